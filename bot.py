@@ -1,9 +1,10 @@
 # bot.py
 import os
 import asyncio
+import contextlib
 import logging
-from typing import Optional, List, Tuple
-from collections import defaultdict
+from datetime import timedelta
+from typing import AsyncIterator, Optional, List, Sequence, Tuple
 
 # ---------------- Django bootstrap ----------------
 import django
@@ -13,42 +14,105 @@ os.environ.setdefault(
 )
 django.setup()
 
-from django.db import transaction
-from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db import models  # F и Max — через models.: F занят фильтрами aiogram
+from django.utils import timezone
 
 # ---- Модели (у тебя app: eflab) ----
 from eflab.models import Survey, Question, Client, Answer, Mark  # поля см. твои модели :contentReference[oaicite:1]{index=1}
-from eflab.models import SurveyGift
+from eflab.models import SurveyGift, SurveySession, AnswerMark, Broadcast
+from eflab.survey_cache import survey_cache
+from eflab.selection_store import build_selection_store
+from eflab.db_executor import db_async, get_db_executor
+from eflab.answer_outbox import AnswerOutbox
+from eflab.client_cache import ClientCache
+from eflab import aggregates, broadcasts, partitions, reminders
 # ---------------- Aiogram 3.7+ ----------------
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from aiogram.filters import CommandStart, Command
 from aiogram.types import (
     Message, CallbackQuery,
     InlineKeyboardMarkup, InlineKeyboardButton,
-    FSInputFile,
+    FSInputFile, Update,
 )
 
 import os.path
 
+from tgbot import codec
+from tgbot.middlewares import DropDuplicateUpdates, PerUserMailbox
+from tgbot.sender import SendScheduler, SendSchedulerMiddleware, TokenBucket, bulk_priority
+
 # ---------------- Логирование ----------------
 logging.basicConfig(level=logging.INFO)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise RuntimeError("Set BOT_TOKEN in environment (BOT_TOKEN=...)")
 
+# номер воркера в вебхук-режиме (tgbot/webhook.py); в поллинге — пусто
+WORKER_INDEX = os.getenv("BOT_WORKER_INDEX", "")
+# сколько процессов шлёт от имени бота: лимиты Telegram на бота целиком,
+# поэтому общие скорости (SEND_GLOBAL_RATE, BROADCAST_RATE) делим поровну
+WORKER_COUNT = max(1, int(os.getenv("BOT_WORKERS", "1"))) if WORKER_INDEX else 1
+
+# TELEGRAM_API_URL — свой Bot API сервер (локально: python -m tgbot.fake_telegram)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 bot = Bot(
     BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 dp = Dispatcher()
 
+# Все исходящие запросы — через планировщик с лимитами Telegram (tgbot/sender.py).
+# SEND_GLOBAL_RATE — на бота целиком (~30 сообщений/с), воркеру — его доля;
+# лимит на чат делить не нужно: чат всегда обслуживает один воркер
+send_scheduler = SendScheduler(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", "30")) / WORKER_COUNT,
+    per_chat_rate=float(os.getenv("SEND_PER_CHAT_RATE", "1")),
+    per_chat_burst=float(os.getenv("SEND_PER_CHAT_BURST", "3")),
+    max_retries=int(os.getenv("SEND_MAX_RETRIES", "3")),
+)
+bot.session.middleware(SendSchedulerMiddleware(send_scheduler))
+
+# повторно доставленные апдейты (тот же update_id) — отбрасываем до хендлеров
+dp.update.outer_middleware(DropDuplicateUpdates())
+# апдейты одного пользователя — по очереди, разных — параллельно
+user_mailbox = PerUserMailbox(max_depth=int(os.getenv("USER_MAILBOX_DEPTH", "10")))
+dp.update.outer_middleware(user_mailbox)
+
+# =======================================================
+# ================  ПАМЯТЬ ДЛЯ МУЛЬТИВЫБОРА  ============
+# =======================================================
+# (tg_id, question_id) -> set выбранных вариантов; бэкенд — SELECTION_STORE.
+# Нужна только для клавиатур старого формата multi:…, новые (tgbot/codec.py)
+# носят выбор в callback_data.
+selections = build_selection_store()
+
 # =======================================================
-# ========  ПАМЯТЬ ДЛЯ МУЛЬТИВЫБОРА (в процессе)  =======
+# ==========  ЗАПИСЬ ОТВЕТОВ (sync / outbox)  ===========
 # =======================================================
-# selections[user_id][question_id] = set of selected options
-selections: dict[int, dict[int, set[str]]] = defaultdict(lambda: defaultdict(set))
+# ANSWER_WRITE_MODE=outbox — ответы пишутся в локальный журнал и
+# сбрасываются в БД пачками (eflab/answer_outbox.py)
+answer_outbox: Optional[AnswerOutbox] = None
+if settings.ANSWER_WRITE_MODE == "outbox":
+    # у каждого воркера свой журнал: пользователь всегда попадает в один воркер
+    answer_outbox = AnswerOutbox(
+        settings.ANSWER_OUTBOX_PATH + (f".w{WORKER_INDEX}" if WORKER_INDEX else ""),
+        batch_size=settings.ANSWER_OUTBOX_BATCH,
+        flush_interval=settings.ANSWER_OUTBOX_INTERVAL,
+    )
+
+client_cache = ClientCache(
+    ttl=float(os.getenv("CLIENT_CACHE_TTL", "300")),
+    max_entries=int(os.getenv("CLIENT_CACHE_MAX", "50000")),
+    flush_interval=float(os.getenv("CLIENT_CACHE_FLUSH_INTERVAL", "5")),
+)
 
 # =======================================================
 # ==============   СИНХРОННЫЕ ORM ФУНКЦИИ   =============
@@ -58,109 +122,350 @@ def _get_or_create_client_sync(tg_id: int, username: str, full_name: str) -> Cli
     """
     Создаём/находим клиента по tg_id (unique); обновляем acc_tg при изменении username.
     Client: name, acc_tg, email, phone, tg_id.  :contentReference[oaicite:2]{index=2}
+    Через кэш eflab/client_cache.py: в БД — только при промахе, acc_tg пишется пачкой.
     """
-    name = (full_name or "").strip() or username or str(tg_id)
-    acc = f"@{username}" if username else str(tg_id)
-    client, _ = Client.objects.get_or_create(
-        tg_id=tg_id,
-        defaults={"name": name[:100], "acc_tg": acc, "email": "", "phone": ""},
-    )
-    if client.acc_tg != acc:
-        client.acc_tg = acc
-        client.save(update_fields=["acc_tg"])
-    return client
+    return client_cache.get_or_create(tg_id, username, full_name)
 
 
 def _get_survey_by_slug_or_first_active_sync(slug: Optional[str]) -> Optional[Survey]:
     """
     Survey: slug, name, active, hello_text ...  :contentReference[oaicite:3]{index=3}
+    Берётся из кэша структуры (eflab/survey_cache.py).
     """
-    qs = Survey.objects.filter(active=True)
-    if slug:
-        s = qs.filter(slug=slug).first()
-        if s:
-            return s
-    return qs.first()
+    return survey_cache.get_survey(slug)
 
 
 def _list_active_surveys_sync() -> List[Tuple[str, str]]:
     """[(name, slug)] всех активных опросов."""
-    return list(Survey.objects.filter(active=True).values_list("name", "slug"))
+    return survey_cache.list_active()
 
 
-def _answered_qids_sync(client: Client, survey: Survey) -> set[int]:
+def _survey_questions_sync(survey: Survey) -> Tuple[Question, ...]:
+    """Вопросы опроса по порядку numb (из кэша, для неактивного — из БД)."""
+    if survey_cache.snapshot(survey.id) is not None:
+        return survey_cache.questions(survey.id)
+    return tuple(Question.objects.filter(survey=survey).order_by("numb"))
+
+
+def _answered_qids_sync(client: Client, survey: Survey, attempt: int) -> set[int]:
     return set(
-        Answer.objects.filter(client_id=client, que__survey=survey)
+        Answer.objects.filter(client_id=client, que__survey=survey, attempt=attempt)
         .values_list("que_id", flat=True)
     )
 
 
-def _next_question_sync(client: Client, survey: Survey) -> Optional[Question]:
+def _last_attempt_sync(client: Client, survey: Survey) -> int:
+    """Последняя попытка по ответам — для клиентов, у которых ещё нет сессии."""
+    last = (
+        Answer.objects.filter(client_id=client, que__survey=survey)
+        .aggregate(m=models.Max("attempt"))["m"]
+    )
+    return last or 1
+
+
+def _question_after(survey: Survey, question: Optional[Question]) -> Optional[Question]:
+    """Следующий по numb вопрос после question (первый, если question=None)."""
+    questions = _survey_questions_sync(survey)
+    if question is None:
+        return questions[0] if questions else None
+    for i, q in enumerate(questions):
+        if q.id == question.id:
+            return questions[i + 1] if i + 1 < len(questions) else None
+    return None
+
+
+def _build_session_fields(client: Client, survey: Survey, attempt: int) -> dict:
+    """Поля курсора по ответам попытки attempt (старые клиенты без сессии, починка курсора)."""
+    done = _answered_qids_sync(client, survey, attempt)
+    nxt = next((q for q in _survey_questions_sync(survey) if q.id not in done), None)
+    return {
+        "current_question": nxt,
+        "answered_count": len(done),
+        "completed_at": timezone.now() if nxt is None else None,
+        "last_activity_at": timezone.now(),
+    }
+
+
+def _get_session_sync(client: Client, survey: Survey, for_update: bool = False) -> SurveySession:
+    qs = SurveySession.objects.filter(client=client, survey=survey)
+    if for_update:
+        qs = qs.select_for_update()
+    session = qs.first()
+    if session is None:
+        attempt = _last_attempt_sync(client, survey)
+        session, _ = SurveySession.objects.get_or_create(
+            client=client, survey=survey,
+            defaults={"attempt": attempt, **_build_session_fields(client, survey, attempt)},
+        )
+    if answer_outbox is not None:
+        answer_outbox.apply_pending(session)
+    return session
+
+
+def _next_question_sync(client: Client, survey: Survey, touch: bool = False) -> Optional[Question]:
     """
     Question: survey, numb (порядок), que_text, type_q, file, kind_file ...  :contentReference[oaicite:4]{index=4}
+    Текущий вопрос берётся из курсора SurveySession.
+    touch=True — пользователь сам открыл опрос, делаем его «текущим».
+    """
+    session = _get_session_sync(client, survey)
+    if touch:
+        SurveySession.objects.filter(pk=session.pk).update(last_activity_at=timezone.now())
+    return _session_question_sync(session)
+
+
+def _session_question_sync(session: SurveySession) -> Optional[Question]:
+    if session.is_completed:
+        return None
+    if session.current_question_id is not None:
+        q = survey_cache.get_question(session.current_question_id)
+        if q is not None and q.survey_id == session.survey_id:
+            return q
+    # вопрос удалили из админки — чиним курсор по ответам
+    fields = _build_session_fields(session.client, session.survey, session.attempt)
+    SurveySession.objects.filter(pk=session.pk).update(**fields)
+    return fields["current_question"]
+
+
+def _resolve_pending_sync(client: Client) -> Tuple[Optional[Survey], Optional[Question]]:
+    """
+    (опрос, ожидающий ответа вопрос) для свободного текста.
+    Один индексный запрос по незавершённым сессиям (session_open_idx);
+    если открытых нет — первый активный опрос, который клиент ещё не начинал.
     """
-    done = _answered_qids_sync(client, survey)
-    return (
-        Question.objects
-        .filter(survey=survey)
-        .order_by("numb")
-        .exclude(id__in=done)
+    active = survey_cache.active_surveys()
+    if not active:
+        return None, None
+    by_id = {s.id: s for s in active}
+
+    session = (
+        SurveySession.objects
+        .filter(client=client, completed_at__isnull=True, survey_id__in=by_id)
+        .order_by("-last_activity_at")
         .first()
     )
+    if answer_outbox is not None:
+        session = _prefer_pending_session(client, session, by_id)
+    if session is not None:
+        session.client = client
+        session.survey = by_id[session.survey_id]
+        q = _session_question_sync(session)
+        if q is not None:
+            return session.survey, q
+
+    started = set(SurveySession.objects.filter(client=client).values_list("survey_id", flat=True))
+    survey = next((s for s in active if s.id not in started), active[0])
+    return survey, _next_question_sync(client, survey)
+
+
+def _prefer_pending_session(client: Client, session: Optional[SurveySession], by_id: dict) -> Optional[SurveySession]:
+    """В режиме outbox курсор в БД может отставать — учитываем принятые, но не сброшенные ответы."""
+    if session is not None:
+        answer_outbox.apply_pending(session)
+    candidates = [session] if session is not None and not session.is_completed else []
+    for survey_id, state in answer_outbox.pending_sessions(client.id):
+        if survey_id in by_id and state.completed_at is None:
+            candidates.append(_get_session_sync(client, by_id[survey_id]))
+    return max(candidates, key=lambda x: x.last_activity_at, default=None)
 
 
 def _progress_text_sync(client: Client, survey: Survey) -> str:
-    total = Question.objects.filter(survey=survey).count()
-    done = len(_answered_qids_sync(client, survey))
+    total = len(_survey_questions_sync(survey))
+    done = _get_session_sync(client, survey).answered_count
     return f"Прогресс: {done}/{total}"
 
 
 def _get_question_by_id_sync(qid: int) -> Optional[Question]:
-    return Question.objects.select_related("survey").filter(id=qid).first()
+    return survey_cache.get_question(qid)
 
 
 def _get_marks_for_question_sync(q: Question) -> List[Mark]:
     """
     Mark: mark_text, que -> Question  :contentReference[oaicite:5]{index=5}
     """
-    return list(Mark.objects.filter(que=q))
+    return survey_cache.get_marks(q.id)
+
+
+# INSERT ответа (+ выбранные варианты мультивыбора) + сдвиг курсора одним
+# запросом (Postgres). Повторный ответ на тот же вопрос в той же попытке ничего
+# не пишет и курсор не двигает: NOT EXISTS по answer_client_que_idx (таблица
+# секционирована, uniq_answer_client_que_attempt есть только у legacy-секции,
+# см. eflab/partitions.py) + ON CONFLICT DO NOTHING по
+# уникальным индексам, какие есть. Ответ пишется, только если вопрос — текущий
+# в курсоре: нажатие старой кнопки (прошлая попытка, вопрос впереди) не должно
+# занять место будущего ответа. Курсор берётся FOR UPDATE: NOT EXISTS не видит
+# незакоммиченный параллельный ответ, а месячные секции уникального индекса не
+# имеют — второй запрос ждёт первый и видит уже сдвинутый курсор.
+SAVE_ANSWER_SQL = """
+WITH sess AS (
+    SELECT id, attempt, current_question_id
+    FROM {session}
+    WHERE client_id = %(client)s AND survey_id = %(survey)s
+    FOR UPDATE
+), ins AS (
+    INSERT INTO {answer} (client_tg_acc, que_id, ans, date, client_id_id, attempt)
+    SELECT %(acc)s, %(que)s, %(ans)s, now(), %(client)s, sess.attempt
+    FROM sess
+    WHERE sess.current_question_id = %(que)s
+      AND NOT EXISTS (
+        SELECT 1 FROM {answer} a
+        WHERE a.client_id_id = %(client)s AND a.que_id = %(que)s AND a.attempt = sess.attempt
+    )
+    ON CONFLICT DO NOTHING
+    RETURNING id
+), opts AS (
+    INSERT INTO {answer_mark} (answer_id, mark_id)
+    SELECT ins.id, m.id FROM ins JOIN {mark} m ON m.id = ANY(%(marks)s::bigint[])
+), upd AS (
+    UPDATE {session} s SET
+        current_question_id = %(next)s,
+        answered_count = s.answered_count + 1,
+        completed_at = CASE WHEN %(next)s IS NULL THEN now() ELSE NULL END,
+        last_activity_at = now()
+    FROM sess
+    WHERE s.id = sess.id
+      AND EXISTS (SELECT 1 FROM ins)
+)
+SELECT id FROM ins
+""".format(
+    session=SurveySession._meta.db_table,
+    answer=Answer._meta.db_table,
+    answer_mark=AnswerMark._meta.db_table,
+    mark=Mark._meta.db_table,
+)
 
 
-def _save_answer_sync(client: Client, question: Question, value: str) -> Answer:
+def _save_answer_sync(client: Client, question: Question, value: str,
+                      mark_ids: Sequence[int] = ()) -> Optional[Answer]:
     """
     Answer: client_tg_acc, que, ans, date(auto_now_add), client_id -> Client  :contentReference[oaicite:6]{index=6}
+    mark_ids — выбранные варианты one_of_some (пишутся в AnswerMark).
+    None — вопрос не текущий в курсоре: уже отвечен (двойной клик, повтор апдейта)
+    или это кнопка прошлой попытки. Курсора ещё нет (клавиатура отправлена
+    до появления SurveySession) — создаём его по ответам, как /start.
     """
+    if answer_outbox is not None:
+        return _journal_answer_sync(client, question, value, mark_ids)
+
+    if connection.vendor == "postgresql":
+        nxt = _question_after(question.survey, question)
+        params = {
+            "client": client.id,
+            "survey": question.survey_id,
+            "acc": client.acc_tg,
+            "que": question.id,
+            "ans": value,
+            "next": nxt.id if nxt else None,
+            "marks": list(mark_ids),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(SAVE_ANSWER_SQL, params)
+            row = cursor.fetchone()
+            if row is None and not SurveySession.objects.filter(client=client, survey_id=question.survey_id).exists():
+                _get_session_sync(client, question.survey)
+                cursor.execute(SAVE_ANSWER_SQL, params)
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        return Answer(id=row[0], client_tg_acc=client.acc_tg, que=question, ans=value, client_id=client)
+
     with transaction.atomic():
-        return Answer.objects.create(
-            client_tg_acc=client.acc_tg,
-            que=question,
-            ans=value,
-            client_id=client,
+        session = _get_session_sync(client, question.survey, for_update=True)
+        if session.current_question_id != question.id:
+            # уже отвечен или не текущий (кнопка прошлой попытки) — не пишем
+            return None
+        answer, created = Answer.objects.get_or_create(
+            client_id=client, que=question, attempt=session.attempt,
+            defaults={"client_tg_acc": client.acc_tg, "ans": value},
         )
+        if not created:
+            return None
+        if mark_ids:
+            alive = Mark.objects.filter(id__in=mark_ids).values_list("id", flat=True)
+            AnswerMark.objects.bulk_create([AnswerMark(answer=answer, mark_id=m) for m in alive])
+        _advance_session(session, question)
+        session.save(update_fields=["current_question", "answered_count", "completed_at", "last_activity_at"])
+        return answer
+
+
+def _advance_session(session: SurveySession, question: Question) -> None:
+    # двигаем курсор, только если ответили на текущий вопрос
+    if session.current_question_id == question.id:
+        nxt = _question_after(question.survey, question)
+        session.current_question = nxt
+        session.answered_count += 1
+        if nxt is None:
+            session.completed_at = timezone.now()
+    session.last_activity_at = timezone.now()
+
+
+def _journal_answer_sync(client: Client, question: Question, value: str,
+                         mark_ids: Sequence[int] = ()) -> Optional[Answer]:
+    """Режим outbox: ответ и новый курсор — в локальный журнал, в БД позже пачкой."""
+    session = _get_session_sync(client, question.survey)
+    if session.current_question_id != question.id:
+        # уже отвечен (или не текущий) — дубль, в журнал не пишем
+        return None
+    answer = Answer(
+        client_tg_acc=client.acc_tg, que=question, ans=value, client_id=client, attempt=session.attempt
+    )
+    _advance_session(session, question)
+    answer_outbox.append(answer, question.survey_id, session, mark_ids)
+    return answer
 
 def _get_gift_sync(survey: Survey):
-    return SurveyGift.objects.filter(survey=survey).first()
+    return survey_cache.get_gift(survey.id)
 
-def _delete_answers_for_client_survey_sync(client: Client, survey: Survey) -> int:
-    """Удалить все ответы пользователя по конкретному опросу (для ретейка)."""
-    qs = Answer.objects.filter(client_id=client, que__survey=survey)
-    count = qs.count()
-    qs.delete()
-    return count
+def _store_file_id_sync(model, pk: int, file_key: Optional[str], file_id: str) -> None:
+    """
+    Запомнить file_id. Условие по tg_file_key — если файл уже заменили
+    в админке, чужой file_id не запишется. update() не шлёт сигналы,
+    поэтому кэш структуры не пересобирается.
+    """
+    model.objects.filter(pk=pk, tg_file_key=file_key).update(tg_file_id=file_id)
+
+
+def _restart_survey_sync(client: Client, survey: Survey) -> int:
+    """
+    Ретейк: новая попытка вместо удаления ответов. Курсор — на первый вопрос,
+    счётчик попытки +1; ответы прошлых попыток остаются в истории
+    (чистит/архивирует их manage.py purge_old_attempts). Возвращает номер попытки.
+    """
+    session = _get_session_sync(client, survey)
+    now = timezone.now()
+    SurveySession.objects.filter(pk=session.pk).update(
+        attempt=models.F("attempt") + 1,
+        current_question=_question_after(survey, None),
+        answered_count=0,
+        started_at=now,
+        completed_at=None,
+        last_activity_at=now,
+        reminder_sent_at=None,
+    )
+    return session.attempt + 1
 
 
 
 # ===== async-обёртки над ORM =====
-aget_or_create_client = sync_to_async(_get_or_create_client_sync, thread_sensitive=True)
-aget_survey = sync_to_async(_get_survey_by_slug_or_first_active_sync, thread_sensitive=True)
-alist_active_surveys = sync_to_async(_list_active_surveys_sync, thread_sensitive=True)
-a_next_question = sync_to_async(_next_question_sync, thread_sensitive=True)
-a_progress_text = sync_to_async(_progress_text_sync, thread_sensitive=True)
-a_get_question = sync_to_async(_get_question_by_id_sync, thread_sensitive=True)
-a_get_marks = sync_to_async(_get_marks_for_question_sync, thread_sensitive=True)
-a_save_answer = sync_to_async(_save_answer_sync, thread_sensitive=True)
-a_delete_answers = sync_to_async(_delete_answers_for_client_survey_sync, thread_sensitive=True)
-a_get_gift = sync_to_async(_get_gift_sync, thread_sensitive=True)
+async def aget_or_create_client(tg_id: int, username: str, full_name: str) -> Client:
+    # попадание в кэш отдаём прямо из event loop, без похода в пул БД
+    client = client_cache.lookup(tg_id, username, full_name)
+    if client is None:
+        client = await get_db_executor().run(client_cache.load, tg_id, username, full_name)
+    return client
+
+
+aget_survey = db_async(_get_survey_by_slug_or_first_active_sync)
+alist_active_surveys = db_async(_list_active_surveys_sync)
+a_next_question = db_async(_next_question_sync)
+a_resolve_pending = db_async(_resolve_pending_sync)
+a_progress_text = db_async(_progress_text_sync)
+a_get_question = db_async(_get_question_by_id_sync)
+a_get_marks = db_async(_get_marks_for_question_sync)
+a_save_answer = db_async(_save_answer_sync)
+a_restart_survey = db_async(_restart_survey_sync)
+a_get_gift = db_async(_get_gift_sync)
+a_store_file_id = db_async(_store_file_id_sync)
 
 
 # =======================================================
@@ -173,20 +478,22 @@ def kb_yes_no(prefix: str, payload: str) -> InlineKeyboardMarkup:
     ]])
 
 
-def kb_multi(question_id: int, options: List[str], chosen: set[str]) -> InlineKeyboardMarkup:
-    """Мультивыбор: чекбоксы + Готово/Пропустить."""
+def kb_multi(question_id: int, options: List[str], mask: int) -> InlineKeyboardMarkup:
+    """Мультивыбор: чекбоксы + Готово/Пропустить. Выбор хранится в callback_data (tgbot/codec.py)."""
+    tag = codec.options_tag(options)
+
+    def data(action: str, index: int = 0) -> str:
+        return codec.MultiPayload(question_id, tag, mask, action, index).encode()
+
     rows = []
-    for opt in options:
-        checked = "✅ " if opt in chosen else "▫️ "
+    for i, opt in enumerate(options):
+        checked = "✅ " if mask >> i & 1 else "▫️ "
         rows.append([
-            InlineKeyboardButton(
-                text=f"{checked}{opt[:48]}",
-                callback_data=f"multi:{question_id}:toggle:{opt}"
-            )
+            InlineKeyboardButton(text=f"{checked}{opt[:48]}", callback_data=data(codec.TOGGLE, i))
         ])
     rows.append([
-        InlineKeyboardButton(text="Готово", callback_data=f"multi:{question_id}:done"),
-        InlineKeyboardButton(text="Пропустить", callback_data=f"multi:{question_id}:skip"),
+        InlineKeyboardButton(text="Готово", callback_data=data(codec.DONE)),
+        InlineKeyboardButton(text="Пропустить", callback_data=data(codec.SKIP)),
     ])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
@@ -210,122 +517,188 @@ def kb_in_survey(slug: str, show_menu: bool) -> InlineKeyboardMarkup:
 # =======================================================
 # ================  ОТПРАВКА ВОПРОСА  ===================
 # =======================================================
-async def send_question(msg: Message, survey: Survey, q: Question):
-    header = f"<b>Вопрос {q.numb}</b>\n{q.que_text or ''}".strip()
+# RENDER_MODE=compact (по умолчанию) — шаг опроса одним сообщением;
+# RENDER_MODE=legacy — заголовок, подсказка и «Ответ записан» отдельно.
+COMPACT_RENDER = os.getenv("RENDER_MODE", "compact").lower() != "legacy"
+CAPTION_LIMIT = 1024  # лимит Telegram на подпись к медиа
 
-    sent = False
+def _sent_file_id(sent: Message) -> Optional[str]:
+    """file_id из ответа Telegram (фото — самый большой размер)."""
+    if sent.photo:
+        return sent.photo[-1].file_id
+    for media in (sent.video, sent.audio, sent.animation, sent.document):
+        if media:
+            return media.file_id
+    return None
 
-    if q.file:
+
+async def send_cached_file(msg: Message, obj, kind: Optional[str], caption: Optional[str], **kwargs) -> bool:
+    return await send_cached_file_to(msg.chat.id, obj, kind, caption, **kwargs)
+
+
+async def send_cached_file_to(chat_id: int, obj, kind: Optional[str], caption: Optional[str], **kwargs) -> bool:
+    """
+    Отправить obj.file (Question / SurveyGift / Broadcast) в чат нужным методом.
+    Если есть сохранённый tg_file_id — шлём по нему без загрузки файла,
+    если Telegram его не принял — загружаем с диска и запоминаем новый.
+    """
+    senders = {
+        "photo": bot.send_photo,
+        "video": bot.send_video,
+        "audio": bot.send_audio,
+    }
+    method = senders.get((kind or "document").lower(), bot.send_document)
+
+    async def send(file, **kw):
+        return await method(chat_id, file, **kw)
+
+    if obj.tg_file_id:
         try:
-            # Всегда используем путь до файла внутри контейнера
-            if hasattr(q.file, "path") and os.path.exists(q.file.path):
-                f = FSInputFile(q.file.path)
-
-                kind = (q.kind_file or "document").lower()
-
-                if kind == "photo":
-                    await msg.answer_photo(f, caption=header)
-                elif kind == "video":
-                    await msg.answer_video(f, caption=header)
-                elif kind == "audio":
-                    await msg.answer_audio(f, caption=header)
-                else:
-                    await msg.answer_document(f, caption=header)
-
-                sent = True
-            else:
-                print("Файл вопроса не найден на диске:", q.file)
-        except Exception as e:
-            print("Ошибка отправки файла вопроса:", e)
+            await send(obj.tg_file_id, caption=caption, **kwargs)
+            return True
+        except TelegramBadRequest as e:
+            logging.warning("file_id %s отклонён (%s), загружаем файл заново", obj.tg_file_id, e)
+            obj.tg_file_id = None
+
+    # Всегда используем путь до файла внутри контейнера
+    if not (hasattr(obj.file, "path") and os.path.exists(obj.file.path)):
+        logging.warning("Файл не найден на диске: %s", obj.file)
+        return False
+
+    sent = await send(FSInputFile(obj.file.path), caption=caption, **kwargs)
+    file_id = _sent_file_id(sent)
+    if file_id:
+        obj.tg_file_id = file_id
+        await a_store_file_id(type(obj), obj.pk, obj.tg_file_key, file_id)
+    return True
 
-    if not sent:
-        await msg.answer(header)
 
-    # тип вопроса — кнопки / текст
+def join_text(*parts: Optional[str]) -> str:
+    return "\n\n".join(p for p in parts if p)
+
+
+async def question_prompt(msg: Message, q: Question) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Подсказка и клавиатура под вопросом в зависимости от типа."""
     typeq = (q.type_q or "").lower()
 
     if typeq == "yes_or_no":
-        await msg.answer("Ваш ответ:", reply_markup=kb_yes_no("ans_yn", str(q.id)))
+        return "Ваш ответ:", kb_yes_no("ans_yn", str(q.id))
 
-    elif typeq == "one_of_some":
+    if typeq == "one_of_some":
         marks = await a_get_marks(q)
         options = [m.mark_text for m in marks] if marks else []
+        return "Выберите варианты (можно несколько):", kb_multi(q.id, options, 0)
 
-        selections[msg.from_user.id][q.id] = selections[msg.from_user.id].get(q.id, set())
+    return "Напишите ответ текстом:", None
 
-        await msg.answer(
-            "Выберите варианты (можно несколько):",
-            reply_markup=kb_multi(q.id, options, selections[msg.from_user.id][q.id])
-        )
 
-    else:
-        await msg.answer("Напишите ответ текстом:")
+async def send_question(msg: Message, survey: Survey, q: Question, preface: Optional[str] = None):
+    """
+    preface — текст перед вопросом («Ответ записан…», приветствие).
+    В компактном режиме всё уходит одним сообщением: preface + вопрос +
+    подсказка с клавиатурой (для файла — в подписи). В режиме legacy —
+    как раньше, отдельными сообщениями.
+    """
+    header = f"<b>Вопрос {q.numb}</b>\n{q.que_text or ''}".strip()
+    prompt, markup = await question_prompt(msg, q)
+
+    if not COMPACT_RENDER:
+        if preface:
+            await msg.answer(preface)
+        await _send_question_legacy(msg, q, header, prompt, markup)
+        return
+
+    text = join_text(preface, header, prompt)
+    if q.file:
+        fits = len(text) <= CAPTION_LIMIT
+        try:
+            sent = await send_cached_file(
+                msg, q, q.kind_file,
+                text if fits else header[:CAPTION_LIMIT],
+                reply_markup=markup if fits else None,
+            )
+        except Exception as e:
+            logging.exception("Ошибка отправки файла вопроса: %s", e)
+            sent = False
+        if sent and fits:
+            return
+        if sent:
+            text = join_text(preface, prompt)
+
+    await msg.answer(text, reply_markup=markup)
+
+
+async def _send_question_legacy(msg: Message, q: Question, header: str, prompt: str,
+                                markup: Optional[InlineKeyboardMarkup]):
+    sent = False
+
+    if q.file:
+        try:
+            sent = await send_cached_file(msg, q, q.kind_file, header)
+        except Exception as e:
+            logging.exception("Ошибка отправки файла вопроса: %s", e)
+
+    if not sent:
+        await msg.answer(header)
 
+    await msg.answer(prompt, reply_markup=markup)
 
 
-async def ask_next_or_finish(msg: Message, client: Client, survey: Survey, from_answer: bool = False):
+async def ask_next_or_finish(msg: Message, client: Client, survey: Survey, from_answer: bool = False,
+                             preface: Optional[str] = None):
     """
     Показывает следующий вопрос или завершает опрос.
     Подарок выдаётся ТОЛЬКО если вызов был после ответа (from_answer=True).
+    preface — текст, который нужно показать перед этим шагом (см. send_question).
     """
 
     # 1. Ищем следующий вопрос
-    q = await a_next_question(client, survey)
+    q = await a_next_question(client, survey, touch=not from_answer)
 
     # ---------------------------------------
     # 2. Если вопрос найден → задаём его
     # ---------------------------------------
     if q:
-        await send_question(msg, survey, q)
+        await send_question(msg, survey, q, preface=preface)
         return
 
     # ---------------------------------------
     # 3. ВОПРОСОВ НЕТ — ОПРОС ЗАКОНЧЕН
     # ---------------------------------------
+    if preface and not COMPACT_RENDER:
+        await msg.answer(preface)
+        preface = None
+
+    items = await alist_active_surveys()
+    show_menu = len(items) > 1
+    menu = kb_in_survey(survey.slug, show_menu)
 
     # Если функция вызвана НЕ после ответа — НЕ выдаём подарок
     if not from_answer:
-        items = await alist_active_surveys()
-        show_menu = len(items) > 1
-
-        await msg.answer(
-            f"Вы уже проходили опрос «{survey.name}».",
-            reply_markup=kb_in_survey(survey.slug, show_menu)
-        )
+        await msg.answer(join_text(preface, f"Вы уже проходили опрос «{survey.name}»."), reply_markup=menu)
         return
 
     # Если вызов после ответа — теперь можно выдавать подарок
     gift = await a_get_gift(survey)
+    finished = f"Вы закончили опрос «{survey.name}»!"
 
     if gift and gift.file:
+        caption = gift.caption or "Спасибо за прохождение! 🎁"
+        full = join_text(preface, caption, finished)
         try:
-            if hasattr(gift.file, "path") and os.path.exists(gift.file.path):
-                f = FSInputFile(gift.file.path)
-                caption = gift.caption or "Спасибо за прохождение! 🎁"
-
-                name = gift.file.name.lower()
-                if name.endswith((".png", ".jpg", ".jpeg", ".gif", ".webp")):
-                    await msg.answer_photo(f, caption=caption)
-                elif name.endswith((".mp4", ".mov", ".avi", ".mkv")):
-                    await msg.answer_video(f, caption=caption)
-                elif name.endswith((".mp3", ".aac", ".wav", ".ogg")):
-                    await msg.answer_audio(f, caption=caption)
-                else:
-                    await msg.answer_document(f, caption=caption)
-
+            if COMPACT_RENDER and len(full) <= CAPTION_LIMIT:
+                # подарок, итог и меню — одним сообщением
+                if await send_cached_file(msg, gift, gift.kind_file, full, reply_markup=menu):
+                    return
+            else:
+                await send_cached_file(msg, gift, gift.kind_file, caption)
         except Exception as e:
-            print("Ошибка отправки подарка:", e)
+            logging.exception("Ошибка отправки подарка: %s", e)
 
     # ---------------------------------------
     # 4. Выводим меню после завершения опроса
     # ---------------------------------------
-    items = await alist_active_surveys()
-    show_menu = len(items) > 1
-
-    await msg.answer(
-        f"Вы закончили опрос «{survey.name}»!",
-        reply_markup=kb_in_survey(survey.slug, show_menu)
-    )
+    await msg.answer(join_text(preface, finished), reply_markup=menu)
 
 
 
@@ -352,8 +725,7 @@ async def cmd_start(message: Message):
             await message.answer("Опрос не найден или неактивен. Нажмите /surveys для списка.")
             return
         hello = getattr(survey, "hello_text", None) or f"Привет, {client.name}! Приглашаем пройти опрос «{survey.name}»."
-        await message.answer(hello)
-        await ask_next_or_finish(message, client, survey)   # сразу начинаем
+        await ask_next_or_finish(message, client, survey, preface=hello)   # сразу начинаем
         return
 
     # без slug — смотрим список активных
@@ -366,8 +738,7 @@ async def cmd_start(message: Message):
         only_name, only_slug = items[0]
         survey = await aget_survey(only_slug)
         hello = getattr(survey, "hello_text", None) or f"Привет, {client.name}! Приглашаем пройти опрос «{survey.name}»."
-        await message.answer(hello)
-        await ask_next_or_finish(message, client, survey)
+        await ask_next_or_finish(message, client, survey, preface=hello)
         return
 
     # несколько — покажем меню
@@ -389,8 +760,7 @@ async def cmd_surveys(message: Message):
 
         survey = await aget_survey(only_slug)
         hello = getattr(survey, "hello_text", None) or f"Привет, {client.name}! Приглашаем пройти опрос «{survey.name}»."
-        await message.answer(hello)
-        await ask_next_or_finish(message, client, survey)
+        await ask_next_or_finish(message, client, survey, preface=hello)
         return
 
     await message.answer("Выберите опрос:", reply_markup=kb_surveys(items))
@@ -412,8 +782,7 @@ async def cb_menu_surveys(call: CallbackQuery):
 
         survey = await aget_survey(only_slug)
         hello = getattr(survey, "hello_text", None) or f"Привет, {client.name}! Приглашаем пройти опрос «{survey.name}»."
-        await call.message.answer(hello)
-        await ask_next_or_finish(call.message, client, survey)
+        await ask_next_or_finish(call.message, client, survey, preface=hello)
         return
 
     await call.message.answer("Выберите опрос:", reply_markup=kb_surveys(items))
@@ -462,8 +831,7 @@ async def cb_ready(call: CallbackQuery):
         await call.message.answer("Сейчас нет активных опросов.")
         return
 
-    await call.message.answer(f"Отлично! Начинаем «{survey.name}».")
-    await ask_next_or_finish(call.message, client, survey)
+    await ask_next_or_finish(call.message, client, survey, preface=f"Отлично! Начинаем «{survey.name}».")
 
 
 @dp.message(Command("continue"))
@@ -493,15 +861,35 @@ async def cmd_continue(message: Message):
         await message.answer("Опрос не найден или неактивен.")
         return
 
-    await message.answer(f"Продолжаем «{survey.name}».", reply_markup=kb_in_survey(survey.slug))
+    await message.answer(f"Продолжаем «{survey.name}».", reply_markup=kb_in_survey(survey.slug, False))
     await ask_next_or_finish(message, client, survey)
 
 
+@dp.callback_query(F.data.startswith("resume:"))
+async def cb_resume(call: CallbackQuery):
+    """Кнопка «Продолжить» из напоминания — то же, что /continue <slug>."""
+    _, slug = call.data.split(":", 1)
+    await call.answer()
+
+    tg_id = call.from_user.id
+    username = call.from_user.username or ""
+    full_name = call.from_user.full_name or ""
+    client = await aget_or_create_client(tg_id, username, full_name)
+
+    survey = await aget_survey(slug)
+    if not survey:
+        await call.message.answer("Опрос не найден или неактивен.")
+        return
+
+    await call.message.answer(f"Продолжаем «{survey.name}».", reply_markup=kb_in_survey(survey.slug, False))
+    await ask_next_or_finish(call.message, client, survey)
+
+
 @dp.message(Command("restart"))
 async def cmd_restart(message: Message):
     """
     Полностью начать заново: /restart <slug>
-    Удаляет прошлые ответы пользователя по опросу и стартует с вопроса №1.
+    Новая попытка: старт с вопроса №1, прошлые ответы остаются в истории.
     """
     tg_id = message.from_user.id
     username = message.from_user.username or ""
@@ -519,9 +907,11 @@ async def cmd_restart(message: Message):
         await message.answer("Опрос не найден или неактивен.")
         return
 
-    deleted = await a_delete_answers(client, survey)
-    await message.answer(f"Старые ответы удалены ({deleted}). Начинаем заново «{survey.name}».")
-    await ask_next_or_finish(message, client, survey)
+    attempt = await a_restart_survey(client, survey)
+    await ask_next_or_finish(
+        message, client, survey,
+        preface=f"Начинаем заново «{survey.name}» (попытка {attempt}).",
+    )
 
 
 @dp.callback_query(F.data.startswith("restart:"))
@@ -540,9 +930,19 @@ async def cb_restart(call: CallbackQuery):
         await call.message.answer("Опрос не найден или неактивен.")
         return
 
-    deleted = await a_delete_answers(client, survey)
-    await call.message.answer(f"Старые ответы удалены ({deleted}). Начинаем заново «{survey.name}».")
-    await ask_next_or_finish(call.message, client, survey)
+    attempt = await a_restart_survey(client, survey)
+    await ask_next_or_finish(
+        call.message, client, survey,
+        preface=f"Начинаем заново «{survey.name}» (попытка {attempt}).",
+    )
+
+async def show_current_question(msg: Message, client: Client, survey: Survey):
+    """
+    Ответ не записан — вопрос не текущий: двойное нажатие, кнопка старой
+    клавиатуры или прошлой попытки. Говорим об этом и показываем текущий.
+    """
+    await ask_next_or_finish(msg, client, survey, preface="Этот вопрос уже неактуален.")
+
 
 # ---------- Да/Нет ----------
 @dp.callback_query(F.data.startswith("ans_yn:"))
@@ -561,16 +961,84 @@ async def cb_ans_yesno(call: CallbackQuery):
     client = await aget_or_create_client(tg_id, username, full_name)
 
     val = "Да" if yn == "yes" else "Нет"
-    await a_save_answer(client, q, val)
+    if await a_save_answer(client, q, val) is None:
+        await show_current_question(call.message, client, q.survey)
+        return
 
-    await call.message.answer(f"Ответ записан: <b>{val}</b>")
-    await ask_next_or_finish(call.message, client, q.survey, from_answer=True)
+    await ask_next_or_finish(call.message, client, q.survey, from_answer=True, preface=f"Ответ записан: <b>{val}</b>")
 
 
 # ---------- Мультивыбор (one_of_some) ----------
-@dp.callback_query(F.data.startswith("multi:"))
+async def show_multi_keyboard(call: CallbackQuery, qid: int, options: List[str], mask: int):
+    try:
+        await call.message.edit_reply_markup(reply_markup=kb_multi(qid, options, mask))
+    except TelegramBadRequest:
+        await call.message.answer("Обновлён выбор:", reply_markup=kb_multi(qid, options, mask))
+
+
+def multi_value(texts) -> str:
+    """Текст ответа мультивыбора для Answer.ans (варианты по алфавиту через «; »)."""
+    return "; ".join(sorted(texts))
+
+
+async def save_multi_answer(call: CallbackQuery, q: Question, value: str, mark_ids: Sequence[int] = ()):
+    tg_id = call.from_user.id
+    username = call.from_user.username or ""
+    full_name = call.from_user.full_name or ""
+    client = await aget_or_create_client(tg_id, username, full_name)
+
+    if await a_save_answer(client, q, value, mark_ids) is None:
+        await show_current_question(call.message, client, q.survey)
+        return
+    shown = value if value else "<i>пропуск</i>"
+
+    # ПЕРЕХОД НА СЛЕДУЮЩИЙ ВОПРОС — отмечаем from_answer=True
+    await ask_next_or_finish(call.message, client, q.survey, from_answer=True,
+                             preface=f"Ответ записан: {shown}")
+
+
+@dp.callback_query(F.data.startswith(f"{codec.PREFIX}:"))
 async def cb_multi(call: CallbackQuery):
-    # data: multi:<qid>:(toggle|done|skip)[:<value>]
+    """Компактный формат: выбор приходит в payload, варианты — из кэша структуры."""
+    payload = codec.decode(call.data)
+    if payload is None:
+        await call.answer()
+        return
+
+    q = await a_get_question(payload.question_id)
+    if not q:
+        await call.answer()
+        await call.message.answer("Вопрос не найден.")
+        return
+
+    marks = await a_get_marks(q)
+    options = [m.mark_text for m in marks] if marks else []
+
+    # варианты поменяли в админке — индексы в кнопках уже не те
+    if payload.tag != codec.options_tag(options):
+        await call.answer("Варианты ответа изменились, выберите заново.")
+        await show_multi_keyboard(call, q.id, options, 0)
+        return
+
+    await call.answer()
+
+    # --- toggle (переключение вариантов)
+    if payload.action == codec.TOGGLE:
+        if payload.index < len(options):
+            await show_multi_keyboard(call, q.id, options, payload.toggled())
+        return
+
+    # --- сохраняем ответ (skip или done) ---
+    chosen = payload.chosen(marks or []) if payload.action == codec.DONE else []
+    await save_multi_answer(call, q, multi_value(m.mark_text for m in chosen), [m.id for m in chosen])
+
+
+@dp.callback_query(F.data.startswith("multi:"))
+async def cb_multi_legacy(call: CallbackQuery):
+    """
+    Старый формат multi:<qid>:(toggle|done|skip)[:<value>] — для клавиатур,
+    отправленных до перехода на компактный; выбор лежит в хранилище selections.
+    """
     parts = call.data.split(":", 3)
     _, qid_s, action, *rest = parts
     qid = int(qid_s)
@@ -582,56 +1050,21 @@ async def cb_multi(call: CallbackQuery):
         return
 
     user_id = call.from_user.id
-    chosen = selections[user_id][qid]
 
-    # --- toggle (переключение вариантов)
+    # --- toggle: переключаем и переводим клавиатуру на компактный формат
     if action == "toggle":
         value = rest[0] if rest else ""
-        if value in chosen:
-            chosen.remove(value)
-        else:
-            chosen.add(value)
+        chosen = await selections.toggle(user_id, qid, value)
 
         marks = await a_get_marks(q)
         options = [m.mark_text for m in marks] if marks else []
-
-        try:
-            await call.message.edit_reply_markup(
-                reply_markup=kb_multi(qid, options, chosen)
-            )
-        except:
-            await call.message.answer(
-                "Обновлён выбор:",
-                reply_markup=kb_multi(qid, options, chosen)
-            )
+        await show_multi_keyboard(call, qid, options, codec.mask_of(options, chosen))
         return
 
-    # --- сохраняем ответ (skip или done) ---
-    tg_id = call.from_user.id
-    username = call.from_user.username or ""
-    full_name = call.from_user.full_name or ""
-    client = await aget_or_create_client(tg_id, username, full_name)
-
-    # Пропуск
-    if action == "skip":
-        await a_save_answer(client, q, "")
-        selections[user_id].pop(qid, None)
-        await call.message.answer("Ответ записан: <i>пропуск</i>")
-        await ask_next_or_finish(call.message, client, q.survey, from_answer=True)
-        return
-
-    # Done: сохраняем выбранные значения
-    if action == "done":
-        value = "; ".join(sorted(chosen)) if chosen else ""
-        await a_save_answer(client, q, value)
-        selections[user_id].pop(qid, None)
-
-        shown = value if value else "<i>пропуск</i>"
-        await call.message.answer(f"Ответ записан: {shown}")
-
-        # ПЕРЕХОД НА СЛЕДУЮЩИЙ ВОПРОС — отмечаем from_answer=True
-        await ask_next_or_finish(call.message, client, q.survey, from_answer=True)
-        return
+    chosen = await selections.get(user_id, qid) if action == "done" else set()
+    await selections.clear(user_id, qid)
+    marks = await a_get_marks(q) if chosen else []
+    await save_multi_answer(call, q, multi_value(chosen), [m.id for m in marks if m.mark_text in chosen])
 
 
 # ---------- Свободный текст как ответ ----------
@@ -642,20 +1075,12 @@ async def msg_text_answer(message: Message):
     full_name = message.from_user.full_name or ""
     client = await aget_or_create_client(tg_id, username, full_name)
 
-    # найдём опрос, где ещё есть неотвеченные вопросы
-    @sync_to_async(thread_sensitive=True)
-    def _find_survey_with_pending(cli: Client) -> Optional[Survey]:
-        for s in Survey.objects.filter(active=True):
-            if _next_question_sync(cli, s) is not None:
-                return s
-        return Survey.objects.filter(active=True).first()
-
-    survey = await _find_survey_with_pending(client)
+    # текущий незавершённый опрос и вопрос — одним запросом
+    survey, q = await a_resolve_pending(client)
     if not survey:
         await message.answer("Сейчас нет активных опросов.")
         return
 
-    q = await a_next_question(client, survey)
     if q is None:
         items = await alist_active_surveys()
         show_menu = len(items) > 1
@@ -670,14 +1095,268 @@ async def msg_text_answer(message: Message):
         await message.answer("Пустой ответ не сохранён, повторите, пожалуйста.")
         return
 
-    await a_save_answer(client, q, txt)
-    await message.answer("Ответ записан.")
-    await ask_next_or_finish(message, client, survey, from_answer=True)
+    if await a_save_answer(client, q, txt) is None:
+        await show_current_question(message, client, survey)
+        return
+    await ask_next_or_finish(message, client, survey, from_answer=True, preface="Ответ записан.")
+
+
+# =======================================================
+# =====================  РАССЫЛКИ  ======================
+# =======================================================
+# Рассылки приглашений (eflab/broadcasts.py): берём из очереди и шлём
+# с низким приоритетом (bulk_priority) и своим лимитом BROADCAST_RATE
+# ниже глобального — ответы пользователям всегда идут первыми.
+# BROADCAST_RATE, как и SEND_GLOBAL_RATE, — на бота целиком, воркеру — его доля.
+BROADCAST_INTERVAL = float(os.getenv("BROADCAST_INTERVAL", "10"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20")) / WORKER_COUNT
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_PAGE = int(os.getenv("BROADCAST_PAGE", "100"))
+broadcast_bucket = TokenBucket(BROADCAST_RATE, max(1.0, BROADCAST_RATE))
+
+a_claim_broadcast = db_async(broadcasts.claim_next)
+a_broadcast_page = db_async(broadcasts.next_page)
+a_broadcast_save_page = db_async(broadcasts.save_page)
+a_broadcast_heartbeat = db_async(broadcasts.heartbeat)
+a_broadcast_finish = db_async(broadcasts.finish)
+a_broadcast_release = db_async(broadcasts.release)
+
+
+def kb_invite(bot_username: str, b: Broadcast) -> InlineKeyboardMarkup:
+    # ссылка присылает боту «/start <slug>» — дальше обычный cmd_start
+    url = f"https://t.me/{bot_username}?start={b.survey.slug}"
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=b.button_text, url=url)]])
+
+
+async def send_invitation(b: Broadcast, chat_id: int, markup: InlineKeyboardMarkup) -> None:
+    if b.file and len(b.text) <= CAPTION_LIMIT:
+        if await send_cached_file_to(chat_id, b, b.kind_file, b.text, reply_markup=markup):
+            return
+    elif b.file:
+        await send_cached_file_to(chat_id, b, b.kind_file, None)
+    await bot.send_message(chat_id, b.text, reply_markup=markup)
+
+
+async def _deliver(b: Broadcast, client_id: int, chat_id: int, markup: InlineKeyboardMarkup,
+                   limit: asyncio.Semaphore) -> Tuple[int, str, str]:
+    async with limit:
+        await asyncio.sleep(broadcast_bucket.reserve())
+        try:
+            with bulk_priority():
+                await send_invitation(b, chat_id, markup)
+            return client_id, "sent", ""
+        except TelegramForbiddenError as e:
+            return client_id, "blocked", str(e)[:255]
+        except Exception as e:
+            logging.warning("рассылка #%s: клиент %s — %s", b.pk, client_id, e)
+            return client_id, "failed", str(e)[:255]
+
+
+async def _keep_alive(broadcast_id: int):
+    """Пачка на BROADCAST_RATE может идти дольше STALE_AFTER — отмечаемся, что живы."""
+    interval = broadcasts.HEARTBEAT_EVERY.total_seconds()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await a_broadcast_heartbeat(broadcast_id)
+        except Exception:
+            logging.exception("рассылка #%s: не удалось отметиться", broadcast_id)
+
+
+async def run_broadcast(b: Broadcast):
+    me = await bot.me()
+    markup = kb_invite(me.username, b)
+    limit = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    after = b.last_client_id
+    logging.info("рассылка #%s: старт с клиента id > %s", b.pk, after)
+    try:
+        while True:
+            page = await a_broadcast_page(b, after, BROADCAST_PAGE)
+            if not page:
+                await a_broadcast_finish(b.pk)
+                logging.info("рассылка #%s завершена", b.pk)
+                return
+            results = []
+            if b.file and not b.tg_file_id:
+                # первый получатель загружает файл, остальные пойдут по file_id
+                results.append(await _deliver(b, *page[0], markup, limit))
+                page_rest = page[1:]
+            else:
+                page_rest = page
+            keep_alive = asyncio.create_task(_keep_alive(b.pk))
+            try:
+                results += await asyncio.gather(*(_deliver(b, cid, chat, markup, limit) for cid, chat in page_rest))
+            finally:
+                keep_alive.cancel()
+            after = page[-1][0]
+            if not await a_broadcast_save_page(b.pk, results, after):
+                logging.info("рассылка #%s приостановлена на клиенте id %s", b.pk, after)
+                return
+    except asyncio.CancelledError:
+        # бот останавливается: начатая пачка не записана и при продолжении уйдёт снова
+        await a_broadcast_release(b.pk)
+        raise
+
+
+async def run_broadcasts(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            b = await a_claim_broadcast()
+            if b is not None:
+                await run_broadcast(b)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("рассылки: ошибка, рассылку подхватим после паузы")
+
+
+# =======================================================
+# ====================  НАПОМИНАНИЯ  ====================
+# =======================================================
+# Брошенные на середине опросы (eflab/reminders.py): раз в REMINDER_INTERVAL
+# берём до REMINDER_BATCH курсоров, молчащих дольше REMINDER_AFTER часов,
+# и шлём по одному напоминанию с кнопкой «Продолжить». Лимит — общий
+# с рассылками (broadcast_bucket), приоритет — низкий.
+REMINDER_INTERVAL = float(os.getenv("REMINDER_INTERVAL", "300"))
+REMINDER_AFTER = timedelta(hours=float(os.getenv("REMINDER_AFTER_HOURS", "24")))
+REMINDER_MAX_AGE = timedelta(days=float(os.getenv("REMINDER_MAX_AGE_DAYS", "14")))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "200"))
+
+a_claim_reminders = db_async(reminders.claim_due)
+
+
+def kb_resume(slug: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="Продолжить", callback_data=f"resume:{slug}"),
+    ]])
+
+
+async def send_reminder(session: SurveySession) -> None:
+    await asyncio.sleep(broadcast_bucket.reserve())
+    text = (
+        f"Вы не закончили опрос «{session.survey.name}» (ответов: {session.answered_count}). "
+        "Продолжим с того же места?"
+    )
+    try:
+        with bulk_priority():
+            await bot.send_message(session.client.tg_id, text, reply_markup=kb_resume(session.survey.slug))
+    except TelegramForbiddenError:
+        pass  # бот заблокирован — отметка уже стоит, больше не пытаемся
+    except Exception as e:
+        logging.warning("напоминание: клиент %s, опрос %s — %s", session.client_id, session.survey_id, e)
+
+
+async def run_reminders(interval: float):
+    pending = answer_outbox.apply_pending if answer_outbox is not None else None
+    limit = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def remind(session: SurveySession):
+        async with limit:
+            await send_reminder(session)
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while True:
+                due = await a_claim_reminders(REMINDER_AFTER, REMINDER_MAX_AGE, REMINDER_BATCH, pending)
+                if due:
+                    logging.info("напоминания: %s", len(due))
+                    await asyncio.gather(*(remind(s) for s in due))
+                if len(due) < REMINDER_BATCH:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("напоминания: ошибка, повторим на следующем проходе")
 
 
 # ====================== RUN ======================
+async def log_stats_periodically(interval: float):
+    """Метрики в лог: пул БД, outbox ответов, очередь отправки, кэш клиентов, очереди пользователей."""
+    db = get_db_executor()
+    while True:
+        await asyncio.sleep(interval)
+        logging.info("db pool: %s", db.stats())
+        db.reset_max()
+        if answer_outbox is not None:
+            logging.info("answer outbox: %s", answer_outbox.stats())
+        logging.info("send queue: %s", send_scheduler.stats())
+        logging.info("client cache: %s", client_cache.stats())
+        logging.info("user mailbox: %s", user_mailbox.stats())
+        user_mailbox.reset_max()
+        send_scheduler.reset_max()
+
+
+@contextlib.asynccontextmanager
+async def runtime():
+    """
+    Фоновые задачи бота: метрики, сброс outbox и кэша клиентов, счётчики
+    ответов (eflab/aggregates.py), секции ответов, рассылки и напоминания;
+    на выходе — дослать всё в БД.
+    """
+    stats_interval = float(os.getenv("STATS_LOG_INTERVAL", "60"))
+    stats_task = asyncio.create_task(log_stats_periodically(stats_interval)) if stats_interval > 0 else None
+    outbox_task = asyncio.create_task(answer_outbox.run(get_db_executor())) if answer_outbox else None
+    clients_task = asyncio.create_task(client_cache.run(get_db_executor()))
+    agg_interval = float(os.getenv("AGGREGATES_INTERVAL", "5"))
+    agg_task = (
+        asyncio.create_task(aggregates.run(get_db_executor(), agg_interval)) if agg_interval > 0 else None
+    )
+    broadcast_task = (
+        asyncio.create_task(run_broadcasts(BROADCAST_INTERVAL)) if BROADCAST_INTERVAL > 0 else None
+    )
+    reminder_task = (
+        asyncio.create_task(run_reminders(REMINDER_INTERVAL)) if REMINDER_INTERVAL > 0 else None
+    )
+    # секции ответов вперёд (eflab/partitions.py): без секции месяца ответ не запишется
+    partition_interval = float(os.getenv("PARTITION_CHECK_INTERVAL", str(6 * 3600)))
+    partition_task = asyncio.create_task(partitions.run(
+        get_db_executor(), partition_interval, int(os.getenv("PARTITION_MONTHS_AHEAD", "3")),
+    )) if partition_interval > 0 else None
+    try:
+        yield
+    finally:
+        for task in (stats_task, agg_task, partition_task):
+            if task:
+                task.cancel()
+        background = [t for t in (broadcast_task, reminder_task, outbox_task, clients_task) if t]
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        get_db_executor().shutdown()
+
+
+async def _feed_update(raw: bytes):
+    try:
+        update = Update.model_validate_json(raw, context={"bot": bot})
+        await dp.feed_update(bot, update)
+    except Exception:
+        logging.exception("ошибка обработки апдейта")
+
+
+async def run_worker(updates: AsyncIterator[bytes]):
+    """
+    Воркер вебхук-режима (tgbot/webhook.py): апдейты приходят от ингресса.
+    Каждый — отдельной задачей, порядок внутри пользователя держит user_mailbox.
+    Когда поток апдейтов кончился (остановка) — дорабатываем начатое и выходим.
+    """
+    tasks = set()
+    async with runtime():
+        async for raw in updates:
+            task = asyncio.create_task(_feed_update(raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            logging.info("воркер %s: дорабатываем %s апдейтов", WORKER_INDEX, len(tasks))
+            await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.session.close()
+
+
 async def main():
-    await dp.start_polling(bot)
+    async with runtime():
+        # каждый апдейт — отдельной задачей; порядок внутри пользователя держит user_mailbox
+        await dp.start_polling(bot, handle_as_tasks=True)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # OpClass в индексах, поиск (eflab/search.py)
     'eflab'
 ]
 STATIC_URL = "/static/"
@@ -116,6 +117,9 @@ DATABASES = {
         'PORT': os.getenv('POSTGRES_PORT'),
         'USER': os.getenv('POSTGRES_USER'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
+        # постоянные соединения: у каждого потока пула бота (DB_POOL_SIZE) своё
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -159,3 +163,27 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Как часто бот сверяет версию структуры опросов (сек), см. eflab/survey_cache.py
+SURVEY_CACHE_CHECK_INTERVAL = float(os.getenv('SURVEY_CACHE_CHECK_INTERVAL', '5'))
+
+# Хранилище незавершённого мультивыбора: memory (LRU в процессе) или db (общая таблица)
+SELECTION_STORE = os.getenv('SELECTION_STORE', 'memory')
+SELECTION_TTL = int(os.getenv('SELECTION_TTL', str(24 * 3600)))
+SELECTION_MAX_ENTRIES = int(os.getenv('SELECTION_MAX_ENTRIES', '100000'))
+
+# Потоков в пуле ORM-вызовов бота (eflab/db_executor.py); 0 — старый режим через sync_to_async
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+# Как часто поток пула проверяет своё соединение (сек); после ошибки — сразу
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv('DB_HEALTH_CHECK_INTERVAL', '30'))
+
+# Запись ответов: sync — сразу в БД; outbox — через локальный журнал с пакетным сбросом
+ANSWER_WRITE_MODE = os.getenv('ANSWER_WRITE_MODE', 'sync')
+ANSWER_OUTBOX_PATH = os.getenv('ANSWER_OUTBOX_PATH', str(BASE_DIR / 'answer_outbox.sqlite3'))
+ANSWER_OUTBOX_BATCH = int(os.getenv('ANSWER_OUTBOX_BATCH', '500'))
+ANSWER_OUTBOX_INTERVAL = float(os.getenv('ANSWER_OUTBOX_INTERVAL', '1.0'))
+
+# Выгрузка ответов (eflab/exports.py): строк на пачку серверного курсора;
+# фоновые выгрузки — thread (поток веб-процесса) или command (manage.py process_exports)
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '2000'))
+EXPORT_RUNNER = os.getenv('EXPORT_RUNNER', 'thread')
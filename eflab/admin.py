@@ -1,10 +1,19 @@
 # eflab/admin.py
 from django.contrib import admin
 from django import forms
+from django.db import connection
+from django.db.models import Count, Prefetch
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 from .models import Survey, Question, Mark, Client, Answer
-import csv
-from django.http import HttpResponse
-from .models import SurveyGift
+from .models import SurveyGift, SurveyStructureVersion, AnswerExport, DumpWatermark, QuestionAnswerStat
+from .models import Broadcast, BroadcastDelivery
+from .aggregates import TOTAL, WATERMARK
+from .exports import fail_stale, stream_response, start_export
+from .paginator import EstimatedCountPaginator
+from .search import search_answers, search_clients, search_questions
 
 # ----- Формы с нормальными виджетами -----
 class SurveyForm(forms.ModelForm):
@@ -51,7 +60,7 @@ class QuestionInline(admin.TabularInline):
 @admin.register(Survey)
 class SurveyAdmin(admin.ModelAdmin):
     form = SurveyForm
-    list_display = ("name", "slug", "active", "questions_count")
+    list_display = ("name", "slug", "active", "questions_count", "results_link")
     list_filter = ("active",)
     search_fields = ("name", "slug", "description")
     prepopulated_fields = {"slug": ("name",)}
@@ -60,27 +69,81 @@ class SurveyAdmin(admin.ModelAdmin):
         ("Основное", {"fields": ("name", "slug", "active")}),
         ("Описание", {"fields": ("description", "hello_text")}),
     )
-    actions = ("activate", "deactivate")
+    actions = ("activate", "deactivate", "export_in_background")
+
+    def get_queryset(self, request):
+        # число вопросов — одним GROUP BY на страницу, а не COUNT на каждую строку
+        return super().get_queryset(request).annotate(questions_total=Count("question"))
 
     def questions_count(self, obj):
-        return obj.question_set.count()
+        return obj.questions_total
     questions_count.short_description = "Вопросов"
+    questions_count.admin_order_field = "questions_total"
+
+    def results_link(self, obj):
+        return format_html('<a href="{}">Результаты</a>', reverse("admin:eflab_survey_results", args=[obj.pk]))
+    results_link.short_description = "Результаты"
+
+    def get_urls(self):
+        urls = [
+            path("<int:survey_id>/results/", self.admin_site.admin_view(self.results_view), name="eflab_survey_results"),
+        ]
+        return urls + super().get_urls()
+
+    def results_view(self, request, survey_id):
+        """Итоги опроса из счётчиков QuestionAnswerStat — O(вопросов), без сканов Answer."""
+        survey = get_object_or_404(Survey, pk=survey_id)
+        questions = list(
+            survey.question_set.order_by("numb").prefetch_related(
+                Prefetch("answer_stats", queryset=QuestionAnswerStat.objects.order_by("-count", "option"))
+            )
+        )
+        rows = []
+        for q in questions:
+            stats = list(q.answer_stats.all())
+            total = next((s.count for s in stats if s.option == TOTAL), 0)
+            options = [
+                {"option": s.option, "count": s.count, "percent": round(s.count * 100 / total) if total else 0}
+                for s in stats if s.option != TOTAL
+            ]
+            rows.append({"question": q, "total": total, "options": options})
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": f"Результаты: {survey.name}",
+            "survey": survey,
+            "rows": rows,
+            "answers_total": sum(r["total"] for r in rows),
+            "started": rows[0]["total"] if rows else 0,
+            "finished": rows[-1]["total"] if rows else 0,
+            "watermark": DumpWatermark.objects.filter(name=WATERMARK).first(),
+        }
+        return TemplateResponse(request, "admin/eflab/survey/results.html", context)
 
     @admin.action(description="Активировать выбранные")
     def activate(self, request, queryset):
         updated = queryset.update(active=True)
+        SurveyStructureVersion.bump()  # update() не шлёт сигналы
         self.message_user(request, f"Активировано: {updated}")
 
     @admin.action(description="Деактивировать выбранные")
     def deactivate(self, request, queryset):
         updated = queryset.update(active=False)
+        SurveyStructureVersion.bump()
         self.message_user(request, f"Деактивировано: {updated}")
 
+    @admin.action(description="Выгрузить ответы в фоне (CSV.gz)")
+    def export_in_background(self, request, queryset):
+        for survey in queryset:
+            start_export(AnswerExport.objects.create(survey=survey))
+        self.message_user(request, f"Запущено выгрузок: {queryset.count()}. Прогресс — в «Выгрузки ответов».")
+
 
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
     form = QuestionForm
     list_display = ("survey", "numb", "type_q", "short_text", "has_file")
+    list_select_related = ("survey",)
     list_filter = ("survey", "type_q", "kind_file")
     search_fields = ("que_text",)
     ordering = ("survey", "numb")
@@ -91,6 +154,12 @@ class QuestionAdmin(admin.ModelAdmin):
         ("Текст и файл", {"fields": ("que_text", "file", "kind_file")}),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        # на Postgres — полнотекстовый индекс (eflab/search.py), иначе обычный icontains
+        if connection.vendor != "postgresql" or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return search_questions(queryset, search_term.strip()), False
+
     def short_text(self, obj):
         return (obj.que_text or "")[:60]
     short_text.short_description = "Текст"
@@ -104,6 +173,7 @@ class QuestionAdmin(admin.ModelAdmin):
 @admin.register(Mark)
 class MarkAdmin(admin.ModelAdmin):
     list_display = ("que", "mark_text")
+    list_select_related = ("que__survey",)  # str(Question) показывает опрос
     search_fields = ("mark_text", "que__que_text")
     list_filter = ("que__survey",)
     autocomplete_fields = ("que",)
@@ -115,36 +185,48 @@ class ClientAdmin(admin.ModelAdmin):
     search_fields = ("name", "acc_tg", "tg_id", "email", "phone")
     list_per_page = 25
     ordering = ("name",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # при поиске не считать ещё и всю таблицу
+
+    def get_search_results(self, request, queryset, search_term):
+        # и для списка, и для автодополнения client_id в ответах
+        if connection.vendor != "postgresql" or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return search_clients(queryset, search_term.strip()), False
 
 def export_answers(modeladmin, request, queryset):
-    response = HttpResponse(content_type="text/csv; charset=utf-8")
-    response["Content-Disposition"] = 'attachment; filename="answers.csv"'
-    writer = csv.writer(response)
-    writer.writerow(["survey", "question_num", "question", "client", "telegram", "answer", "date"])
-    for a in queryset.select_related("que__survey", "client_id"):
-        writer.writerow([
-            a.que.survey.name,
-            a.que.numb,
-            (a.que.que_text or "")[:120],
-            getattr(a.client_id, "name", ""),
-            a.client_tg_acc,
-            (a.ans or "").replace("\n", " ")[:500],
-            a.date,
-        ])
-    return response
+    # потоком, серверным курсором — память не растёт с размером выгрузки
+    return stream_response(queryset)
 export_answers.short_description = "Экспортировать выбранные ответы в CSV"
 
 
+def export_answers_gzip(modeladmin, request, queryset):
+    return stream_response(queryset, gzip=True)
+export_answers_gzip.short_description = "Экспортировать выбранные ответы в CSV.gz"
+
+
 @admin.register(Answer)
 class AnswerAdmin(admin.ModelAdmin):
     form = AnswerForm
-    actions = (export_answers,)
-    list_display = ("client_id", "survey_col", "question_col", "short_ans", "date")
+    actions = (export_answers, export_answers_gzip)
+    list_display = ("client_id", "survey_col", "question_col", "short_ans", "attempt", "date")
+    list_select_related = ("client_id", "que__survey")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     list_filter = ("que__survey", "date")
     search_fields = ("ans", "client_tg_acc", "client_id__name", "que__que_text")
     date_hierarchy = "date"
     autocomplete_fields = ("client_id", "que")
-    readonly_fields = ("client_tg_acc", "date")
+    readonly_fields = ("client_tg_acc", "date", "attempt")
+
+    def get_queryset(self, request):
+        # tsvector для поиска в списке не нужен — не тянем его с каждой строкой
+        return super().get_queryset(request).defer("search_vector", "que__search_vector")
+
+    def get_search_results(self, request, queryset, search_term):
+        if connection.vendor != "postgresql" or not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return search_answers(queryset, search_term.strip()), False
 
     def survey_col(self, obj):
         return obj.que.survey
@@ -162,6 +244,7 @@ class AnswerAdmin(admin.ModelAdmin):
 @admin.register(SurveyGift)
 class SurveyGiftAdmin(admin.ModelAdmin):
     list_display = ("survey", "file", "caption")
+    list_select_related = ("survey",)
     list_filter = ("survey",)
     search_fields = ("survey__name", "caption")
     readonly_fields = ()
@@ -170,3 +253,103 @@ class SurveyGiftAdmin(admin.ModelAdmin):
         ("Подарок", {"fields": ("file", "caption")}),
     )
 
+
+
+@admin.register(AnswerExport)
+class AnswerExportAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "survey", "status", "progress_col", "rows_col", "file_link", "created_at", "finished_at")
+    list_select_related = ("survey",)
+    list_filter = ("status",)
+    readonly_fields = (
+        "status", "rows_total", "rows_done", "file", "error", "created_at", "heartbeat_at", "finished_at",
+    )
+    fieldsets = (
+        ("Что выгружать", {"fields": ("survey", "date_from", "date_to", "gzip")}),
+        ("Ход выгрузки", {"fields": (
+            "status", "rows_total", "rows_done", "file", "error", "created_at", "heartbeat_at", "finished_at",
+        )}),
+    )
+
+    def changelist_view(self, request, extra_context=None):
+        # поток выгрузки мог умереть вместе с веб-процессом — не показываем вечное «выполняется»
+        fail_stale()
+        return super().changelist_view(request, extra_context)
+
+    def has_change_permission(self, request, obj=None):
+        # параметры запущенной выгрузки не меняем — только смотрим
+        return obj is None and super().has_change_permission(request, obj)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            start_export(obj)
+
+    def progress_col(self, obj):
+        return format_html('<progress value="{}" max="100"></progress> {}%', obj.progress, obj.progress)
+    progress_col.short_description = "Прогресс"
+
+    def rows_col(self, obj):
+        return f"{obj.rows_done}/{obj.rows_total}"
+    rows_col.short_description = "Строк"
+
+    def file_link(self, obj):
+        if not obj.file:
+            return "—"
+        return format_html('<a href="{}">скачать</a>', obj.file.url)
+    file_link.short_description = "Файл"
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "audience", "status", "progress_col", "counts_col", "created_at", "finished_at")
+    list_select_related = ("survey",)
+    list_filter = ("status", "survey")
+    autocomplete_fields = ("survey",)
+    actions = ("start_broadcast", "pause_broadcast")
+    readonly_fields = (
+        "status", "total", "sent_count", "blocked_count", "failed_count", "last_client_id",
+        "created_at", "started_at", "heartbeat_at", "finished_at",
+    )
+    fieldsets = (
+        ("Приглашение", {"fields": ("survey", "audience", "text", "button_text", "file")}),
+        ("Ход рассылки", {"fields": readonly_fields}),
+    )
+
+    def get_readonly_fields(self, request, obj=None):
+        # после запуска текст и аудиторию не меняем — часть уже получила приглашение
+        if obj is not None and obj.status != "draft":
+            return ("survey", "audience", "text", "button_text", "file") + self.readonly_fields
+        return self.readonly_fields
+
+    @admin.action(description="Запустить / продолжить рассылку")
+    def start_broadcast(self, request, queryset):
+        n = queryset.filter(status__in=("draft", "paused")).update(status="queued")
+        self.message_user(request, f"Поставлено в очередь: {n}. Отправляет бот, прогресс — в этом списке.")
+
+    @admin.action(description="Приостановить")
+    def pause_broadcast(self, request, queryset):
+        n = queryset.filter(status__in=("queued", "running")).update(status="paused")
+        self.message_user(request, f"Приостановлено: {n} (текущая пачка допишется)")
+
+    def progress_col(self, obj):
+        return format_html('<progress value="{}" max="100"></progress> {}%', obj.progress, obj.progress)
+    progress_col.short_description = "Прогресс"
+
+    def counts_col(self, obj):
+        return f"{obj.sent_count} / {obj.blocked_count} / {obj.failed_count} из {obj.total}"
+    counts_col.short_description = "Доставлено / блок / ошибки"
+
+
+@admin.register(BroadcastDelivery)
+class BroadcastDeliveryAdmin(admin.ModelAdmin):
+    list_display = ("broadcast", "client", "status", "error", "sent_at")
+    list_select_related = ("broadcast__survey", "client")
+    list_filter = ("status", "broadcast")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
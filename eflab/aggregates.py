@@ -0,0 +1,191 @@
+# eflab/aggregates.py
+"""
+Счётчики ответов по вопросам (QuestionAnswerStat) — без сканов Answer.
+
+Новые ответы учитывает пакетный потребитель consume(): берёт Answer с id
+выше отметки DumpWatermark(name="aggregates") и в одной транзакции
+прибавляет дельты к счётчикам и двигает отметку. Так учитываются все пути
+записи — raw SQL, bulk_create из outbox, ORM, — а горячий путь бота
+не платит ни одного лишнего запроса.
+
+Варианты one_of_some берутся из AnswerMark, а для старых ответов без
+связей — из текста ответа. Удаление уже учтённого ответа через ORM
+(админка, каскад) вычитается сигналом (post_delete), правка в админке
+пересчитывает вопрос.
+
+Итоги исторические: чистка — manage.py purge_old_attempts и
+answer_retention — удаляет ответы одним DELETE на пачку, без сигналов,
+и счётчики не уменьшает. manage.py recompute_aggregates пересчитывает
+по ответам, которые остались в БД: после чистки итоги уменьшатся.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Answer, AnswerMark, DumpWatermark, Question, QuestionAnswerStat
+
+logger = logging.getLogger(__name__)
+
+WATERMARK = "aggregates"
+TOTAL = ""               # option для «всего ответов на вопрос»
+MULTI_SEPARATOR = "; "   # так бот склеивает варианты one_of_some в Answer.ans
+
+
+def answer_keys(type_q: Optional[str], ans: Optional[str], options: Optional[List[str]] = None) -> List[str]:
+    """Какие счётчики вопроса увеличивает ответ. options — тексты вариантов из AnswerMark."""
+    keys = [TOTAL]
+    if not ans:
+        return keys  # пропуск / пустой ответ — только в «всего»
+    if type_q == "yes_or_no":
+        keys.append(ans[:255])
+    elif type_q == "one_of_some":
+        chosen = options if options else ans.split(MULTI_SEPARATOR)
+        keys.extend(dict.fromkeys(opt[:255] for opt in chosen if opt))
+    return keys
+
+
+def _linked_options(answer_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """answer_id -> тексты выбранных вариантов (AnswerMark)."""
+    options: Dict[int, List[str]] = {}
+    for answer_id, text in AnswerMark.objects.filter(answer_id__in=list(answer_ids)).values_list("answer_id", "mark__mark_text"):
+        options.setdefault(answer_id, []).append(text)
+    return options
+
+
+def _deltas(rows: Iterable[tuple], sign: int = 1, options: Optional[Dict[int, List[str]]] = None) -> Counter:
+    """rows: (answer_id, que_id, type_q, ans)."""
+    options = options or {}
+    deltas: Counter = Counter()
+    for answer_id, que_id, type_q, ans in rows:
+        for key in answer_keys(type_q, ans, options.get(answer_id)):
+            deltas[(que_id, key)] += sign
+    return deltas
+
+
+def _apply(deltas: Counter) -> None:
+    """Прибавить дельты к счётчикам. Вызывать внутри transaction.atomic()."""
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    existing = {
+        (s.question_id, s.option): s
+        for s in QuestionAnswerStat.objects.select_for_update().filter(
+            question_id__in={qid for qid, _ in deltas}
+        )
+    }
+    to_update, to_create = [], []
+    for (qid, option), delta in deltas.items():
+        stat = existing.get((qid, option))
+        if stat is None:
+            to_create.append(QuestionAnswerStat(question_id=qid, option=option, count=delta))
+        else:
+            stat.count += delta
+            to_update.append(stat)
+    QuestionAnswerStat.objects.bulk_update(to_update, ["count"])
+    QuestionAnswerStat.objects.bulk_create(to_create)
+
+
+def _locked_watermark() -> DumpWatermark:
+    DumpWatermark.objects.get_or_create(name=WATERMARK)
+    return DumpWatermark.objects.select_for_update().get(name=WATERMARK)
+
+
+def consume(batch_size: int = 5000, lag: float = 10.0) -> int:
+    """
+    Учесть следующую пачку новых ответов. Возвращает число учтённых.
+    lag — ответы моложе N секунд не берём: транзакции с меньшими id
+    должны успеть закоммититься, прежде чем отметка их обгонит.
+    """
+    with transaction.atomic():
+        mark = _locked_watermark()  # несколько процессов бота — по очереди
+        rows = list(
+            Answer.objects.filter(id__gt=mark.last_answer_id, date__lt=timezone.now() - timedelta(seconds=lag))
+            .order_by("id")
+            .values_list("id", "que_id", "que__type_q", "ans")[:batch_size]
+        )
+        if not rows:
+            return 0
+        multi = [row[0] for row in rows if row[2] == "one_of_some"]
+        _apply(_deltas(rows, options=_linked_options(multi) if multi else None))
+        mark.last_answer_id = rows[-1][0]
+        mark.rows_total += len(rows)
+        mark.save(update_fields=["last_answer_id", "rows_total", "updated_at"])
+        return len(rows)
+
+
+def consume_all(batch_size: int = 5000, lag: float = 10.0) -> int:
+    total = 0
+    while True:
+        n = consume(batch_size, lag)
+        if not n:
+            return total
+        total += n
+
+
+def recompute_question(question_id: int) -> None:
+    """Пересчитать счётчики вопроса по ответам, уже учтённым отметкой."""
+    with transaction.atomic():
+        mark = _locked_watermark()
+        answers = Answer.objects.filter(que_id=question_id, id__lte=mark.last_answer_id)
+        rows = answers.values_list("id", "que_id", "que__type_q", "ans").iterator(chunk_size=5000)
+        options: Dict[int, List[str]] = {}
+        for answer_id, text in AnswerMark.objects.filter(answer__in=answers).values_list("answer_id", "mark__mark_text"):
+            options.setdefault(answer_id, []).append(text)
+        deltas = _deltas(rows, options=options)
+        QuestionAnswerStat.objects.filter(question_id=question_id).delete()
+        QuestionAnswerStat.objects.bulk_create(
+            [QuestionAnswerStat(question_id=qid, option=option, count=n) for (qid, option), n in deltas.items() if n]
+        )
+
+
+async def run(executor, interval: float = 5.0, batch_size: int = 5000, lag: float = 10.0) -> None:
+    """Фоновый потребитель новых ответов (задача бота)."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while await executor.run(consume, batch_size, lag) == batch_size:
+                pass
+        except Exception:
+            logger.exception("aggregates: ошибка обновления счётчиков, повторим позже")
+
+
+# ---------- сигналы (удаление и правка уже учтённых ответов) ----------
+def _consumed(answer_id: int) -> bool:
+    last = DumpWatermark.objects.filter(name=WATERMARK).values_list("last_answer_id", flat=True).first()
+    return bool(last) and answer_id <= last
+
+
+def on_answer_pre_save(sender, instance: Answer, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._stat_old_que_id = Answer.objects.filter(pk=instance.pk).values_list("que_id", flat=True).first()
+
+
+def on_answer_post_save(sender, instance: Answer, created=False, raw=False, **kwargs):
+    # новые ответы учтёт consume(); здесь — только правка существующего
+    if raw or created or not _consumed(instance.pk):
+        return
+    for qid in {instance.que_id, getattr(instance, "_stat_old_que_id", None)} - {None}:
+        recompute_question(qid)
+
+
+def on_answer_pre_delete(sender, instance: Answer, **kwargs):
+    # связи AnswerMark удалятся каскадом раньше, чем придёт post_delete
+    instance._stat_options = _linked_options([instance.pk]).get(instance.pk)
+
+
+def on_answer_post_delete(sender, instance: Answer, **kwargs):
+    if not _consumed(instance.pk):
+        return
+    type_q = Question.objects.filter(pk=instance.que_id).values_list("type_q", flat=True).first()
+    if type_q is None:
+        return  # удаляется сам вопрос — счётчики уйдут каскадом
+    options = getattr(instance, "_stat_options", None)
+    with transaction.atomic():
+        _apply(_deltas([(instance.pk, instance.que_id, type_q, instance.ans)], sign=-1,
+                       options={instance.pk: options} if options else None))
@@ -0,0 +1,241 @@
+# eflab/answer_outbox.py
+"""
+Write-behind запись ответов (ANSWER_WRITE_MODE=outbox).
+
+Ответ сначала попадает в локальный журнал SQLite (append-only, fsync на
+коммите) — после этого он считается принятым, и бот сразу отвечает
+пользователю. Фоновая задача сбрасывает журнал в Postgres пачками через
+bulk_create: по размеру (ANSWER_OUTBOX_BATCH) или по таймеру
+(ANSWER_OUTBOX_INTERVAL).
+
+Курсор SurveySession тоже двигается отложенно: пока запись не сброшена,
+принятое состояние курсора лежит в памяти (overlay) и накладывается на
+строку из БД при чтении — если попытка та же (после ретейка курсор
+прошлой попытки уже не нужен). После падения журнал читается заново при старте —
+overlay восстанавливается, непереданные ответы досылаются. Повторная
+досылка безопасна: уже записанные outbox_id отсеиваются перед вставкой
+(на секционированной таблице outbox_id уникален только вместе с date,
+а date при повторе другая), остальное — bulk_create(ignore_conflicts=True).
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from django.db import transaction
+
+from .models import Answer, AnswerMark, Mark, SurveySession
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[int, int]  # (client_id, survey_id)
+
+
+@dataclass
+class SessionState:
+    current_question_id: Optional[int]
+    answered_count: int
+    completed_at: Optional[str]
+    last_activity_at: str
+    attempt: int = 1  # попытка, к которой относится курсор (журналы до attempt — 1)
+
+    @classmethod
+    def from_session(cls, session: SurveySession) -> "SessionState":
+        return cls(
+            current_question_id=session.current_question_id,
+            answered_count=session.answered_count,
+            completed_at=session.completed_at.isoformat() if session.completed_at else None,
+            last_activity_at=session.last_activity_at.isoformat(),
+            attempt=session.attempt,
+        )
+
+    def db_fields(self) -> dict:
+        return {
+            "current_question_id": self.current_question_id,
+            "answered_count": self.answered_count,
+            "completed_at": datetime.fromisoformat(self.completed_at) if self.completed_at else None,
+            "last_activity_at": datetime.fromisoformat(self.last_activity_at),
+        }
+
+
+class AnswerOutbox:
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 1.0):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()        # журнал и overlay
+        self._flush_lock = threading.Lock()  # один flush за раз
+        self._overlay: Dict[SessionKey, Tuple[int, SessionState]] = {}
+        self._pending = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._replay_overlay()
+
+    def _replay_overlay(self) -> None:
+        rows = self._conn.execute("SELECT seq, payload FROM outbox ORDER BY seq").fetchall()
+        for seq, payload in rows:
+            entry = json.loads(payload)
+            key = (entry["client_id"], entry["survey_id"])
+            self._overlay[key] = (seq, SessionState(**entry["session"]))
+        self._pending = len(rows)
+        if rows:
+            logger.info("answer outbox: %s неотправленных ответов в журнале, досылаем", len(rows))
+
+    # ---------- запись ----------
+    def append(self, answer: Answer, survey_id: int, session: SurveySession, mark_ids: Sequence[int] = ()) -> None:
+        """Принять ответ: запись в журнал + новое состояние курсора в overlay."""
+        state = SessionState.from_session(session)
+        entry = {
+            "outbox_id": str(answer.outbox_id or uuid.uuid4()),
+            "client_id": answer.client_id_id,
+            "client_tg_acc": answer.client_tg_acc,
+            "que_id": answer.que_id,
+            "ans": answer.ans,
+            "attempt": answer.attempt,
+            "mark_ids": list(mark_ids),
+            "survey_id": survey_id,
+            "session": asdict(state),
+        }
+        with self._lock:
+            cur = self._conn.execute("INSERT INTO outbox (payload) VALUES (?)", (json.dumps(entry, ensure_ascii=False),))
+            self._overlay[(entry["client_id"], survey_id)] = (cur.lastrowid, state)
+            self._pending += 1
+            full = self._pending >= self.batch_size
+        if full and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    # ---------- чтение ----------
+    def apply_pending(self, session: SurveySession) -> SurveySession:
+        """Наложить ещё не сброшенное состояние курсора на строку из БД."""
+        with self._lock:
+            item = self._overlay.get((session.client_id, session.survey_id))
+        if item is None or item[1].attempt != session.attempt:
+            # после ретейка курсор прошлой попытки не накладываем
+            return session
+        fields = item[1].db_fields()
+        last_activity = max(fields.pop("last_activity_at"), session.last_activity_at)
+        for name, value in fields.items():
+            setattr(session, name, value)
+        session.last_activity_at = last_activity
+        return session
+
+    def pending_sessions(self, client_id: int) -> List[Tuple[int, SessionState]]:
+        """[(survey_id, состояние)] несброшенных курсоров клиента."""
+        with self._lock:
+            return [(sid, st) for (cid, sid), (_, st) in self._overlay.items() if cid == client_id]
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._pending
+
+    # ---------- сброс в БД ----------
+    def flush(self) -> int:
+        """Сбросить одну пачку из журнала в БД. Синхронно — запускать в пуле БД."""
+        with self._flush_lock:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, payload FROM outbox ORDER BY seq LIMIT ?", (self.batch_size,)
+                ).fetchall()
+            if not rows:
+                return 0
+            entries = [json.loads(payload) for _, payload in rows]
+            max_seq = rows[-1][0]
+
+            latest: Dict[SessionKey, SessionState] = {}
+            for e in entries:
+                latest[(e["client_id"], e["survey_id"])] = SessionState(**e["session"])
+
+            with transaction.atomic():
+                flushed = {
+                    str(x) for x in Answer.objects.filter(
+                        outbox_id__in=[e["outbox_id"] for e in entries]
+                    ).values_list("outbox_id", flat=True)
+                }
+                Answer.objects.bulk_create(
+                    [
+                        Answer(
+                            outbox_id=e["outbox_id"],
+                            client_id_id=e["client_id"],
+                            client_tg_acc=e["client_tg_acc"],
+                            que_id=e["que_id"],
+                            ans=e["ans"],
+                            attempt=e.get("attempt", 1),
+                        )
+                        for e in entries if e["outbox_id"] not in flushed
+                    ],
+                    ignore_conflicts=True,
+                )
+                self._save_marks(entries)
+                for (client_id, survey_id), state in latest.items():
+                    SurveySession.objects.filter(
+                        client_id=client_id, survey_id=survey_id, attempt=state.attempt
+                    ).update(**state.db_fields())
+
+            with self._lock:
+                self._conn.execute("DELETE FROM outbox WHERE seq <= ?", (max_seq,))
+                self._pending -= len(rows)
+                for key in list(latest):
+                    item = self._overlay.get(key)
+                    if item is not None and item[0] <= max_seq:
+                        del self._overlay[key]
+            return len(rows)
+
+    @staticmethod
+    def _save_marks(entries: List[dict]) -> None:
+        """Варианты мультивыбора: id ответов после bulk_create(ignore_conflicts) ищем по outbox_id."""
+        with_marks = {e["outbox_id"]: e["mark_ids"] for e in entries if e.get("mark_ids")}
+        if not with_marks:
+            return
+        ids = Answer.objects.filter(outbox_id__in=list(with_marks)).values_list("outbox_id", "id")
+        # вариант могли удалить в админке, пока ответ лежал в журнале
+        alive = set(Mark.objects.filter(id__in={m for ms in with_marks.values() for m in ms}).values_list("id", flat=True))
+        AnswerMark.objects.bulk_create(
+            [
+                AnswerMark(answer_id=answer_id, mark_id=m)
+                for outbox_id, answer_id in ids for m in with_marks[str(outbox_id)] if m in alive
+            ],
+            ignore_conflicts=True,
+        )
+
+    def flush_all(self) -> int:
+        total = 0
+        while True:
+            n = self.flush()
+            if not n:
+                return total
+            total += n
+
+    async def run(self, executor) -> None:
+        """Фоновый цикл: сброс по таймеру или по заполнению пачки."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    while await executor.run(self.flush):
+                        pass
+                except Exception:
+                    logger.exception("answer outbox: ошибка сброса, повторим позже")
+        finally:
+            # штатная остановка — досылаем всё, что успели принять
+            await executor.run(self.flush_all)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"pending": self._pending, "sessions": len(self._overlay)}
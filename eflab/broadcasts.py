@@ -0,0 +1,110 @@
+# eflab/broadcasts.py
+"""
+Рассылки приглашений (Broadcast): работа с БД. Отправляет бот (bot.py, раздел
+«РАССЫЛКИ») — в том же процессе и через тот же планировщик отправки, что и
+ответы пользователям, только с низким приоритетом.
+
+  claim_next()  — взять рассылку из очереди (или брошенную упавшим процессом);
+  next_page()   — следующие получатели после отметки, keyset по id клиента;
+  save_page()   — статусы пачки одним bulk_create + отметка и счётчики;
+  heartbeat()   — «жив» посреди долгой пачки (каждые HEARTBEAT_EVERY);
+  finish() / release() — завершить или вернуть в очередь при остановке бота.
+
+Отметка двигается только вместе со статусами пачки, поэтому после падения
+повторно могут уйти не больше одной пачки сообщений.
+"""
+from collections import Counter
+from datetime import timedelta
+from typing import List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import Broadcast, BroadcastDelivery, Client, SurveySession
+
+# рассылка «отправляется», но отметки «жив» нет дольше — процесс, который её вёл,
+# упал. Пачка на BROADCAST_RATE может идти дольше STALE_AFTER, поэтому бот
+# отмечается и посреди пачки — с запасом в четыре пропуска
+STALE_AFTER = timedelta(minutes=2)
+HEARTBEAT_EVERY = STALE_AFTER / 4
+
+
+def _claimable() -> Q:
+    return Q(status="queued") | Q(status="running", heartbeat_at__lt=timezone.now() - STALE_AFTER)
+
+
+def claim_next() -> Optional[Broadcast]:
+    for pk in Broadcast.objects.filter(_claimable()).order_by("created_at").values_list("pk", flat=True)[:5]:
+        # условный UPDATE — рассылку возьмёт ровно один процесс
+        if Broadcast.objects.filter(_claimable(), pk=pk).update(status="running", heartbeat_at=timezone.now()):
+            broadcast = Broadcast.objects.select_related("survey").get(pk=pk)
+            if broadcast.started_at is None:
+                broadcast.started_at = timezone.now()
+                broadcast.total = recipients(broadcast).count()
+                broadcast.save(update_fields=["started_at", "total"])
+            return broadcast
+    return None
+
+
+def recipients(broadcast: Broadcast):
+    clients = Client.objects.filter(tg_id__isnull=False)
+    sessions = SurveySession.objects.filter(client=OuterRef("pk"), survey_id=broadcast.survey_id)
+    if broadcast.audience == "not_started":
+        clients = clients.filter(~Exists(sessions))
+    elif broadcast.audience == "not_completed":
+        clients = clients.filter(Exists(sessions.filter(completed_at__isnull=True)))
+    return clients
+
+
+def next_page(broadcast: Broadcast, after_client_id: int, size: int) -> List[Tuple[int, int]]:
+    """[(client_id, tg_id)] после отметки."""
+    return list(
+        recipients(broadcast).filter(id__gt=after_client_id).order_by("id").values_list("id", "tg_id")[:size]
+    )
+
+
+def save_page(broadcast_id: int, results: List[Tuple[int, str, str]], last_client_id: int) -> bool:
+    """
+    results: [(client_id, status, error)]. Пишет статусы и сдвигает отметку.
+    Возвращает False, если рассылку тем временем поставили на паузу.
+    Пачку, повторно отправленную после падения, в счётчиках не учитываем
+    второй раз: считаются только клиенты, у которых статуса ещё не было.
+    """
+    with transaction.atomic():
+        recorded = set(
+            BroadcastDelivery.objects
+            .filter(broadcast_id=broadcast_id, client_id__in=[client_id for client_id, _, _ in results])
+            .values_list("client_id", flat=True)
+        )
+        new = [row for row in results if row[0] not in recorded]
+        counts = Counter(status for _, status, _ in new)
+        BroadcastDelivery.objects.bulk_create(
+            [
+                BroadcastDelivery(broadcast_id=broadcast_id, client_id=client_id, status=status, error=error)
+                for client_id, status, error in new
+            ],
+            ignore_conflicts=True,
+        )
+        Broadcast.objects.filter(pk=broadcast_id).update(
+            last_client_id=last_client_id,
+            sent_count=F("sent_count") + counts["sent"],
+            blocked_count=F("blocked_count") + counts["blocked"],
+            failed_count=F("failed_count") + counts["failed"],
+            heartbeat_at=timezone.now(),
+        )
+        status = Broadcast.objects.filter(pk=broadcast_id).values_list("status", flat=True).first()
+    return status == "running"
+
+
+def heartbeat(broadcast_id: int) -> None:
+    Broadcast.objects.filter(pk=broadcast_id, status="running").update(heartbeat_at=timezone.now())
+
+
+def finish(broadcast_id: int) -> None:
+    Broadcast.objects.filter(pk=broadcast_id, status="running").update(status="done", finished_at=timezone.now())
+
+
+def release(broadcast_id: int) -> None:
+    """Бот останавливается — вернуть рассылку в очередь, следующий процесс продолжит с отметки."""
+    Broadcast.objects.filter(pk=broadcast_id, status="running").update(status="queued", heartbeat_at=None)
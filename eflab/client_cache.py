@@ -0,0 +1,115 @@
+# eflab/client_cache.py
+"""
+Кэш клиентов бота по tg_id (LRU + TTL).
+
+Каждый апдейт начинается с поиска клиента; раньше это был get_or_create
+и, при смене username, ещё и save(). Теперь клиент берётся из памяти,
+в БД идём только при промахе. Смена username применяется к записи в кэше
+сразу, а в таблицу Client уходит пачкой (flush_dirty / run).
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .models import Client
+
+logger = logging.getLogger(__name__)
+
+
+def client_identity(tg_id: int, username: str, full_name: str) -> Tuple[str, str]:
+    """(name, acc_tg) как их записывает бот."""
+    name = (full_name or "").strip() or username or str(tg_id)
+    acc = f"@{username}" if username else str(tg_id)
+    return name, acc
+
+
+class ClientCache:
+    def __init__(self, ttl: float = 300, max_entries: int = 50_000, flush_interval: float = 5.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._data: "OrderedDict[int, Tuple[Client, float]]" = OrderedDict()
+        self._dirty: Dict[int, Tuple[int, str]] = {}  # tg_id -> (client.pk, acc_tg)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, tg_id: int, username: str, full_name: str) -> Optional[Client]:
+        """Только память: клиент или None при промахе/истёкшем TTL."""
+        with self._lock:
+            item = self._data.get(tg_id)
+            if item is None or item[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self._data.move_to_end(tg_id)
+            self.hits += 1
+            client = item[0]
+            _, acc = client_identity(tg_id, username, full_name)
+            if client.acc_tg != acc:
+                client.acc_tg = acc
+                self._dirty[tg_id] = (client.pk, acc)
+            return client
+
+    def get_or_create(self, tg_id: int, username: str, full_name: str) -> Client:
+        """Синхронно: память, при промахе — БД. Запускать в пуле БД."""
+        client = self.lookup(tg_id, username, full_name)
+        if client is not None:
+            return client
+        return self.load(tg_id, username, full_name)
+
+    def load(self, tg_id: int, username: str, full_name: str) -> Client:
+        """Промах: get_or_create в БД и запись в кэш."""
+        name, acc = client_identity(tg_id, username, full_name)
+        client, _ = Client.objects.get_or_create(
+            tg_id=tg_id,
+            defaults={"name": name[:100], "acc_tg": acc, "email": "", "phone": ""},
+        )
+        with self._lock:
+            if client.acc_tg != acc:
+                client.acc_tg = acc
+                self._dirty[tg_id] = (client.pk, acc)
+            self._data[tg_id] = (client, time.monotonic() + self.ttl)
+            self._data.move_to_end(tg_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return client
+
+    def invalidate(self, tg_id: int) -> None:
+        with self._lock:
+            self._data.pop(tg_id, None)
+
+    def flush_dirty(self) -> int:
+        """Записать накопленные смены username одним bulk_update."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+        try:
+            Client.objects.bulk_update(
+                [Client(pk=pk, acc_tg=acc) for pk, acc in dirty.values()], ["acc_tg"], batch_size=500
+            )
+        except Exception:
+            with self._lock:
+                for tg_id, item in dirty.items():
+                    self._dirty.setdefault(tg_id, item)
+            raise
+        return len(dirty)
+
+    async def run(self, executor) -> None:
+        """Фоновый сброс смен username раз в flush_interval секунд."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await executor.run(self.flush_dirty)
+                except Exception:
+                    logger.exception("client cache: ошибка записи username, повторим позже")
+        finally:
+            await executor.run(self.flush_dirty)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "dirty": len(self._dirty), "hits": self.hits, "misses": self.misses}
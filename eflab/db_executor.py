@@ -0,0 +1,116 @@
+# eflab/db_executor.py
+"""
+Пул потоков для ORM-вызовов бота.
+
+sync_to_async(thread_sensitive=True) гоняет все запросы через один общий
+поток, и бот упирается в него при любом числе параллельных апдейтов.
+Здесь — ограниченный пул (DB_POOL_SIZE потоков), у каждого потока своё
+соединение Django (они thread-local и живут CONN_MAX_AGE секунд).
+Очередь ожидания и время в ней видны в stats().
+
+Протухшие/битые соединения поток проверяет не перед каждым вызовом, а раз
+в DB_HEALTH_CHECK_INTERVAL секунд и сразу после ошибки: close_old_connections()
+сбрасывает флаг CONN_HEALTH_CHECKS, и каждый вызов начинался бы с лишнего
+SELECT 1.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class DbExecutor:
+    def __init__(self, size: int, health_interval: float = 30.0):
+        self.size = size
+        self.health_interval = health_interval
+        self._local = threading.local()  # когда поток последний раз проверял соединение
+        self._pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="db") if size > 0 else None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._calls = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _run(self, func: Callable, enqueued_at: float, args, kwargs):
+        wait = time.monotonic() - enqueued_at
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._calls += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        self._check_connections()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            self._local.checked_at = None  # после ошибки соединение проверим на следующем вызове
+            raise
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _check_connections(self) -> None:
+        # как Django на запрос: выбрасываем протухшие/битые соединения
+        now = time.monotonic()
+        checked_at = getattr(self._local, "checked_at", None)
+        if checked_at is None or now - checked_at >= self.health_interval:
+            close_old_connections()
+            self._local.checked_at = now
+
+    async def run(self, func: Callable, *args, **kwargs):
+        if self._pool is None:
+            return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+        with self._lock:
+            self._queued += 1
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, self._run, func, time.monotonic(), args, kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self._calls
+            return {
+                "pool_size": self.size,
+                "running": self._running,
+                "queued": self._queued,
+                "calls": calls,
+                "wait_avg_ms": round(self._wait_total / calls * 1000, 2) if calls else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+            }
+
+    def reset_max(self) -> None:
+        with self._lock:
+            self._wait_max = 0.0
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+_executor: Optional[DbExecutor] = None
+
+
+def get_db_executor() -> DbExecutor:
+    global _executor
+    if _executor is None:
+        _executor = DbExecutor(
+            getattr(settings, "DB_POOL_SIZE", 8), getattr(settings, "DB_HEALTH_CHECK_INTERVAL", 30.0)
+        )
+    return _executor
+
+
+def db_async(func: Callable) -> Callable:
+    """Замена sync_to_async(func, thread_sensitive=True) — выполнение в пуле."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await get_db_executor().run(func, *args, **kwargs)
+    return wrapper
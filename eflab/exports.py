@@ -0,0 +1,181 @@
+# eflab/exports.py
+"""
+Выгрузка ответов в CSV без загрузки всей таблицы в память.
+
+Строки читаются серверным курсором (.iterator(chunk_size=...)) как
+кортежи values_list, CSV собирается в куски по ~64 КБ и отдаётся
+потоком: в админке — StreamingHttpResponse (stream_response), в фоне —
+файлом в MEDIA_ROOT/exports (run_export, задача AnswerExport).
+
+Фоновая задача отмечается в heartbeat_at с каждой пачкой строк. Если поток
+или процесс умер посреди выгрузки, задача так и осталась бы «выполняется»;
+fail_stale() (список выгрузок в админке, process_exports) переводит такие
+задачи в «ошибку» — выгрузку можно заказать заново.
+"""
+import csv
+import logging
+import threading
+import zlib
+from datetime import timedelta
+from typing import Iterable, Iterator
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Answer, AnswerExport
+
+logger = logging.getLogger(__name__)
+
+HEADER = ["survey", "question_num", "question", "client", "telegram", "answer", "date", "attempt"]
+FIELDS = (
+    "que__survey__name", "que__numb", "que__que_text", "client_id__name",
+    "client_tg_acc", "ans", "date", "attempt",
+)
+CHUNK_ROWS = settings.EXPORT_CHUNK_ROWS
+BUFFER_BYTES = 64 * 1024
+# без отметки дольше этого задача считается брошенной; с запасом на count()
+# и первую пачку серверного курсора по большой таблице
+STALE_AFTER = timedelta(minutes=10)
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: write() возвращает строку, а не пишет её."""
+
+    def write(self, value):
+        return value
+
+
+def answer_rows(queryset) -> Iterator[list]:
+    """Строки CSV (без заголовка) — серверный курсор, пачками по CHUNK_ROWS."""
+    rows = queryset.order_by("id").values_list(*FIELDS).iterator(chunk_size=CHUNK_ROWS)
+    for survey, numb, que_text, client, acc, ans, date, attempt in rows:
+        yield [
+            survey,
+            numb,
+            (que_text or "")[:120],
+            client or "",
+            acc,
+            (ans or "").replace("\n", " ")[:500],
+            date,
+            attempt,
+        ]
+
+
+def csv_chunks(rows: Iterable[list]) -> Iterator[bytes]:
+    """CSV с заголовком, кусками ~BUFFER_BYTES."""
+    writer = csv.writer(_Echo())
+    buf = [writer.writerow(HEADER)]
+    size = 0
+    for row in rows:
+        line = writer.writerow(row)
+        buf.append(line)
+        size += len(line)
+        if size >= BUFFER_BYTES:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 — формат gzip
+    for chunk in chunks:
+        data = gz.compress(chunk)
+        if data:
+            yield data
+    yield gz.flush()
+
+
+def stream_response(queryset, gzip: bool = False, filename: str = "answers") -> StreamingHttpResponse:
+    chunks = csv_chunks(answer_rows(queryset))
+    if gzip:
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type="application/gzip")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv.gz"'
+    else:
+        response = StreamingHttpResponse(chunks, content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+# ---------------- фоновая выгрузка ----------------
+def export_queryset(job: AnswerExport):
+    qs = Answer.objects.all()
+    if job.survey_id:
+        qs = qs.filter(que__survey_id=job.survey_id)
+    if job.date_from:
+        qs = qs.filter(date__gte=job.date_from)
+    if job.date_to:
+        qs = qs.filter(date__lte=job.date_to)
+    return qs
+
+
+def _counted(rows: Iterable[list], job: AnswerExport) -> Iterator[list]:
+    """Пропускает строки и раз в CHUNK_ROWS пишет прогресс в задачу."""
+    done = 0
+    for row in rows:
+        yield row
+        done += 1
+        if done % CHUNK_ROWS == 0:
+            AnswerExport.objects.filter(pk=job.pk).update(rows_done=done, heartbeat_at=timezone.now())
+    AnswerExport.objects.filter(pk=job.pk).update(rows_done=done, heartbeat_at=timezone.now())
+
+
+def fail_stale() -> int:
+    """Задачи «выполняется» без отметки дольше STALE_AFTER — в «ошибку». Возвращает их число."""
+    now = timezone.now()
+    return AnswerExport.objects.filter(status="running", heartbeat_at__lt=now - STALE_AFTER).update(
+        status="failed", error="исполнитель выгрузки пропал, закажите её заново", finished_at=now
+    )
+
+
+def run_export(job_id: int) -> None:
+    """Выполнить задачу выгрузки: CSV(.gz) в MEDIA_ROOT/exports, статус и прогресс — в AnswerExport."""
+    claimed = AnswerExport.objects.filter(pk=job_id, status="pending").update(
+        status="running", heartbeat_at=timezone.now()
+    )
+    if not claimed:
+        return  # уже взята другим исполнителем
+    job = AnswerExport.objects.get(pk=job_id)
+    try:
+        qs = export_queryset(job)
+        AnswerExport.objects.filter(pk=job.pk).update(rows_total=qs.count(), heartbeat_at=timezone.now())
+        chunks = csv_chunks(_counted(answer_rows(qs), job))
+        if job.gzip:
+            chunks = gzip_chunks(chunks)
+        name = f"answers_{job.pk}_{timezone.now():%Y%m%d_%H%M%S}.csv" + (".gz" if job.gzip else "")
+        # пишем в хранилище по кускам, не собирая файл в памяти
+        job.file.save(name, ContentFile(b""), save=False)
+        with job.file.storage.open(job.file.name, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        AnswerExport.objects.filter(pk=job.pk).update(
+            status="done", file=job.file.name, finished_at=timezone.now()
+        )
+    except Exception as e:
+        logger.exception("выгрузка #%s не удалась", job_id)
+        AnswerExport.objects.filter(pk=job.pk).update(
+            status="failed", error=str(e)[:2000], finished_at=timezone.now()
+        )
+
+
+def _run_in_thread(job_id: int) -> None:
+    try:
+        run_export(job_id)
+    finally:
+        connection.close()  # соединение этого потока больше никому не нужно
+
+
+def start_export(job: AnswerExport) -> None:
+    """
+    Запустить выгрузку. EXPORT_RUNNER=thread (по умолчанию) — в фоновом
+    потоке веб-процесса; EXPORT_RUNNER=command — задача остаётся в очереди
+    до manage.py process_exports.
+    """
+    if settings.EXPORT_RUNNER != "thread":
+        return
+    thread = threading.Thread(target=_run_in_thread, args=(job.pk,), name=f"export-{job.pk}", daemon=True)
+    # админка сохраняет в транзакции — поток должен увидеть уже закоммиченную задачу
+    transaction.on_commit(thread.start)
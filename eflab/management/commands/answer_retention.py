@@ -0,0 +1,173 @@
+# eflab/management/commands/answer_retention.py
+"""
+Старые ответы — из горячей таблицы: архив, отключение или обезличивание.
+
+    python manage.py answer_retention --older-than-months 12 --mode archive
+
+Граница — начало месяца N месяцев назад. Секции, целиком лежащие до
+границы (см. eflab/partitions.py):
+  archive   — строки пачками в MEDIA_ROOT/archive/<секция>_<время>.jsonl.gz,
+              затем DETACH PARTITION CONCURRENTLY, связи AnswerMark
+              и DROP TABLE;
+  detach    — только DETACH CONCURRENTLY: таблица остаётся в БД отдельно,
+              бот и админка её больше не читают;
+  anonymize — пачками client_id = NULL, client_tg_acc = '' (текст ответа
+              остаётся), секция остаётся на месте.
+Строки до границы в секциях, которые её пересекают (legacy, или вся
+таблица, если она не секционирована), обрабатываются по id пачками:
+archive — выгрузить и удалить, anonymize — обезличить, detach — пропуск.
+
+Каждая пачка — своя короткая транзакция. Счётчики итогов
+(QuestionAnswerStat) не уменьшаются: итоги опроса остаются
+историческими. Связи AnswerMark архивируются вместе с ответом и
+удаляются только после DETACH: если он не удался, секция остаётся целой.
+Прерванный DETACH CONCURRENTLY следующий запуск завершает (FINALIZE).
+"""
+import gzip
+import json
+import time
+from datetime import date, datetime, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from eflab.models import Answer, AnswerMark
+from eflab.partitions import TABLE, Partition, add_months, detach, is_partitioned, list_partitions, month_start
+
+ARCHIVE_FIELDS = ("id", "client_id_id", "client_tg_acc", "que_id", "ans", "date", "attempt")
+
+
+class Command(BaseCommand):
+    help = "Архивировать, отключить или обезличить ответы старше N месяцев"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than-months", type=int, required=True)
+        parser.add_argument("--mode", choices=("archive", "detach", "anonymize"), default="archive")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, с")
+        parser.add_argument("--dry-run", action="store_true", help="только показать, что будет сделано")
+
+    def handle(self, *args, older_than_months, mode, batch_size, sleep, dry_run, **options):
+        if older_than_months < 1:
+            raise CommandError("--older-than-months должен быть >= 1: текущий месяц не трогаем")
+        cutoff_day = add_months(month_start(date.today()), -older_than_months)
+        self.cutoff = datetime(cutoff_day.year, cutoff_day.month, 1, tzinfo=dt_timezone.utc)
+        self.mode, self.batch_size, self.sleep, self.dry_run = mode, batch_size, sleep, dry_run
+
+        whole = []
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                if is_partitioned(cursor):
+                    whole = [
+                        p for p in list_partitions(cursor)
+                        if p.upper is not None and p.upper <= self.cutoff
+                    ]
+        for partition in whole:
+            self.retire_partition(partition)
+        self.retire_rows()
+
+    # ---------- секции целиком ----------
+    def retire_partition(self, partition: Partition) -> None:
+        name = partition.name
+        if self.dry_run:
+            self.stdout.write(f"[dry-run] секция {name}: {self.mode}")
+            return
+        if self.mode == "anonymize":
+            n = self._anonymize(f'SELECT id FROM "{name}" WHERE id > %s AND (client_id_id IS NOT NULL OR client_tg_acc <> \'\')')
+            self.stdout.write(f"{name}: обезличено {n}")
+            return
+        if partition.detach_pending:
+            # прошлый запуск прервался на DETACH — архив уже записан, только завершаем
+            self.stdout.write(f"{name}: завершаем прерванный DETACH")
+        elif self.mode == "archive":
+            path = self._archive_path(name)
+            with gzip.open(path, "wt", encoding="utf-8") as out:
+                n = self._archive(f'SELECT id FROM "{name}" WHERE id > %s', out, delete=False)
+            self.stdout.write(f"{name}: архивировано {n} → {path}")
+        with connection.cursor() as cursor:
+            detach(cursor, partition)
+        if self.mode == "detach":
+            self.stdout.write(f"{name}: отключена, таблица сохранена")
+            return
+        # секция уже не видна через eflab_answer — связи ищем по ней самой
+        self._delete_marks_of(name)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE "{name}"')
+        self.stdout.write(f"{name}: секция удалена")
+
+    # ---------- строки в секциях, пересекающих границу ----------
+    def retire_rows(self) -> None:
+        old = Answer.objects.filter(date__lt=self.cutoff)
+        if self.dry_run:
+            self.stdout.write(f"[dry-run] строк до {self.cutoff:%Y-%m-%d} вне целых секций: {old.count()} ({self.mode})")
+            return
+        if self.mode == "detach":
+            if old.exists():
+                self.stdout.write("остались строки в секциях, пересекающих границу: их можно только archive / anonymize")
+            return
+        ids = old.order_by("id").values_list("id", flat=True)
+        if self.mode == "anonymize":
+            n = self._anonymize(ids.filter(Q(client_id__isnull=False) | ~Q(client_tg_acc="")))
+            self.stdout.write(self.style.SUCCESS(f"обезличено строк: {n}"))
+            return
+        path = self._archive_path("answers")
+        with gzip.open(path, "wt", encoding="utf-8") as out:
+            n = self._archive(ids, out, delete=True)
+        self.stdout.write(self.style.SUCCESS(f"архивировано и удалено строк: {n} → {path}"))
+
+    # ---------- пачки ----------
+    def _batches(self, source):
+        """id пачками по keyset; source — SQL с «id > %s» или queryset id."""
+        last_id = 0
+        while True:
+            if isinstance(source, str):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"{source} ORDER BY id LIMIT %s", [last_id, self.batch_size])
+                    ids = [row[0] for row in cursor.fetchall()]
+            else:
+                ids = list(source.filter(id__gt=last_id)[:self.batch_size])
+            if not ids:
+                return
+            last_id = ids[-1]
+            yield ids
+            if self.sleep:
+                time.sleep(self.sleep)
+
+    def _anonymize(self, source) -> int:
+        total = 0
+        for ids in self._batches(source):
+            total += Answer.objects.filter(id__in=ids).update(client_id=None, client_tg_acc="")
+        return total
+
+    def _archive(self, source, out, delete: bool) -> int:
+        total = 0
+        for ids in self._batches(source):
+            marks = {}
+            for answer_id, mark_id in AnswerMark.objects.filter(answer_id__in=ids).values_list("answer_id", "mark_id"):
+                marks.setdefault(answer_id, []).append(mark_id)
+            rows = Answer.objects.filter(id__in=ids).order_by("id").values(*ARCHIVE_FIELDS, survey_id=F("que__survey_id"))
+            for row in rows:
+                row["mark_ids"] = marks.get(row["id"], [])
+                out.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            if delete:
+                # без сигналов и каскада Django: счётчики итогов не трогаем, связи удаляем сами
+                with transaction.atomic(), connection.cursor() as cursor:
+                    AnswerMark.objects.filter(answer_id__in=ids).delete()
+                    cursor.execute(f'DELETE FROM "{TABLE}" WHERE id IN ({", ".join(["%s"] * len(ids))})', ids)
+            total += len(ids)
+            self.stdout.write(f"…{total}")
+        return total
+
+    def _delete_marks_of(self, partition: str) -> None:
+        for ids in self._batches(f'SELECT id FROM "{partition}" WHERE id > %s'):
+            AnswerMark.objects.filter(answer_id__in=ids).delete()
+
+    def _archive_path(self, name: str) -> Path:
+        path = Path(settings.MEDIA_ROOT) / "archive" / f"{name}_{timezone.now():%Y%m%d_%H%M%S}.jsonl.gz"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
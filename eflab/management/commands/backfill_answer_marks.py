@@ -0,0 +1,99 @@
+# eflab/management/commands/backfill_answer_marks.py
+"""
+Заполнить AnswerMark для старых ответов на one_of_some.
+
+    python manage.py backfill_answer_marks --batch-size 5000 --sleep 0.2
+
+Раньше выбор хранился только строкой «A; B» в Answer.ans. Команда
+разбирает её на варианты вопроса (с учётом вариантов, в тексте которых
+есть «; ») и пишет связи пачками по keyset. Прогресс — в DumpWatermark,
+прерванный запуск продолжается с места остановки. Ответы, в которых
+не все варианты нашлись среди текущих Mark (переименовали/удалили),
+пропускаются и считаются в «не разобрано».
+
+Счётчики по вариантам после заполнения пересчитывает
+manage.py recompute_aggregates.
+"""
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from eflab.aggregates import MULTI_SEPARATOR
+from eflab.models import Answer, AnswerMark, DumpWatermark, Mark
+
+WATERMARK = "answer_marks_backfill"
+
+
+def match_marks(ans: str, marks_by_text: Dict[str, int]) -> Optional[List[int]]:
+    """id вариантов, из которых склеен ans, или None, если разобрать не удалось."""
+    texts = sorted(marks_by_text, key=len, reverse=True)
+
+    def walk(pos: int) -> Optional[List[str]]:
+        for text in texts:
+            if not ans.startswith(text, pos):
+                continue
+            end = pos + len(text)
+            if end == len(ans):
+                return [text]
+            if ans.startswith(MULTI_SEPARATOR, end):
+                rest = walk(end + len(MULTI_SEPARATOR))
+                if rest is not None:
+                    return [text] + rest
+        return None
+
+    found = walk(0) if ans else None
+    return None if found is None else [marks_by_text[t] for t in found]
+
+
+class Command(BaseCommand):
+    help = "Разобрать старые ответы мультивыбора в таблицу AnswerMark"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, с")
+        parser.add_argument("--reset", action="store_true", help="начать с первого ответа")
+
+    def handle(self, *args, batch_size, sleep, reset, **options):
+        mark, _ = DumpWatermark.objects.get_or_create(name=WATERMARK)
+        if reset:
+            mark.last_answer_id, mark.rows_total = 0, 0
+            mark.save()
+
+        linked = unmatched = 0
+        while True:
+            rows = list(
+                Answer.objects.filter(id__gt=mark.last_answer_id, que__type_q="one_of_some")
+                .order_by("id")
+                .values_list("id", "que_id", "ans")[:batch_size]
+            )
+            if not rows:
+                break
+
+            marks: Dict[int, Dict[str, int]] = defaultdict(dict)
+            for mid, qid, text in Mark.objects.filter(que_id__in={r[1] for r in rows}).values_list("id", "que_id", "mark_text"):
+                marks[qid][text] = mid
+
+            links = []
+            for answer_id, qid, ans in rows:
+                if not ans:
+                    continue  # пропуск вопроса — вариантов нет
+                ids = match_marks(ans, marks[qid])
+                if ids is None:
+                    unmatched += 1
+                    continue
+                links.extend(AnswerMark(answer_id=answer_id, mark_id=m) for m in ids)
+
+            with transaction.atomic():
+                AnswerMark.objects.bulk_create(links, ignore_conflicts=True)
+                mark.last_answer_id = rows[-1][0]
+                mark.rows_total += len(rows)
+                mark.save(update_fields=["last_answer_id", "rows_total", "updated_at"])
+            linked += len(links)
+            self.stdout.write(f"ответов {mark.rows_total}, связей +{len(links)} (id ≤ {mark.last_answer_id})")
+            if sleep:
+                time.sleep(sleep)
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: связей записано {linked}, не разобрано ответов {unmatched}"))
@@ -0,0 +1,139 @@
+# eflab/management/commands/dump_answers.py
+"""
+Инкрементальная колоночная выгрузка ответов для аналитики.
+
+    python manage.py dump_answers --format parquet --out /data/answers
+
+Ответы вместе с вопросом, опросом и клиентом пишутся в Parquet или Arrow IPC
+(feather), с разбиением по опросу и дню (UTC):
+
+    <out>/survey_id=<id>/date=<YYYY-MM-DD>/part-<первый id ответа в файле>.parquet
+
+Читаем только id > отметки (DumpWatermark) пачками по keyset (id > последний
+прочитанный) — ночной запуск стоит O(новых строк), а не O(таблицы).
+Отметка двигается после записи каждой пачки; если запуск упал посередине,
+повтор начнёт с той же отметки и перепишет те же файлы (имя — по первому
+id), дублей не будет.
+
+--lag: последние N секунд не берём — чтобы транзакции, которые ещё пишут
+ответы с меньшими id, успели закоммититься до того, как отметка их обгонит.
+
+Нужен pyarrow (pip install pyarrow) — в основной requirements он не входит.
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from eflab.models import Answer, DumpWatermark
+
+# колонка выгрузки -> путь в ORM
+COLUMNS = (
+    ("answer_id", "id"),
+    ("answer_date", "date"),
+    ("attempt", "attempt"),
+    ("ans", "ans"),
+    ("question_id", "que_id"),
+    ("question_numb", "que__numb"),
+    ("question_type", "que__type_q"),
+    ("question_text", "que__que_text"),
+    ("survey_id", "que__survey_id"),
+    ("survey_slug", "que__survey__slug"),
+    ("survey_name", "que__survey__name"),
+    ("client_id", "client_id_id"),
+    ("client_tg_id", "client_id__tg_id"),
+    ("client_tg_acc", "client_tg_acc"),
+    ("client_name", "client_id__name"),
+)
+NAMES = [name for name, _ in COLUMNS]
+
+
+def _schema(pa):
+    # survey_id и date в файл не пишем — это колонки разбиения (hive-каталоги)
+    return pa.schema([
+        ("answer_id", pa.int64()),
+        ("answer_date", pa.timestamp("us", tz="UTC")),
+        ("attempt", pa.int32()),
+        ("ans", pa.string()),
+        ("question_id", pa.int64()),
+        ("question_numb", pa.int32()),
+        ("question_type", pa.string()),
+        ("question_text", pa.string()),
+        ("survey_slug", pa.string()),
+        ("survey_name", pa.string()),
+        ("client_id", pa.int64()),
+        ("client_tg_id", pa.int64()),
+        ("client_tg_acc", pa.string()),
+        ("client_name", pa.string()),
+    ])
+
+
+class Command(BaseCommand):
+    help = "Инкрементальная выгрузка ответов в Parquet / Arrow IPC с разбиением по опросу и дню"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+        parser.add_argument("--out", default=None, help="каталог выгрузки (по умолчанию MEDIA_ROOT/dumps/answers)")
+        parser.add_argument("--name", default=None, help="имя отметки (по умолчанию answers_<format>)")
+        parser.add_argument("--batch-size", type=int, default=50_000)
+        parser.add_argument("--lag", type=int, default=60, help="не брать ответы моложе N секунд")
+        parser.add_argument("--compression", default="zstd")
+        parser.add_argument("--reset", action="store_true", help="начать с нуля (сбросить отметку)")
+
+    def handle(self, *args, **opts):
+        try:
+            import pyarrow as pa
+            import pyarrow.feather as feather
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise CommandError("Для dump_answers нужен pyarrow: pip install pyarrow")
+
+        fmt = opts["format"]
+        out = Path(opts["out"] or Path(settings.MEDIA_ROOT) / "dumps" / "answers")
+        name = opts["name"] or f"answers_{fmt}"
+        schema = _schema(pa)
+        ext = "parquet" if fmt == "parquet" else "arrow"
+
+        mark, _ = DumpWatermark.objects.get_or_create(name=name)
+        if opts["reset"]:
+            mark.last_answer_id, mark.last_answer_date, mark.rows_total = 0, None, 0
+            mark.save()
+
+        cutoff = timezone.now() - timedelta(seconds=opts["lag"])
+        base = Answer.objects.filter(date__lt=cutoff).order_by("id").values_list(*(p for _, p in COLUMNS))
+        written = 0
+        while True:
+            rows = [dict(zip(NAMES, r)) for r in base.filter(id__gt=mark.last_answer_id)[:opts["batch_size"]]]
+            if not rows:
+                break
+
+            parts = defaultdict(list)
+            for row in rows:
+                day = row["answer_date"].astimezone(dt_timezone.utc).date()
+                parts[(row["survey_id"], day)].append(row)
+
+            for (survey_id, day), part_rows in parts.items():
+                table = pa.Table.from_pylist(part_rows, schema=schema)
+                path = out / f"survey_id={survey_id}" / f"date={day:%Y-%m-%d}"
+                path.mkdir(parents=True, exist_ok=True)
+                target = path / f"part-{part_rows[0]['answer_id']}.{ext}"
+                tmp = target.with_suffix(".tmp")
+                if fmt == "parquet":
+                    pq.write_table(table, tmp, compression=opts["compression"])
+                else:
+                    feather.write_feather(table, tmp, compression=opts["compression"])
+                tmp.replace(target)  # читатели не увидят недописанный файл
+
+            mark.last_answer_id = rows[-1]["answer_id"]
+            mark.last_answer_date = rows[-1]["answer_date"]
+            mark.rows_total += len(rows)
+            mark.save(update_fields=["last_answer_id", "last_answer_date", "rows_total", "updated_at"])
+            written += len(rows)
+            self.stdout.write(f"выгружено {written} (id ≤ {mark.last_answer_id}, файлов в пачке: {len(parts)})")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: новых строк {written}, всего по отметке «{name}» — {mark.rows_total}; каталог {out}"
+        ))
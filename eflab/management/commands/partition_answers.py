@@ -0,0 +1,49 @@
+# eflab/management/commands/partition_answers.py
+"""
+Помесячные секции таблицы ответов (Postgres), см. eflab/partitions.py.
+
+    python manage.py partition_answers --ahead 3
+
+Саму таблицу переводит на секции миграция 0021; секции вперёд досоздаёт
+бот (eflab/partitions.run), команда — то же из cron, раз в месяц, на
+случай, когда бот не работает. DEFAULT-секцию,
+оставшуюся от прежних версий команды, убирает, разложив её строки по
+месяцам.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from eflab.partitions import ENSURE_LOCK, drop_default, ensure_partitions, is_partitioned, list_partitions
+
+
+class Command(BaseCommand):
+    help = "Досоздать помесячные секции ответов вперёд"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3, help="на сколько месяцев вперёд держать секции")
+        parser.add_argument("--lock-timeout", default="5s",
+                            help="сколько ждать блокировку таблицы, убирая DEFAULT (не держим очередь записей)")
+        parser.add_argument("--dry-run", action="store_true", help="только показать состояние")
+
+    def handle(self, *args, ahead, lock_timeout, dry_run, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Секционирование поддерживается только на Postgres")
+
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("Таблица ответов не секционирована: выполните manage.py migrate")
+            if dry_run:
+                for p in list_partitions(cursor):
+                    bounds = "DEFAULT" if p.is_default else f"{p.lower or 'MINVALUE'} … {p.upper or 'MAXVALUE'}"
+                    self.stdout.write(f"{p.name}: {bounds}{' (DETACH не завершён)' if p.detach_pending else ''}")
+                return
+
+            with transaction.atomic():
+                cursor.execute("SET LOCAL lock_timeout = %s", [lock_timeout])
+                moved = drop_default(cursor)
+            if moved:
+                self.stdout.write(f"DEFAULT-секция убрана, её строки — в {', '.join(moved)}")
+            with transaction.atomic():
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", [ENSURE_LOCK])  # не вместе с ботом
+                created = ensure_partitions(cursor, ahead)
+        self.stdout.write(self.style.SUCCESS(f"новых секций: {len(created)} {', '.join(created)}".rstrip()))
@@ -0,0 +1,36 @@
+# eflab/management/commands/process_exports.py
+"""
+Исполнитель фоновых выгрузок ответов (EXPORT_RUNNER=command).
+
+    python manage.py process_exports           # выполнить очередь и выйти
+    python manage.py process_exports --loop 5  # опрашивать очередь каждые 5 с
+
+Заодно переводит в «ошибку» задачи, брошенные умершим исполнителем (fail_stale).
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from eflab.exports import fail_stale, run_export
+from eflab.models import AnswerExport
+
+
+class Command(BaseCommand):
+    help = "Выполнить ожидающие выгрузки ответов (AnswerExport)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", type=float, default=0, help="не выходить, опрашивать очередь раз в N секунд")
+
+    def handle(self, *args, loop, **options):
+        while True:
+            stale = fail_stale()
+            if stale:
+                self.stdout.write(f"брошенных выгрузок переведено в ошибку: {stale}")
+            for job_id in AnswerExport.objects.filter(status="pending").order_by("id").values_list("id", flat=True):
+                self.stdout.write(f"выгрузка #{job_id}…")
+                run_export(job_id)
+                job = AnswerExport.objects.get(pk=job_id)
+                self.stdout.write(f"выгрузка #{job_id}: {job.get_status_display()}, строк {job.rows_done}")
+            if not loop:
+                return
+            time.sleep(loop)
@@ -0,0 +1,106 @@
+# eflab/management/commands/purge_old_attempts.py
+"""
+Чистка ответов прошлых попыток (ретейк = новая попытка, см. SurveySession.attempt).
+
+    python manage.py purge_old_attempts --keep 1 --older-than 30 --archive
+
+Удаляет ответы, чья попытка старше последних --keep попыток сессии,
+пачками по --batch-size (короткие транзакции, без долгих блокировок).
+--archive — перед удалением пачка дописывается в
+MEDIA_ROOT/archive/answers_attempts_<время>.jsonl.gz (вместе с id выбранных
+вариантов AnswerMark).
+
+Как и answer_retention, удаляет без сигналов Django — одним DELETE на пачку:
+счётчики итогов (QuestionAnswerStat) не уменьшаются, итоги опроса остаются
+историческими. Связи AnswerMark удаляются здесь же, в той же транзакции.
+"""
+import gzip
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from eflab.models import Answer, AnswerMark, SurveySession
+
+
+class Command(BaseCommand):
+    help = "Удалить (и при желании заархивировать) ответы прошлых попыток прохождения опросов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep", type=int, default=1,
+                            help="сколько последних попыток оставить (1 — только текущую)")
+        parser.add_argument("--older-than", type=int, default=0,
+                            help="трогать только ответы старше N дней")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--sleep", type=float, default=0.0, help="пауза между пачками, с")
+        parser.add_argument("--archive", action="store_true", help="сохранить удаляемое в MEDIA_ROOT/archive")
+        parser.add_argument("--dry-run", action="store_true", help="только посчитать")
+
+    def handle(self, *args, keep, older_than, batch_size, sleep, archive, dry_run, **options):
+        if keep < 1:
+            raise CommandError("--keep должен быть >= 1: текущую попытку не трогаем")
+
+        # есть сессия, в которой эта попытка уже не входит в последние keep
+        newer = SurveySession.objects.filter(
+            client_id=OuterRef("client_id"),
+            survey_id=OuterRef("que__survey_id"),
+            attempt__gte=OuterRef("attempt") + keep,
+        )
+        stale = Answer.objects.filter(Exists(newer))
+        if older_than:
+            stale = stale.filter(date__lt=timezone.now() - timedelta(days=older_than))
+
+        if dry_run:
+            self.stdout.write(f"к удалению: {stale.count()}")
+            return
+
+        out = None
+        if archive:
+            path = Path(settings.MEDIA_ROOT) / "archive" / f"answers_attempts_{timezone.now():%Y%m%d_%H%M%S}.jsonl.gz"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            out = gzip.open(path, "wt", encoding="utf-8")
+
+        total, last_id = 0, 0
+        try:
+            while True:
+                batch = list(
+                    stale.filter(id__gt=last_id)
+                    .order_by("id")
+                    .values("id", "client_id_id", "client_tg_acc", "que_id", "ans", "date", "attempt",
+                            survey_id=F("que__survey_id"))[:batch_size]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1]["id"]
+                ids = [row["id"] for row in batch]
+                if out is not None:
+                    marks = {}
+                    for answer_id, mark_id in AnswerMark.objects.filter(answer_id__in=ids).values_list("answer_id", "mark_id"):
+                        marks.setdefault(answer_id, []).append(mark_id)
+                    for row in batch:
+                        row["mark_ids"] = marks.get(row["id"], [])
+                        out.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+                    out.flush()
+                with transaction.atomic(), connection.cursor() as cursor:
+                    AnswerMark.objects.filter(answer_id__in=ids).delete()
+                    cursor.execute(
+                        f'DELETE FROM "{Answer._meta.db_table}" WHERE id IN ({", ".join(["%s"] * len(ids))})', ids
+                    )
+                total += len(batch)
+                self.stdout.write(f"удалено {total}…")
+                if sleep:
+                    time.sleep(sleep)
+        finally:
+            if out is not None:
+                out.close()
+
+        msg = f"Готово: удалено ответов прошлых попыток — {total}"
+        if out is not None:
+            msg += f", архив: {path}"
+        self.stdout.write(self.style.SUCCESS(msg))
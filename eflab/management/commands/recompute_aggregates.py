@@ -0,0 +1,41 @@
+# eflab/management/commands/recompute_aggregates.py
+"""
+Ремонт счётчиков ответов (QuestionAnswerStat, eflab/aggregates.py).
+
+    python manage.py recompute_aggregates              # учесть новые ответы и пересчитать всё
+    python manage.py recompute_aggregates --survey s1  # только вопросы опроса s1
+    python manage.py recompute_aggregates --consume-only
+
+Пересчёт идёт по ответам, которые есть в БД: ответы, удалённые
+purge_old_attempts / answer_retention, из итогов при этом уйдут.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from eflab import aggregates
+from eflab.models import Question, Survey
+
+
+class Command(BaseCommand):
+    help = "Пересчитать материализованные счётчики ответов по вопросам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--survey", help="slug опроса (по умолчанию — все)")
+        parser.add_argument("--consume-only", action="store_true", help="только учесть новые ответы")
+        parser.add_argument("--lag", type=float, default=0, help="не учитывать ответы моложе N секунд")
+
+    def handle(self, *args, survey, consume_only, lag, **options):
+        consumed = aggregates.consume_all(lag=lag)
+        self.stdout.write(f"учтено новых ответов: {consumed}")
+        if consume_only:
+            return
+
+        questions = Question.objects.order_by("survey_id", "numb")
+        if survey:
+            if not Survey.objects.filter(slug=survey).exists():
+                raise CommandError(f"Опрос «{survey}» не найден")
+            questions = questions.filter(survey__slug=survey)
+        n = 0
+        for qid in questions.values_list("id", flat=True).iterator():
+            aggregates.recompute_question(qid)
+            n += 1
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано вопросов: {n}"))
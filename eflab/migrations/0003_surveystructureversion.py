@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0002_surveygift'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyStructureVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='время изменения')),
+            ],
+            options={
+                'verbose_name': 'версия структуры опросов',
+                'verbose_name_plural': 'версии структуры опросов',
+            },
+        ),
+    ]
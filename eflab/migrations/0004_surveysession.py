@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:59
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0003_surveystructureversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveySession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answered_count', models.PositiveIntegerField(default=0, verbose_name='отвечено вопросов')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='начало')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='завершение')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='eflab.client', verbose_name='клиент')),
+                ('current_question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='eflab.question', verbose_name='текущий вопрос')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='eflab.survey', verbose_name='опрос')),
+            ],
+            options={
+                'verbose_name': 'прохождение опроса',
+                'verbose_name_plural': 'прохождения опросов',
+                'constraints': [models.UniqueConstraint(fields=('client', 'survey'), name='uniq_session_client_survey')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:59
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0004_surveysession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveysession',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='последняя активность'),
+        ),
+        migrations.AddIndex(
+            model_name='surveysession',
+            index=models.Index(condition=models.Q(('completed_at__isnull', True)), fields=['client', '-last_activity_at'], name='session_open_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:00
+
+import os
+
+from django.db import migrations, models
+
+# копия eflab.models.MEDIA_EXTENSIONS / guess_media_kind на момент миграции:
+# правка живого кода не должна менять историю
+MEDIA_EXTENSIONS = {
+    'photo': ('.png', '.jpg', '.jpeg', '.gif', '.webp'),
+    'video': ('.mp4', '.mov', '.avi', '.mkv'),
+    'audio': ('.mp3', '.aac', '.wav', '.ogg'),
+}
+
+
+def guess_media_kind(file_name):
+    ext = os.path.splitext((file_name or '').lower())[1]
+    for kind, extensions in MEDIA_EXTENSIONS.items():
+        if ext in extensions:
+            return kind
+    return 'document'
+
+
+def backfill_kind_file(apps, schema_editor):
+    for model_name in ("Question", "SurveyGift"):
+        model = apps.get_model("eflab", model_name)
+        for obj in model.objects.filter(kind_file__isnull=True).exclude(file="").exclude(file__isnull=True).only("id", "file"):
+            model.objects.filter(pk=obj.pk).update(kind_file=guess_media_kind(obj.file.name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0005_surveysession_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='tg_file_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Telegram file_id'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='tg_file_key',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='ключ файла для file_id'),
+        ),
+        migrations.AddField(
+            model_name='surveygift',
+            name='kind_file',
+            field=models.CharField(blank=True, choices=[('photo', 'photo'), ('video', 'video'), ('audio', 'audio'), ('document', 'document')], max_length=100, null=True, verbose_name='тип файла'),
+        ),
+        migrations.AddField(
+            model_name='surveygift',
+            name='tg_file_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Telegram file_id'),
+        ),
+        migrations.AddField(
+            model_name='surveygift',
+            name='tg_file_key',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='ключ файла для file_id'),
+        ),
+        migrations.RunPython(backfill_kind_file, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0006_tg_file_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SelectionState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tg_id', models.BigIntegerField(verbose_name='tg id пользователя')),
+                ('question_id', models.BigIntegerField(verbose_name='id вопроса')),
+                ('chosen', models.JSONField(default=list, verbose_name='выбранные варианты')),
+                ('updated_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='время изменения')),
+            ],
+            options={
+                'verbose_name': 'состояние мультивыбора',
+                'verbose_name_plural': 'состояния мультивыбора',
+                'constraints': [models.UniqueConstraint(fields=('tg_id', 'question_id'), name='uniq_selection_user_question')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0007_selectionstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='outbox_id',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
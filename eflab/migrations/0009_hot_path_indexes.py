@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:08
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции;
+    # зато индекс строится без блокировки записи в таблицу ответов
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0008_answer_outbox_id'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='answer',
+            index=models.Index(fields=['client_id', 'que'], name='answer_client_que_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='question',
+            index=models.Index(fields=['survey', 'numb'], name='question_survey_numb_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='survey',
+            index=models.Index(condition=models.Q(('active', True)), fields=['active'], name='survey_active_idx'),
+        ),
+    ]
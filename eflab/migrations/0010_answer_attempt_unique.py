@@ -0,0 +1,77 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:09
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def drop_duplicate_answers(apps, schema_editor):
+    """Перед уникальным ограничением оставляем первый ответ на вопрос, остальные дубли удаляем."""
+    Answer = apps.get_model("eflab", "Answer")
+    duplicates = (
+        Answer.objects
+        .filter(client_id__isnull=False)
+        .values("client_id", "que", "attempt")
+        .annotate(n=Count("id"), first_id=Min("id"))
+        .filter(n__gt=1)
+    )
+    for d in duplicates.iterator():
+        (
+            Answer.objects
+            .filter(client_id=d["client_id"], que=d["que"], attempt=d["attempt"])
+            .exclude(id=d["first_id"])
+            .delete()
+        )
+
+
+UNIQUE = models.UniqueConstraint(fields=('client_id', 'que', 'attempt'), name='uniq_answer_client_que_attempt')
+
+
+def add_unique_concurrently(apps, schema_editor):
+    """
+    Postgres: уникальный индекс строится CONCURRENTLY (запись в ответы не
+    блокируется), затем ограничение вешается на готовый индекс — это уже
+    только изменение каталога. Если индекс не построился (между чисткой и
+    построением успел появиться дубль), остаётся INVALID-индекс: его
+    удаляем при повторном запуске.
+    """
+    Answer = apps.get_model("eflab", "Answer")
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.add_constraint(Answer, UNIQUE)
+        return
+    table, name = Answer._meta.db_table, UNIQUE.name
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    schema_editor.execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY "{name}" ON "{table}" (client_id_id, que_id, attempt)'
+    )
+    schema_editor.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" UNIQUE USING INDEX "{name}"')
+
+
+def remove_unique(apps, schema_editor):
+    schema_editor.remove_constraint(apps.get_model("eflab", "Answer"), UNIQUE)
+
+
+class Migration(migrations.Migration):
+    # индекс по таблице ответов — CONCURRENTLY, вне транзакции
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0009_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answer',
+            name='attempt',
+            field=models.PositiveIntegerField(default=1, verbose_name='попытка'),
+        ),
+        migrations.AddField(
+            model_name='surveysession',
+            name='attempt',
+            field=models.PositiveIntegerField(default=1, verbose_name='попытка'),
+        ),
+        migrations.RunPython(drop_duplicate_answers, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_unique_concurrently, remove_unique)],
+            state_operations=[migrations.AddConstraint(model_name='answer', constraint=UNIQUE)],
+        ),
+    ]
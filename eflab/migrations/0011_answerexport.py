@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0010_answer_attempt_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateTimeField(blank=True, null=True, verbose_name='ответы с')),
+                ('date_to', models.DateTimeField(blank=True, null=True, verbose_name='ответы по')),
+                ('gzip', models.BooleanField(default=True, verbose_name='сжать (gzip)')),
+                ('status', models.CharField(choices=[('pending', 'в очереди'), ('running', 'выполняется'), ('done', 'готово'), ('failed', 'ошибка')], default='pending', max_length=10, verbose_name='статус')),
+                ('rows_total', models.PositiveBigIntegerField(default=0, verbose_name='всего строк')),
+                ('rows_done', models.PositiveBigIntegerField(default=0, verbose_name='выгружено строк')),
+                ('file', models.FileField(blank=True, null=True, upload_to='exports/', verbose_name='файл')),
+                ('error', models.TextField(blank=True, default='', verbose_name='ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создана')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершена')),
+                ('survey', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='eflab.survey', verbose_name='опрос')),
+            ],
+            options={
+                'verbose_name': 'выгрузка ответов',
+                'verbose_name_plural': 'выгрузки ответов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0011_answerexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DumpWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='выгрузка')),
+                ('last_answer_id', models.BigIntegerField(default=0, verbose_name='последний выгруженный id ответа')),
+                ('last_answer_date', models.DateTimeField(blank=True, null=True, verbose_name='время последнего ответа')),
+                ('rows_total', models.PositiveBigIntegerField(default=0, verbose_name='выгружено строк всего')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='обновлено')),
+            ],
+            options={
+                'verbose_name': 'отметка выгрузки',
+                'verbose_name_plural': 'отметки выгрузок',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0012_dumpwatermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionAnswerStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('option', models.CharField(blank=True, default='', max_length=255, verbose_name='вариант')),
+                ('count', models.BigIntegerField(default=0, verbose_name='ответов')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_stats', to='eflab.question', verbose_name='вопрос')),
+            ],
+            options={
+                'verbose_name': 'счётчик ответов',
+                'verbose_name_plural': 'счётчики ответов',
+                'constraints': [models.UniqueConstraint(fields=('question', 'option'), name='uniq_stat_question_option')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0013_questionanswerstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='marks', to='eflab.answer', verbose_name='ответ')),
+                ('mark', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answer_links', to='eflab.mark', verbose_name='вариант')),
+            ],
+            options={
+                'verbose_name': 'выбранный вариант',
+                'verbose_name_plural': 'выбранные варианты',
+                'indexes': [models.Index(fields=['mark', 'answer'], name='answermark_mark_idx')],
+                'constraints': [models.UniqueConstraint(fields=('answer', 'mark'), name='uniq_answer_mark')],
+            },
+        ),
+    ]
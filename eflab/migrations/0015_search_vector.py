@@ -0,0 +1,85 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:28
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# таблица, текстовая колонка — tsvector по ним держит триггер
+SEARCH_SOURCES = (
+    ("eflab_answer", "ans"),
+    ("eflab_question", "que_text"),
+)
+BATCH = 10_000
+
+
+def create_triggers(apps, schema_editor):
+    """BEFORE INSERT/UPDATE: вектор считается в БД, поэтому его получают и raw INSERT бота, и bulk_create."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, column in SEARCH_SOURCES:
+        schema_editor.execute(f"""
+            CREATE OR REPLACE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('russian', coalesce(NEW.{column}, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        schema_editor.execute(f"""
+            CREATE TRIGGER {table}_search_vector
+            BEFORE INSERT OR UPDATE OF {column} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION {table}_search_vector()
+        """)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, _ in SEARCH_SOURCES:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector ON {table}")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {table}_search_vector()")
+
+
+def backfill_vectors(apps, schema_editor):
+    """Старые строки — пачками по id, каждая пачка в своей транзакции (миграция не atomic)."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in SEARCH_SOURCES:
+            last_id = 0
+            while True:
+                cursor.execute(f"""
+                    WITH batch AS (SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT %s)
+                    UPDATE {table} t SET search_vector = to_tsvector('russian', coalesce(t.{column}, ''))
+                    FROM batch WHERE t.id = batch.id
+                    RETURNING t.id
+                """, [last_id, BATCH])
+                ids = [row[0] for row in cursor.fetchall()]
+                if not ids:
+                    break
+                last_id = max(ids)
+
+
+class Migration(migrations.Migration):
+    # вектор для существующих ответов заполняется пачками, без одной длинной транзакции
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0014_answermark'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='answer',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+        migrations.RunPython(backfill_vectors, migrations.RunPython.noop),
+    ]
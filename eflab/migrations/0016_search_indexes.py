@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:29
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # GIN по таблице ответов строится долго — CONCURRENTLY, без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0015_search_vector'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='answer',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='answer_search_gin'),
+        ),
+        AddIndexConcurrently(
+            model_name='answer',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('ans'), name='gin_trgm_ops'), name='answer_ans_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='question',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='question_search_gin'),
+        ),
+        AddIndexConcurrently(
+            model_name='question',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('que_text'), name='gin_trgm_ops'), name='question_text_trgm'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:30
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # pg_trgm включён в 0015; индексы строим без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0016_search_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='client_name_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='client',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('acc_tg'), name='gin_trgm_ops'), name='client_acc_tg_trgm'),
+        ),
+        AddIndexConcurrently(
+            model_name='client',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('phone', name='gin_trgm_ops'), name='client_phone_trgm'),
+        ),
+    ]
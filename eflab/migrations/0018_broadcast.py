@@ -0,0 +1,60 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0017_client_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tg_file_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='Telegram file_id')),
+                ('tg_file_key', models.CharField(blank=True, max_length=255, null=True, verbose_name='ключ файла для file_id')),
+                ('audience', models.CharField(choices=[('all', 'все клиенты'), ('not_started', 'ещё не начинали этот опрос'), ('not_completed', 'начали, но не закончили')], default='not_started', max_length=20, verbose_name='кому')),
+                ('text', models.TextField(verbose_name='текст приглашения')),
+                ('button_text', models.CharField(default='Пройти опрос', max_length=64, verbose_name='текст кнопки')),
+                ('file', models.FileField(blank=True, null=True, upload_to='broadcasts/', verbose_name='файл')),
+                ('kind_file', models.CharField(blank=True, choices=[('photo', 'photo'), ('video', 'video'), ('audio', 'audio'), ('document', 'document')], max_length=100, null=True, verbose_name='тип файла')),
+                ('status', models.CharField(choices=[('draft', 'черновик'), ('queued', 'в очереди'), ('running', 'отправляется'), ('paused', 'на паузе'), ('done', 'завершена')], default='draft', max_length=10, verbose_name='статус')),
+                ('last_client_id', models.BigIntegerField(default=0, verbose_name='отметка (id клиента)')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='получателей')),
+                ('sent_count', models.PositiveIntegerField(default=0, verbose_name='доставлено')),
+                ('blocked_count', models.PositiveIntegerField(default=0, verbose_name='бот заблокирован')),
+                ('failed_count', models.PositiveIntegerField(default=0, verbose_name='ошибок')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='последняя пачка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='завершена')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='eflab.survey', verbose_name='опрос')),
+            ],
+            options={
+                'verbose_name': 'рассылка',
+                'verbose_name_plural': 'рассылки',
+                'ordering': ('-created_at',),
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('sent', 'доставлено'), ('blocked', 'бот заблокирован'), ('failed', 'ошибка')], max_length=10, verbose_name='статус')),
+                ('error', models.CharField(blank=True, default='', max_length=255, verbose_name='ошибка')),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='время')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='eflab.broadcast', verbose_name='рассылка')),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='eflab.client', verbose_name='клиент')),
+            ],
+            options={
+                'verbose_name': 'доставка рассылки',
+                'verbose_name_plural': 'доставки рассылок',
+                'constraints': [models.UniqueConstraint(fields=('broadcast', 'client'), name='uniq_delivery_broadcast_client')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0018_broadcast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveysession',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='напоминание отправлено'),
+        ),
+    ]
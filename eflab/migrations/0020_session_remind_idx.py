@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-17 12:10
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # курсоры обновляются на каждый ответ — индекс строим без блокировки записи
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0019_surveysession_reminder_sent_at'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='surveysession',
+            index=models.Index(condition=models.Q(('answered_count__gt', 0), ('completed_at__isnull', True), ('reminder_sent_at__isnull', True)), fields=['last_activity_at'], name='session_remind_idx'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.6 on 2026-10-17 14:02
+
+from django.db import migrations, models, transaction
+
+from eflab import partitions
+
+
+def partition_answers(apps, schema_editor):
+    """
+    Postgres: перевести ответы на помесячные секции (eflab/partitions.py).
+    Таблицы, уже переведённые прежней командой partition_answers, только
+    приводятся к той же схеме: имя ограничения outbox, без DEFAULT-секции,
+    без лишних копий индексов (id, date) и (outbox_id, date) у legacy-секции.
+    Если блокировку таблицы взять не удалось — миграция падает, повторный
+    migrate продолжит с того же места.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table, old_name = partitions.TABLE, f"{partitions.TABLE}_outbox_date_uniq"
+    with schema_editor.connection.cursor() as cursor:
+        if not partitions.is_partitioned(cursor):
+            partitions.convert(cursor)
+            return
+        with transaction.atomic():
+            cursor.execute("SET LOCAL lock_timeout = '5s'")
+            cursor.execute(
+                "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s", [table, old_name]
+            )
+            if cursor.fetchone():
+                cursor.execute(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{old_name}" TO "{partitions.OUTBOX_UNIQUE}"')
+            partitions.drop_default(cursor)
+        # прежний переход строил для ATTACH свои индексы, подготовленные остались без дела
+        for index in (f"{partitions.LEGACY}_id_date", f"{partitions.LEGACY}_outbox_date"):
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"')
+        partitions.ensure_partitions(cursor)
+
+
+def unpartition_answers(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        raise RuntimeError("Секционирование ответов не откатывается: данные остаются в секциях")
+
+
+class UnlessPostgres(migrations.SeparateDatabaseAndState):
+    """
+    На Postgres схему целиком строит partition_answers, на остальных БД
+    (секционирования нет) изменения состояния применяются к схеме как обычно.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        super().database_forwards(app_label, schema_editor, from_state, to_state)
+        if schema_editor.connection.vendor != "postgresql":
+            self._as_database().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            self._as_database().database_backwards(app_label, schema_editor, from_state, to_state)
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def _as_database(self):
+        return migrations.SeparateDatabaseAndState(database_operations=self.state_operations)
+
+
+class Migration(migrations.Migration):
+    # шаг 1 перехода — индексы CONCURRENTLY, вне транзакции
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0020_session_remind_idx'),
+    ]
+
+    operations = [
+        UnlessPostgres(
+            database_operations=[migrations.RunPython(partition_answers, unpartition_answers)],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='answer',
+                    name='outbox_id',
+                    field=models.UUIDField(blank=True, editable=False, null=True),
+                ),
+                migrations.RemoveConstraint(
+                    model_name='answer',
+                    name='uniq_answer_client_que_attempt',
+                ),
+                migrations.AddConstraint(
+                    model_name='answer',
+                    constraint=models.UniqueConstraint(fields=('outbox_id', 'date'), name='answer_outbox_date_uniq'),
+                ),
+                migrations.AlterField(
+                    model_name='answermark',
+                    name='answer',
+                    field=models.ForeignKey(db_constraint=False, on_delete=models.deletion.CASCADE, related_name='marks', to='eflab.answer', verbose_name='ответ'),
+                ),
+            ],
+        ),
+    ]
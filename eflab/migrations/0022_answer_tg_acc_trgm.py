@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-17 15:20
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+from eflab import partitions
+
+INDEX = django.contrib.postgres.indexes.GinIndex(
+    django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('client_tg_acc'), name='gin_trgm_ops'),
+    name='answer_tg_acc_trgm',
+)
+
+
+def add_index(apps, schema_editor):
+    """Postgres: по секциям CONCURRENTLY (eflab/partitions.py), запись в ответы не блокируется."""
+    Answer = apps.get_model("eflab", "Answer")
+    if schema_editor.connection.vendor != "postgresql":
+        schema_editor.add_index(Answer, INDEX)
+        return
+    with schema_editor.connection.cursor() as cursor:
+        partitions.add_index_concurrently(cursor, INDEX.name, "USING gin (UPPER(client_tg_acc) gin_trgm_ops)")
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model("eflab", "Answer"), INDEX)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('eflab', '0021_partition_answers'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(add_index, remove_index)],
+            state_operations=[migrations.AddIndex(model_name='answer', index=INDEX)],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('eflab', '0022_answer_tg_acc_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='answerexport',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='последний прогресс'),
+        ),
+    ]
@@ -1,10 +1,75 @@
+import hashlib
+import os
+
 from django.db.models import CASCADE
 
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Upper
+from django.utils import timezone
 
 NULLABLE = {'blank': True, 'null': True}
 
+MEDIA_EXTENSIONS = {
+    'photo': ('.png', '.jpg', '.jpeg', '.gif', '.webp'),
+    'video': ('.mp4', '.mov', '.avi', '.mkv'),
+    'audio': ('.mp3', '.aac', '.wav', '.ogg'),
+}
+
+
+def guess_media_kind(file_name: str) -> str:
+    """photo / video / audio / document по расширению файла."""
+    ext = os.path.splitext((file_name or '').lower())[1]
+    for kind, extensions in MEDIA_EXTENSIONS.items():
+        if ext in extensions:
+            return kind
+    return 'document'
+
+
+def _file_digest(f) -> str:
+    h = hashlib.sha256()
+    for chunk in f.chunks():
+        h.update(chunk)
+    return h.hexdigest()[:32]
+
+
+class TgFileCacheMixin(models.Model):
+    """
+    Кэш Telegram file_id для поля file.
+    После первой загрузки бот сохраняет file_id и дальше шлёт файл по нему.
+    tg_file_key = "<имя в хранилище>:<sha256>" — при замене файла в админке
+    ключ меняется и file_id сбрасывается.
+    """
+    tg_file_id = models.CharField(max_length=255, verbose_name='Telegram file_id', **NULLABLE)
+    tg_file_key = models.CharField(max_length=255, verbose_name='ключ файла для file_id', **NULLABLE)
+
+    def _file_changed(self) -> bool:
+        if not self.file:
+            return False
+        return not self.file._committed or not (self.tg_file_key or '').startswith(f'{self.file.name}:')
+
+    def save(self, *args, **kwargs):
+        if not self.file:
+            self.tg_file_id = None
+            self.tg_file_key = None
+            return super().save(*args, **kwargs)
+
+        digest = _file_digest(self.file) if self._file_changed() else None
+        super().save(*args, **kwargs)
+        if digest is None:
+            return
+        # имя в хранилище известно только после сохранения файла
+        key = f'{self.file.name}:{digest}'
+        if key != self.tg_file_key:
+            self.tg_file_key = key
+            self.tg_file_id = None
+            type(self).objects.filter(pk=self.pk).update(tg_file_key=key, tg_file_id=None)
+
+    class Meta:
+        abstract = True
+
 
 class Survey(models.Model):
     slug = models.SlugField(max_length=255, unique=True, verbose_name='slug')
@@ -21,9 +86,12 @@ class Survey(models.Model):
     class Meta:
         verbose_name = 'опрос'
         verbose_name_plural = 'опросы'
+        indexes = [
+            models.Index(fields=['active'], condition=models.Q(active=True), name='survey_active_idx'),
+        ]
 
 
-class Question(models.Model):
+class Question(TgFileCacheMixin):
     CHOICES = (
         ('yes_or_no', 'yes_or_no'),
         ('one_of_some', 'one_of_some'),
@@ -42,23 +110,41 @@ class Question(models.Model):
     wait_answer = models.BooleanField(verbose_name='ожидание ответа', **NULLABLE)
     file = models.FileField(upload_to='documents/', verbose_name="Файл документа", **NULLABLE)
     kind_file = models.CharField(max_length=100, choices=KINDS, verbose_name='тип вопроса', **NULLABLE)
+    # to_tsvector('russian', que_text) — заполняет триггер БД (миграция 0015), см. eflab/search.py
+    search_vector = SearchVectorField(editable=False, **NULLABLE)
 
     def __str__(self):
         return f'{self.survey}, {self.numb}, {self.que_text}'
 
+    def save(self, *args, **kwargs):
+        if self.file and not self.kind_file:
+            self.kind_file = guess_media_kind(self.file.name)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'вопрос'
         verbose_name_plural = 'вопросы'
+        indexes = [
+            models.Index(fields=['survey', 'numb'], name='question_survey_numb_idx'),
+            GinIndex(fields=['search_vector'], name='question_search_gin'),
+            GinIndex(OpClass(Upper('que_text'), name='gin_trgm_ops'), name='question_text_trgm'),
+        ]
 
 
-class SurveyGift(models.Model):
+class SurveyGift(TgFileCacheMixin):
     survey = models.OneToOneField(Survey, on_delete=models.CASCADE, verbose_name="Опрос")
     file = models.FileField(upload_to="gifts/", verbose_name="Подарочный файл", **NULLABLE)
     caption = models.CharField(max_length=255, verbose_name="Текст, сопровождающий подарок", **NULLABLE)
+    kind_file = models.CharField(max_length=100, choices=Question.KINDS, verbose_name="тип файла", **NULLABLE)
 
     def __str__(self):
         return f"Подарок для {self.survey.name}"
 
+    def save(self, *args, **kwargs):
+        # тип считаем один раз при сохранении, а не на каждой отправке
+        self.kind_file = guess_media_kind(self.file.name) if self.file else None
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "подарок"
         verbose_name_plural = "подарки"
@@ -77,14 +163,29 @@ class Client(models.Model):
     class Meta:
         verbose_name = 'клиент'
         verbose_name_plural = 'клиенты'
+        indexes = [
+            # поиск и автодополнение в админке (eflab/search.py: search_clients)
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='client_name_trgm'),
+            GinIndex(OpClass(Upper('acc_tg'), name='gin_trgm_ops'), name='client_acc_tg_trgm'),
+            GinIndex(OpClass('phone', name='gin_trgm_ops'), name='client_phone_trgm'),
+        ]
 
 
 class Answer(models.Model):
+    """
+    Таблица секционирована по месяцам (eflab/partitions.py, миграция 0021):
+    в БД первичный ключ (id, date), для Django pk остаётся id.
+    """
     client_tg_acc = models.CharField(max_length=100, verbose_name='ТГ аккаунт')
     que = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name='вопрос')
     ans = models.TextField(verbose_name='ответ')
     date = models.DateTimeField(auto_now_add=True, verbose_name='время ответа')
     client_id = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name='id клиента', **NULLABLE)
+    # ключ записи из журнала write-behind (eflab/answer_outbox.py) — защита от повторной досылки
+    outbox_id = models.UUIDField(editable=False, **NULLABLE)
+    attempt = models.PositiveIntegerField(default=1, verbose_name='попытка')
+    # to_tsvector('russian', ans) — заполняет триггер БД, в том числе для raw INSERT и bulk_create
+    search_vector = SearchVectorField(editable=False, **NULLABLE)
 
     def __str__(self):
         return f'{self.client_tg_acc}'
@@ -93,6 +194,18 @@ class Answer(models.Model):
     class Meta:
         verbose_name = 'ответ'
         verbose_name_plural = 'ответы'
+        indexes = [
+            models.Index(fields=['client_id', 'que'], name='answer_client_que_idx'),
+            GinIndex(fields=['search_vector'], name='answer_search_gin'),
+            # UPPER(ans) — под icontains (UPPER(...) LIKE UPPER('%...%')) для поиска по части слова
+            GinIndex(OpClass(Upper('ans'), name='gin_trgm_ops'), name='answer_ans_trgm'),
+            GinIndex(OpClass(Upper('client_tg_acc'), name='gin_trgm_ops'), name='answer_tg_acc_trgm'),
+        ]
+        constraints = [
+            # уникальный ключ секционированной таблицы обязан включать date.
+            # Один ответ на вопрос в рамках попытки — NOT EXISTS в записи бота
+            models.UniqueConstraint(fields=['outbox_id', 'date'], name='answer_outbox_date_uniq'),
+        ]
 
 
 class Mark(models.Model):
@@ -104,4 +217,295 @@ class Mark(models.Model):
 
     class Meta:
         verbose_name = 'кнопка'
-        verbose_name_plural = 'кнопки'
\ No newline at end of file
+        verbose_name_plural = 'кнопки'
+
+class AnswerMark(models.Model):
+    """
+    Выбранные варианты (Mark) ответа на one_of_some — по строке на вариант.
+    Answer.ans по-прежнему хранит текст для чтения; считать и фильтровать
+    по вариантам — по этой таблице (индекс по mark).
+    """
+    # без FK в БД: на секционированный ответ можно сослаться только по (id, date)
+    answer = models.ForeignKey(
+        Answer, on_delete=models.CASCADE, related_name='marks', verbose_name='ответ', db_constraint=False,
+    )
+    mark = models.ForeignKey(Mark, on_delete=models.CASCADE, related_name='answer_links', verbose_name='вариант')
+
+    def __str__(self):
+        return f'{self.answer_id} → {self.mark_id}'
+
+    class Meta:
+        verbose_name = 'выбранный вариант'
+        verbose_name_plural = 'выбранные варианты'
+        constraints = [
+            models.UniqueConstraint(fields=['answer', 'mark'], name='uniq_answer_mark'),
+        ]
+        indexes = [
+            models.Index(fields=['mark', 'answer'], name='answermark_mark_idx'),
+        ]
+
+
+class SurveyStructureVersion(models.Model):
+    """
+    Штамп версии структуры опросов (Survey/Question/Mark/SurveyGift).
+    Админка увеличивает version при любом изменении, бот сверяет его
+    со своим кэшем и пересобирает снапшот — так несколько процессов бота
+    видят одну и ту же структуру.
+    """
+    version = models.PositiveBigIntegerField(default=0, verbose_name='версия')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='время изменения')
+
+    def __str__(self):
+        return f'v{self.version}'
+
+    @classmethod
+    def bump(cls):
+        updated = cls.objects.filter(pk=1).update(
+            version=models.F('version') + 1, updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    @classmethod
+    def current(cls) -> int:
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    class Meta:
+        verbose_name = 'версия структуры опросов'
+        verbose_name_plural = 'версии структуры опросов'
+
+
+class SurveySession(models.Model):
+    """
+    Курсор прохождения опроса клиентом: текущий вопрос и число ответов.
+    Обновляется в одной транзакции с сохранением Answer, поэтому следующий
+    вопрос и прогресс — это чтение одной строки, а не скан ответов.
+    """
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name='клиент')
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, verbose_name='опрос')
+    current_question = models.ForeignKey(
+        Question, on_delete=models.SET_NULL, related_name='+', verbose_name='текущий вопрос', **NULLABLE
+    )
+    answered_count = models.PositiveIntegerField(default=0, verbose_name='отвечено вопросов')
+    attempt = models.PositiveIntegerField(default=1, verbose_name='попытка')
+    started_at = models.DateTimeField(default=timezone.now, verbose_name='начало')
+    completed_at = models.DateTimeField(verbose_name='завершение', **NULLABLE)
+    last_activity_at = models.DateTimeField(default=timezone.now, verbose_name='последняя активность')
+    reminder_sent_at = models.DateTimeField(verbose_name='напоминание отправлено', **NULLABLE)
+
+    def __str__(self):
+        return f'{self.client} — {self.survey}'
+
+    @property
+    def is_completed(self) -> bool:
+        return self.completed_at is not None
+
+    class Meta:
+        verbose_name = 'прохождение опроса'
+        verbose_name_plural = 'прохождения опросов'
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'survey'], name='uniq_session_client_survey'),
+        ]
+        indexes = [
+            # «текущий» незавершённый опрос клиента — для свободного текста
+            models.Index(
+                fields=['client', '-last_activity_at'],
+                condition=models.Q(completed_at__isnull=True),
+                name='session_open_idx',
+            ),
+            # брошенные на середине опросы, которым ещё не напоминали (eflab/reminders.py)
+            models.Index(
+                fields=['last_activity_at'],
+                condition=models.Q(completed_at__isnull=True, reminder_sent_at__isnull=True, answered_count__gt=0),
+                name='session_remind_idx',
+            ),
+        ]
+
+
+class SelectionState(models.Model):
+    """
+    Незавершённый мультивыбор (one_of_some) пользователя.
+    Используется DB-бэкендом хранилища выбора (eflab/selection_store.py),
+    чтобы выбор переживал рестарт и был виден всем процессам бота.
+    """
+    tg_id = models.BigIntegerField(verbose_name='tg id пользователя')
+    question_id = models.BigIntegerField(verbose_name='id вопроса')
+    chosen = models.JSONField(default=list, verbose_name='выбранные варианты')
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='время изменения')
+
+    def __str__(self):
+        return f'{self.tg_id}: {self.question_id}'
+
+    class Meta:
+        verbose_name = 'состояние мультивыбора'
+        verbose_name_plural = 'состояния мультивыбора'
+        constraints = [
+            models.UniqueConstraint(fields=['tg_id', 'question_id'], name='uniq_selection_user_question'),
+        ]
+
+
+class AnswerExport(models.Model):
+    """
+    Фоновая выгрузка ответов в CSV (eflab/exports.py) — для объёмов,
+    которые не стоит отдавать одним запросом. Файл ложится в
+    MEDIA_ROOT/exports, прогресс виден в админке.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'в очереди'),
+        ('running', 'выполняется'),
+        ('done', 'готово'),
+        ('failed', 'ошибка'),
+    ]
+
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, verbose_name='опрос', **NULLABLE)
+    date_from = models.DateTimeField(verbose_name='ответы с', **NULLABLE)
+    date_to = models.DateTimeField(verbose_name='ответы по', **NULLABLE)
+    gzip = models.BooleanField(default=True, verbose_name='сжать (gzip)')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name='статус')
+    rows_total = models.PositiveBigIntegerField(default=0, verbose_name='всего строк')
+    rows_done = models.PositiveBigIntegerField(default=0, verbose_name='выгружено строк')
+    file = models.FileField(upload_to='exports/', verbose_name='файл', **NULLABLE)
+    error = models.TextField(blank=True, default='', verbose_name='ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='создана')
+    heartbeat_at = models.DateTimeField(verbose_name='последний прогресс', **NULLABLE)
+    finished_at = models.DateTimeField(verbose_name='завершена', **NULLABLE)
+
+    def __str__(self):
+        return f'Выгрузка #{self.pk} ({self.get_status_display()})'
+
+    @property
+    def progress(self) -> int:
+        if self.status == 'done':
+            return 100
+        return int(self.rows_done * 100 / self.rows_total) if self.rows_total else 0
+
+    class Meta:
+        verbose_name = 'выгрузка ответов'
+        verbose_name_plural = 'выгрузки ответов'
+        ordering = ('-created_at',)
+
+
+class DumpWatermark(models.Model):
+    """
+    Верхняя граница (id ответа) уже выгруженных данных инкрементальной
+    выгрузки (manage.py dump_answers): следующий запуск читает только id > last_answer_id.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name='выгрузка')
+    last_answer_id = models.BigIntegerField(default=0, verbose_name='последний выгруженный id ответа')
+    last_answer_date = models.DateTimeField(verbose_name='время последнего ответа', **NULLABLE)
+    rows_total = models.PositiveBigIntegerField(default=0, verbose_name='выгружено строк всего')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='обновлено')
+
+    def __str__(self):
+        return f'{self.name}: id ≤ {self.last_answer_id}'
+
+    class Meta:
+        verbose_name = 'отметка выгрузки'
+        verbose_name_plural = 'отметки выгрузок'
+
+
+class QuestionAnswerStat(models.Model):
+    """
+    Материализованные счётчики ответов (eflab/aggregates.py).
+    option = '' — всего ответов на вопрос; для yes_or_no — «Да»/«Нет»,
+    для one_of_some — каждый выбранный вариант отдельно.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='answer_stats', verbose_name='вопрос')
+    option = models.CharField(max_length=255, blank=True, default='', verbose_name='вариант')
+    count = models.BigIntegerField(default=0, verbose_name='ответов')
+
+    def __str__(self):
+        return f'{self.question_id}: {self.option or "всего"} = {self.count}'
+
+    class Meta:
+        verbose_name = 'счётчик ответов'
+        verbose_name_plural = 'счётчики ответов'
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'option'], name='uniq_stat_question_option'),
+        ]
+
+
+class Broadcast(TgFileCacheMixin):
+    """
+    Рассылка приглашения в опрос (ссылка t.me/<бот>?start=<slug>).
+    Отправляет бот фоновой задачей (eflab/broadcasts.py + bot.py): получатели
+    идут пачками по id клиента, отметка last_client_id сдвигается после
+    записи статусов пачки — после падения рассылка продолжается с неё.
+    """
+    AUDIENCE_CHOICES = [
+        ('all', 'все клиенты'),
+        ('not_started', 'ещё не начинали этот опрос'),
+        ('not_completed', 'начали, но не закончили'),
+    ]
+    STATUS_CHOICES = [
+        ('draft', 'черновик'),
+        ('queued', 'в очереди'),
+        ('running', 'отправляется'),
+        ('paused', 'на паузе'),
+        ('done', 'завершена'),
+    ]
+
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, verbose_name='опрос')
+    audience = models.CharField(max_length=20, choices=AUDIENCE_CHOICES, default='not_started', verbose_name='кому')
+    text = models.TextField(verbose_name='текст приглашения')
+    button_text = models.CharField(max_length=64, default='Пройти опрос', verbose_name='текст кнопки')
+    file = models.FileField(upload_to='broadcasts/', verbose_name='файл', **NULLABLE)
+    kind_file = models.CharField(max_length=100, choices=Question.KINDS, verbose_name='тип файла', **NULLABLE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='draft', verbose_name='статус')
+    last_client_id = models.BigIntegerField(default=0, verbose_name='отметка (id клиента)')
+    total = models.PositiveIntegerField(default=0, verbose_name='получателей')
+    sent_count = models.PositiveIntegerField(default=0, verbose_name='доставлено')
+    blocked_count = models.PositiveIntegerField(default=0, verbose_name='бот заблокирован')
+    failed_count = models.PositiveIntegerField(default=0, verbose_name='ошибок')
+    heartbeat_at = models.DateTimeField(verbose_name='последняя пачка', **NULLABLE)
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='создана')
+    started_at = models.DateTimeField(verbose_name='начата', **NULLABLE)
+    finished_at = models.DateTimeField(verbose_name='завершена', **NULLABLE)
+
+    def __str__(self):
+        return f'Рассылка #{self.pk}: {self.survey}'
+
+    def save(self, *args, **kwargs):
+        # как у подарка: файл в черновике могут заменить — тип пересчитываем всегда
+        self.kind_file = guess_media_kind(self.file.name) if self.file else None
+        super().save(*args, **kwargs)
+
+    @property
+    def processed(self) -> int:
+        return self.sent_count + self.blocked_count + self.failed_count
+
+    @property
+    def progress(self) -> int:
+        if self.status == 'done':
+            return 100
+        return min(100, int(self.processed * 100 / self.total)) if self.total else 0
+
+    class Meta:
+        verbose_name = 'рассылка'
+        verbose_name_plural = 'рассылки'
+        ordering = ('-created_at',)
+
+
+class BroadcastDelivery(models.Model):
+    """Статус отправки рассылки одному клиенту; пишется пачками."""
+    STATUS_CHOICES = [
+        ('sent', 'доставлено'),
+        ('blocked', 'бот заблокирован'),
+        ('failed', 'ошибка'),
+    ]
+
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.CASCADE, related_name='deliveries', verbose_name='рассылка')
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, verbose_name='клиент')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, verbose_name='статус')
+    error = models.CharField(max_length=255, blank=True, default='', verbose_name='ошибка')
+    sent_at = models.DateTimeField(default=timezone.now, verbose_name='время')
+
+    def __str__(self):
+        return f'{self.broadcast_id} → {self.client_id}: {self.status}'
+
+    class Meta:
+        verbose_name = 'доставка рассылки'
+        verbose_name_plural = 'доставки рассылок'
+        constraints = [
+            models.UniqueConstraint(fields=['broadcast', 'client'], name='uniq_delivery_broadcast_client'),
+        ]
@@ -0,0 +1,51 @@
+# eflab/paginator.py
+"""
+Пагинатор админки для больших таблиц (Answer, Client).
+
+Стандартный Paginator на каждой странице списка делает точный
+SELECT COUNT(*) — на миллионах ответов это полный проход таблицы.
+Без фильтров и поиска число строк берём из статистики Postgres
+(pg_class.reltuples, обновляет autovacuum/ANALYZE): приблизительно,
+зато мгновенно. С фильтром считаем точно — там обычно работает индекс.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+
+
+ESTIMATE_SQL = """
+SELECT CASE WHEN p.relkind = 'p' THEN (
+    -- секционированная таблица (eflab/partitions.py): сумма по секциям
+    SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), -1)
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = p.oid
+) ELSE p.reltuples END::bigint
+FROM pg_class p WHERE p.oid = %s::regclass
+"""
+
+
+def estimated_rows(using: str, table: str) -> int:
+    """Оценка числа строк таблицы; -1 — статистики нет (таблицу ещё не анализировали)."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(ESTIMATE_SQL, [table])
+        row = cursor.fetchone()
+    return row[0] if row else -1
+
+
+class EstimatedCountPaginator(Paginator):
+    # на маленьких таблицах оценка неточна, а точный COUNT дёшев
+    exact_below = 10_000
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if (
+            isinstance(qs, QuerySet)
+            and connections[qs.db].vendor == "postgresql"
+            and not qs.query.where
+        ):
+            estimate = estimated_rows(qs.db, qs.model._meta.db_table)
+            if estimate >= self.exact_below:
+                return estimate
+        return super().count
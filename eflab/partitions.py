@@ -0,0 +1,336 @@
+# eflab/partitions.py
+"""
+Помесячное секционирование таблицы ответов (Postgres, PARTITION BY RANGE (date)).
+
+Переход со старой таблицы — миграция 0021_partition_answers (convert()),
+без переписывания данных и без долгих блокировок:
+
+  1. Подготовка, запись не блокируется: уникальные индексы (id, date) и
+     (outbox_id, date) строятся CONCURRENTLY, CHECK (date < граница)
+     добавляется NOT VALID и проверяется VALIDATE.
+  2. Одна короткая транзакция под ACCESS EXCLUSIVE: старая таблица
+     переименовывается в eflab_answer_legacy, создаётся секционированная
+     eflab_answer с теми же колонками, индексами, внешними ключами и
+     триггером поиска, а старая таблица подключается секцией
+     «всё до границы». Диапазон берётся из уже проверенного CHECK (без
+     скана), индексы — уже построенные индексы старой таблицы (уникальные
+     из шага 1 становятся ограничениями через USING INDEX).
+  3. Секции на месяцы вперёд.
+
+Граница — начало месяца через один от текущего: старая таблица ещё
+месяц-другой принимает новые ответы, зато переход в последний день
+месяца не упрётся в CHECK.
+
+Чем секционированная таблица отличается от обычной (модель Answer и
+миграция 0021 описывают именно её, на всех БД):
+- первичный ключ (id, date): уникальный ключ обязан включать ключ
+  секционирования. Для Django pk по-прежнему id — он из одной
+  последовательности, а составной pk Django не умеет ни в админке, ни
+  во внешних ключах. Менять поле id миграциями нельзя;
+- outbox_id уникален вместе с date (answer_outbox_date_uniq);
+- uniq_answer_client_que_attempt на всей таблице невозможен (он остаётся
+  только на legacy-секции). От дублей защищает NOT EXISTS в записи бота:
+  апдейты одного пользователя и так идут по очереди (PerUserMailbox,
+  шардирование вебхука по пользователю);
+- внешний ключ AnswerMark.answer в БД снят (db_constraint=False): ссылаться
+  можно только на ключ целиком. Каскад при удалении ответа делает Django,
+  при удалении секций — manage.py answer_retention.
+
+DEFAULT-секции нет: при ней нельзя DETACH ... CONCURRENTLY, а ATTACH новой
+секции сканирует DEFAULT и падает, если там есть строки её диапазона.
+Поэтому секции создаются заранее: бот досоздаёт их на старте и раз в
+PARTITION_CHECK_INTERVAL (run(), на PARTITION_MONTHS_AHEAD месяцев вперёд),
+manage.py partition_answers по cron — страховка на случай, когда бот
+долго не перезапускался и не работал. Без секции вставка ответа падает.
+"""
+import asyncio
+import logging
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timezone as dt_timezone
+from typing import List, Optional
+
+from django.db import connection, transaction
+
+from .models import Answer
+
+TABLE = Answer._meta.db_table
+LEGACY = f"{TABLE}_legacy"
+DEFAULT = f"{TABLE}_default"
+SEARCH_TRIGGER = f"{TABLE}_search_vector"  # из миграции 0015
+OUTBOX_UNIQUE = "answer_outbox_date_uniq"   # как в Answer.Meta.constraints
+ENSURE_LOCK = 0x65666C6170  # pg advisory lock: секции досоздаёт один процесс
+
+logger = logging.getLogger(__name__)
+
+_BOUND_RE = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \((?:'([^']+)'|MAXVALUE)\)")
+
+
+@dataclass
+class Partition:
+    name: str
+    lower: Optional[datetime]  # None — MINVALUE
+    upper: Optional[datetime]  # None — MAXVALUE
+    is_default: bool = False
+    detach_pending: bool = False  # DETACH CONCURRENTLY прервался посередине
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, n: int) -> date:
+    month = d.month - 1 + n
+    return d.replace(year=d.year + month // 12, month=month % 12 + 1, day=1)
+
+
+def month_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def _ts(d: date) -> str:
+    # границы секций — полночь UTC (date — timestamptz)
+    return datetime(d.year, d.month, d.day, tzinfo=dt_timezone.utc).isoformat()
+
+
+def is_partitioned(cursor) -> bool:
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [TABLE])
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor) -> List[Partition]:
+    cursor.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), i.inhdetachpending
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+        """,
+        [TABLE],
+    )
+    parts = []
+    for name, bound, pending in cursor.fetchall():
+        if bound == "DEFAULT":
+            parts.append(Partition(name, None, None, is_default=True, detach_pending=pending))
+            continue
+        m = _BOUND_RE.search(bound)
+        lower, upper = m.groups() if m else (None, None)
+        parts.append(Partition(
+            name,
+            datetime.fromisoformat(lower) if lower else None,
+            datetime.fromisoformat(upper) if upper else None,
+            detach_pending=pending,
+        ))
+    return parts
+
+
+def _create_month(cursor, month: date) -> str:
+    name = month_name(month)
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (LIKE "{TABLE}" INCLUDING DEFAULTS)')
+    cursor.execute(
+        f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{name}" FOR VALUES FROM (%s) TO (%s)',
+        [_ts(month), _ts(add_months(month, 1))],
+    )
+    return name
+
+
+def ensure_partitions(cursor, months_ahead: int = 3, today: Optional[date] = None) -> List[str]:
+    """
+    Досоздать помесячные секции до months_ahead месяцев вперёд.
+    Секция создаётся отдельной пустой таблицей и подключается ATTACH —
+    это SHARE UPDATE EXCLUSIVE на родителе, чтение и запись не ждут.
+    """
+    parts = list_partitions(cursor)
+    covered_to = max((p.upper for p in parts if p.upper), default=None)
+    month = month_start(today or date.today())
+    if covered_to is not None:
+        month = max(month, covered_to.date())
+    last = add_months(month_start(today or date.today()), months_ahead)
+    created = []
+    while month <= last:
+        created.append(_create_month(cursor, month))
+        month = add_months(month, 1)
+    return created
+
+
+def ensure_ahead(months_ahead: int = 3) -> List[str]:
+    """
+    ensure_partitions из процесса бота. Воркеров несколько — под advisory-
+    блокировкой: кто не взял её, пропускает проход (секции создаёт другой).
+    """
+    if connection.vendor != "postgresql":
+        return []
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return []
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [ENSURE_LOCK])
+        if not cursor.fetchone()[0]:
+            return []
+        cursor.execute("SET LOCAL lock_timeout = '5s'")
+        return ensure_partitions(cursor, months_ahead)
+
+
+async def run(executor, interval: float = 6 * 3600, months_ahead: int = 3) -> None:
+    """Фоновая задача бота: секции вперёд сразу на старте и затем раз в interval."""
+    while True:
+        try:
+            created = await executor.run(ensure_ahead, months_ahead)
+            if created:
+                logger.info("partitions: созданы %s", ", ".join(created))
+        except Exception:
+            logger.exception("partitions: не удалось создать секции, повторим позже")
+        await asyncio.sleep(interval)
+
+
+def add_index_concurrently(cursor, name: str, definition: str) -> None:
+    """
+    CREATE INDEX CONCURRENTLY на секционированной таблице Postgres не умеет:
+    пустой индекс ON ONLY на родителе, затем CONCURRENTLY на каждой секции
+    и ATTACH — индекс родителя станет рабочим, когда подключены все.
+    definition — всё после «ON таблица», например «USING gin (...)».
+    Новые секции (LIKE + ATTACH) получают индекс сами.
+    """
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON ONLY "{TABLE}" {definition}')
+    for p in list_partitions(cursor):
+        child = f"{p.name}_{name}"[:63]
+        cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{child}" ON "{p.name}" {definition}')
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits WHERE inhrelid = %s::regclass AND inhparent = %s::regclass", [child, name]
+        )
+        if cursor.fetchone() is None:
+            cursor.execute(f'ALTER INDEX "{name}" ATTACH PARTITION "{child}"')
+
+
+def drop_default(cursor) -> List[str]:
+    """
+    Убрать DEFAULT-секцию, оставшуюся от прежних версий partition_answers.
+    Её строки (ответы за месяцы, секции которых не успели создать)
+    переезжают в помесячные секции. Вызывать внутри transaction.atomic():
+    обычный DETACH берёт ACCESS EXCLUSIVE, но строк в DEFAULT немного.
+    """
+    default = next((p for p in list_partitions(cursor) if p.is_default), None)
+    if default is None:
+        return []
+    cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{default.name}"')
+    cursor.execute(f'SELECT DISTINCT date_trunc(\'month\', date AT TIME ZONE \'UTC\')::date FROM "{default.name}"')
+    created = [_create_month(cursor, row[0]) for row in sorted(cursor.fetchall())]
+    cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{default.name}"')
+    cursor.execute(f'DROP TABLE "{default.name}"')
+    return created
+
+
+def detach(cursor, partition: Partition) -> None:
+    """
+    DETACH ... CONCURRENTLY (только вне транзакции): без ACCESS EXCLUSIVE на
+    родителе. Если прошлый запуск прервался посередине — FINALIZE.
+    """
+    mode = "FINALIZE" if partition.detach_pending else "CONCURRENTLY"
+    cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{partition.name}" {mode}')
+
+
+# ---------------- переход со старой таблицы ----------------
+def prepare_legacy(cursor, boundary: date) -> None:
+    """Шаг 1 (вне транзакции): всё, что долго, — без блокировки записи."""
+    cursor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{LEGACY}_id_date" ON "{TABLE}" (id, date)')
+    cursor.execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "{LEGACY}_outbox_date" ON "{TABLE}" (outbox_id, date)'
+    )
+    cursor.execute(f'ALTER TABLE "{TABLE}" DROP CONSTRAINT IF EXISTS "{LEGACY}_range"')
+    cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{LEGACY}_range" CHECK (date < %s) NOT VALID', [_ts(boundary)])
+    cursor.execute(f'ALTER TABLE "{TABLE}" VALIDATE CONSTRAINT "{LEGACY}_range"')
+
+
+def swap_to_partitioned(cursor, boundary: date) -> None:
+    """Шаг 2: вызывать внутри transaction.atomic() — всё ниже занимает миллисекунды."""
+    cursor.execute(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE')
+
+    cursor.execute(
+        "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'", [TABLE]
+    )
+    identity = cursor.fetchone()[0]
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{TABLE}"')
+    max_id = cursor.fetchone()[0]
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+    sequence = cursor.fetchone()[0]
+
+    # обычные индексы переедут на родителя под теми же именами
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = %s::regclass AND NOT x.indisunique
+        """,
+        [TABLE],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    incoming = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [TABLE]
+    )
+    pkey = cursor.fetchone()[0]
+
+    for table, name in incoming:  # AnswerMark.answer и т.п.
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY}"')
+    cursor.execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{pkey}"')  # PK (id) заменит (id, date)
+    # готовые индексы шага 1 — ограничениями: ATTACH подключает к PK и UNIQUE
+    # родителя только индексы ограничений, иначе строит новые под блокировкой
+    cursor.execute(f'ALTER TABLE "{LEGACY}" ADD CONSTRAINT "{LEGACY}_pkey" PRIMARY KEY USING INDEX "{LEGACY}_id_date"')
+    cursor.execute(
+        f'ALTER TABLE "{LEGACY}" ADD CONSTRAINT "{LEGACY}_outbox_date_key" UNIQUE USING INDEX "{LEGACY}_outbox_date"'
+    )
+    cursor.execute(f'DROP TRIGGER IF EXISTS "{SEARCH_TRIGGER}" ON "{LEGACY}"')
+    for name, _ in indexes:
+        cursor.execute(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"')
+    if identity:
+        cursor.execute(f'ALTER TABLE "{LEGACY}" ALTER COLUMN id DROP IDENTITY')
+
+    cursor.execute(f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY}" INCLUDING DEFAULTS) PARTITION BY RANGE (date)')
+    if identity:
+        cursor.execute(
+            f'ALTER TABLE "{TABLE}" ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {max_id + 1})'
+        )
+    elif sequence:
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE}".id')
+    cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{pkey}" PRIMARY KEY (id, date)')
+    cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{OUTBOX_UNIQUE}" UNIQUE (outbox_id, date)')
+    for _, definition in indexes:
+        cursor.execute(definition)  # «ON public.eflab_answer» — теперь это родитель
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{name}" {definition}')
+    cursor.execute(f"""
+        CREATE TRIGGER "{SEARCH_TRIGGER}"
+        BEFORE INSERT OR UPDATE OF ans ON "{TABLE}"
+        FOR EACH ROW EXECUTE FUNCTION {SEARCH_TRIGGER}()
+    """)
+
+    # индексы и FK старой таблицы совпадают с родительскими — ATTACH их подхватит
+    cursor.execute(
+        f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{LEGACY}" FOR VALUES FROM (MINVALUE) TO (%s)', [_ts(boundary)]
+    )
+    cursor.execute(f'ALTER TABLE "{LEGACY}" DROP CONSTRAINT "{LEGACY}_range"')
+
+
+def convert(cursor, lock_timeout: str = "5s", months_ahead: int = 3, today: Optional[date] = None) -> date:
+    """
+    Весь переход (шаги 1–3). Вне транзакции: шаг 1 — CONCURRENTLY.
+    Если блокировку таблицы за lock_timeout взять не удалось — ошибка,
+    повторный запуск продолжит (шаг 1 идемпотентен). Возвращает границу.
+    """
+    boundary = add_months(month_start(today or date.today()), 2)
+    prepare_legacy(cursor, boundary)
+    with transaction.atomic():
+        cursor.execute("SET LOCAL lock_timeout = %s", [lock_timeout])
+        swap_to_partitioned(cursor, boundary)
+    ensure_partitions(cursor, months_ahead, today)
+    return boundary
+
@@ -0,0 +1,66 @@
+# eflab/reminders.py
+"""
+Напоминания тем, кто бросил опрос на середине: работа с БД. Отправляет бот
+(bot.py, раздел «НАПОМИНАНИЯ») через тот же планировщик, что и рассылки.
+
+«Брошен» — курсор SurveySession не завершён, ответы есть, последней
+активности больше idle_after назад. Выборка идёт по частичному индексу
+session_remind_idx (last_activity_at WHERE completed_at IS NULL AND
+reminder_sent_at IS NULL AND answered_count > 0): напомненные и завершённые
+из индекса выпадают, поэтому проход стоит O(напоминаний к отправке), а не
+O(клиенты × опросы), и таблицу ответов не трогает.
+
+Одно напоминание на попытку: reminder_sent_at сбрасывает только ретейк.
+Отметка ставится до отправки (не больше одного сообщения даже при падении),
+строки берутся FOR UPDATE SKIP LOCKED — несколько процессов бота не
+напомнят дважды.
+"""
+from datetime import timedelta
+from typing import Callable, List, Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SurveySession
+
+
+def due(idle_after: timedelta, max_age: timedelta):
+    """
+    Брошенные опросы по возрастанию последней активности. Старше max_age
+    не напоминаем: через месяцы напоминание скорее раздражает.
+    """
+    now = timezone.now()
+    return SurveySession.objects.filter(
+        completed_at__isnull=True,
+        reminder_sent_at__isnull=True,
+        answered_count__gt=0,
+        last_activity_at__lt=now - idle_after,
+        last_activity_at__gte=now - max_age,
+        survey__active=True,
+        client__tg_id__isnull=False,
+    ).order_by("last_activity_at")
+
+
+def claim_due(idle_after: timedelta, max_age: timedelta, limit: int,
+              pending: Optional[Callable[[SurveySession], SurveySession]] = None) -> List[SurveySession]:
+    """
+    Взять до limit брошенных опросов и отметить напоминание отправленным.
+    pending — наложить несброшенное состояние курсора (answer_outbox.apply_pending):
+    кто успел ответить, пока ответ лежит в журнале, не брошен — его не отмечаем,
+    следующий проход увидит уже сброшенный курсор.
+    """
+    with transaction.atomic():
+        sessions = list(
+            due(idle_after, max_age)
+            .select_related("client", "survey")
+            .select_for_update(of=("self",), skip_locked=True)[:limit]
+        )
+        if pending is not None:
+            cutoff = timezone.now() - idle_after
+            sessions = [
+                s for s in sessions
+                if not pending(s).is_completed and s.last_activity_at < cutoff
+            ]
+        if sessions:
+            SurveySession.objects.filter(pk__in=[s.pk for s in sessions]).update(reminder_sent_at=timezone.now())
+    return sessions
@@ -0,0 +1,69 @@
+# eflab/search.py
+"""
+Поиск по ответам и вопросам для админки (Postgres).
+
+Основной путь — полнотекстовый: search_vector (to_tsvector('russian', ...),
+держит триггер из миграции 0015) + GIN-индекс, запрос websearch_to_tsquery —
+«оплата» находит и «оплаты», работают кавычки и минус.
+Запасной путь для части слова — icontains по GIN-индексу триграмм на
+UPPER(текст); для строк короче TRIGRAM_MIN_LEN триграммы не помогают,
+и его не включаем.
+
+Ответы ищутся как UNION трёх выборок id: по своему тексту и ТГ-аккаунту
+(BitmapOr по GIN-индексам), по найденным вопросам (индекс que_id) и по
+найденным клиентам (answer_client_que_idx). Условия через OR на одной
+выборке заставили бы Postgres сканировать ответы целиком, а подстановка
+списка id обрезала бы совпадения у частых слов.
+"""
+from django.contrib.postgres.search import SearchQuery
+from django.db.models import Q
+
+from .models import Answer, Client, Question
+
+CONFIG = "russian"
+TRIGRAM_MIN_LEN = 3
+
+
+def text_query(term: str) -> SearchQuery:
+    return SearchQuery(term, config=CONFIG, search_type="websearch")
+
+
+def _text_match(field: str, term: str) -> Q:
+    cond = Q(search_vector=text_query(term))
+    if len(term) >= TRIGRAM_MIN_LEN:
+        cond |= Q(**{f"{field}__icontains": term})
+    return cond
+
+
+def search_questions(queryset, term: str):
+    return queryset.filter(_text_match("que_text", term))
+
+
+def search_clients(queryset, term: str):
+    """
+    Клиенты: имя и ТГ-аккаунт — по триграммам UPPER(...); число — это tg_id
+    (уникальный индекс) или часть телефона; «@» — почта.
+    """
+    cond = Q(name__icontains=term) | Q(acc_tg__icontains=term)
+    if term.isdigit():
+        cond = Q(phone__contains=term)
+        if len(term) <= 18:  # влезает в bigint
+            cond |= Q(tg_id=int(term))
+    elif "@" in term:
+        cond |= Q(email__icontains=term)
+    return queryset.filter(cond)
+
+
+def search_answers(queryset, term: str):
+    """
+    Ответы, где term есть в тексте ответа или в ТГ-аккаунте на момент ответа,
+    в тексте вопроса или в имени / ТГ-аккаунте клиента.
+    """
+    own = _text_match("ans", term)
+    if len(term) >= TRIGRAM_MIN_LEN:
+        own |= Q(client_tg_acc__icontains=term)
+    ids = Answer.objects.filter(own).values("id").union(
+        Answer.objects.filter(que__in=search_questions(Question.objects.all(), term).values("id")).values("id"),
+        Answer.objects.filter(client_id__in=search_clients(Client.objects.all(), term).values("id")).values("id"),
+    )
+    return queryset.filter(id__in=ids)
@@ -0,0 +1,145 @@
+# eflab/selection_store.py
+"""
+Хранилище незавершённого мультивыбора: (tg_id, question_id) -> set вариантов.
+
+Бэкенды:
+  memory — LRU в памяти процесса с TTL и лимитом записей;
+  db     — таблица SelectionState: переживает рестарт, общая для всех процессов бота.
+Выбирается настройкой SELECTION_STORE.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .db_executor import get_db_executor
+from .models import SelectionState
+
+Key = Tuple[int, int]
+
+
+class SelectionStore(ABC):
+    """Общий интерфейс. Все методы async — DB-бэкенд ходит в базу."""
+
+    @abstractmethod
+    async def get(self, tg_id: int, question_id: int) -> Set[str]:
+        """Выбранные варианты; пусто, если выбора нет или он просрочен."""
+
+    @abstractmethod
+    async def toggle(self, tg_id: int, question_id: int, value: str) -> Set[str]:
+        """Отметить / снять вариант, вернуть выбор после переключения."""
+
+    @abstractmethod
+    async def clear(self, tg_id: int, question_id: int) -> None:
+        """Забыть выбор (ответ сохранён или пропущен)."""
+
+
+class MemorySelectionStore(SelectionStore):
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[Key, Tuple[Set[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_entry(self, key: Key) -> Optional[Set[str]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        chosen, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return chosen
+
+    def _put(self, key: Key, chosen: Set[str]) -> None:
+        self._data[key] = (chosen, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def get(self, tg_id: int, question_id: int) -> Set[str]:
+        with self._lock:
+            chosen = self._get_entry((tg_id, question_id))
+            return set(chosen) if chosen else set()
+
+    async def toggle(self, tg_id: int, question_id: int, value: str) -> Set[str]:
+        key = (tg_id, question_id)
+        with self._lock:
+            chosen = set(self._get_entry(key) or ())
+            chosen ^= {value}
+            self._put(key, chosen)
+            return set(chosen)
+
+    async def clear(self, tg_id: int, question_id: int) -> None:
+        with self._lock:
+            self._data.pop((tg_id, question_id), None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DbSelectionStore(SelectionStore):
+    # раз в столько записей чистим просроченные строки
+    PURGE_EVERY = 500
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._writes = 0
+
+    def _fresh_since(self):
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def _get_sync(self, tg_id: int, question_id: int) -> Set[str]:
+        chosen = (
+            SelectionState.objects
+            .filter(tg_id=tg_id, question_id=question_id, updated_at__gte=self._fresh_since())
+            .values_list("chosen", flat=True)
+            .first()
+        )
+        return set(chosen or ())
+
+    def _toggle_sync(self, tg_id: int, question_id: int, value: str) -> Set[str]:
+        with transaction.atomic():
+            state, _ = SelectionState.objects.select_for_update().get_or_create(
+                tg_id=tg_id, question_id=question_id
+            )
+            chosen = set(state.chosen or ()) if state.updated_at >= self._fresh_since() else set()
+            chosen ^= {value}
+            state.chosen = sorted(chosen)
+            state.updated_at = timezone.now()
+            state.save(update_fields=["chosen", "updated_at"])
+        self._maybe_purge()
+        return chosen
+
+    def _clear_sync(self, tg_id: int, question_id: int) -> None:
+        SelectionState.objects.filter(tg_id=tg_id, question_id=question_id).delete()
+
+    def _maybe_purge(self) -> None:
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            SelectionState.objects.filter(updated_at__lt=self._fresh_since()).delete()
+
+    async def get(self, tg_id: int, question_id: int) -> Set[str]:
+        return await get_db_executor().run(self._get_sync, tg_id, question_id)
+
+    async def toggle(self, tg_id: int, question_id: int, value: str) -> Set[str]:
+        return await get_db_executor().run(self._toggle_sync, tg_id, question_id, value)
+
+    async def clear(self, tg_id: int, question_id: int) -> None:
+        await get_db_executor().run(self._clear_sync, tg_id, question_id)
+
+
+def build_selection_store(backend: Optional[str] = None) -> SelectionStore:
+    backend = (backend or getattr(settings, "SELECTION_STORE", "memory")).lower()
+    ttl = getattr(settings, "SELECTION_TTL", 24 * 3600)
+    if backend == "db":
+        return DbSelectionStore(ttl=ttl)
+    if backend == "memory":
+        return MemorySelectionStore(ttl=ttl, max_entries=getattr(settings, "SELECTION_MAX_ENTRIES", 100_000))
+    raise ValueError(f"Неизвестный SELECTION_STORE: {backend!r} (ожидается memory или db)")
@@ -0,0 +1,26 @@
+# eflab/signals.py
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+
+from . import aggregates
+from .models import Survey, Question, Mark, SurveyGift, SurveyStructureVersion, Answer
+
+STRUCTURE_MODELS = (Survey, Question, Mark, SurveyGift)
+
+
+def _bump_structure_version(sender, **kwargs):
+    """Любое изменение структуры опроса инвалидирует кэш бота."""
+    if kwargs.get("raw"):
+        return
+    SurveyStructureVersion.bump()
+
+
+for _model in STRUCTURE_MODELS:
+    post_save.connect(_bump_structure_version, sender=_model, dispatch_uid=f"structure_save_{_model.__name__}")
+    post_delete.connect(_bump_structure_version, sender=_model, dispatch_uid=f"structure_delete_{_model.__name__}")
+
+# счётчики ответов (eflab/aggregates.py): вставки учитывает потребитель,
+# сигналы — только правку и удаление уже учтённых ответов
+pre_save.connect(aggregates.on_answer_pre_save, sender=Answer, dispatch_uid="answer_stats_pre_save")
+post_save.connect(aggregates.on_answer_post_save, sender=Answer, dispatch_uid="answer_stats_save")
+pre_delete.connect(aggregates.on_answer_pre_delete, sender=Answer, dispatch_uid="answer_stats_pre_delete")
+post_delete.connect(aggregates.on_answer_post_delete, sender=Answer, dispatch_uid="answer_stats_delete")
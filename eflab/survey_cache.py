@@ -0,0 +1,143 @@
+# eflab/survey_cache.py
+"""
+Кэш структуры активных опросов для бота.
+
+Структура (опросы, вопросы, кнопки, подарки) меняется только из админки,
+а читается на каждом шаге опроса. Поэтому держим в памяти снапшот всех
+активных опросов и пересобираем его, когда меняется
+SurveyStructureVersion (штамп увеличивают сигналы в eflab/signals.py).
+Штамп проверяется не чаще одного раза в SURVEY_CACHE_CHECK_INTERVAL секунд —
+один дешёвый запрос вместо десятка на каждый клик.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, List, Tuple, Dict
+
+from django.conf import settings
+
+from .models import Survey, Question, Mark, SurveyGift, SurveyStructureVersion
+
+
+@dataclass(frozen=True)
+class SurveySnapshot:
+    survey: Survey
+    questions: Tuple[Question, ...]
+    gift: Optional[SurveyGift]
+
+    @property
+    def total(self) -> int:
+        return len(self.questions)
+
+
+@dataclass
+class _State:
+    version: int = -1
+    surveys: Dict[int, SurveySnapshot] = field(default_factory=dict)
+    by_slug: Dict[str, SurveySnapshot] = field(default_factory=dict)
+    order: Tuple[int, ...] = ()
+    questions: Dict[int, Question] = field(default_factory=dict)
+    marks: Dict[int, Tuple[Mark, ...]] = field(default_factory=dict)
+
+
+class SurveyCache:
+    def __init__(self, check_interval: Optional[float] = None):
+        if check_interval is None:
+            check_interval = getattr(settings, "SURVEY_CACHE_CHECK_INTERVAL", 5.0)
+        self.check_interval = check_interval
+        self._state = _State()
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- свежесть ----------
+    def _fresh_state(self) -> _State:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._state
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._state
+            version = SurveyStructureVersion.current()
+            if version != self._state.version:
+                self._state = self._build(version)
+            self._checked_at = time.monotonic()
+            return self._state
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+            self._state = _State()
+
+    @staticmethod
+    def _build(version: int) -> _State:
+        state = _State(version=version)
+        surveys = list(Survey.objects.filter(active=True).order_by("id"))
+        survey_by_id = {s.id: s for s in surveys}
+
+        per_survey: Dict[int, List[Question]] = {s.id: [] for s in surveys}
+        for q in Question.objects.filter(survey_id__in=survey_by_id).order_by("survey_id", "numb", "id"):
+            q.survey = survey_by_id[q.survey_id]
+            per_survey[q.survey_id].append(q)
+            state.questions[q.id] = q
+
+        marks: Dict[int, List[Mark]] = {}
+        for m in Mark.objects.filter(que_id__in=state.questions).order_by("id"):
+            m.que = state.questions[m.que_id]
+            marks.setdefault(m.que_id, []).append(m)
+        state.marks = {qid: tuple(ms) for qid, ms in marks.items()}
+
+        gifts = {g.survey_id: g for g in SurveyGift.objects.filter(survey_id__in=survey_by_id)}
+
+        for s in surveys:
+            snap = SurveySnapshot(survey=s, questions=tuple(per_survey[s.id]), gift=gifts.get(s.id))
+            state.surveys[s.id] = snap
+            state.by_slug[s.slug] = snap
+        state.order = tuple(s.id for s in surveys)
+        return state
+
+    # ---------- чтение ----------
+    def snapshot(self, survey_id: int) -> Optional[SurveySnapshot]:
+        return self._fresh_state().surveys.get(survey_id)
+
+    def get_survey(self, slug: Optional[str]) -> Optional[Survey]:
+        """Опрос по slug или первый активный (как раньше в боте)."""
+        state = self._fresh_state()
+        if slug and slug in state.by_slug:
+            return state.by_slug[slug].survey
+        if state.order:
+            return state.surveys[state.order[0]].survey
+        return None
+
+    def list_active(self) -> List[Tuple[str, str]]:
+        state = self._fresh_state()
+        return [(state.surveys[sid].survey.name, state.surveys[sid].survey.slug) for sid in state.order]
+
+    def active_surveys(self) -> List[Survey]:
+        state = self._fresh_state()
+        return [state.surveys[sid].survey for sid in state.order]
+
+    def questions(self, survey_id: int) -> Tuple[Question, ...]:
+        snap = self.snapshot(survey_id)
+        return snap.questions if snap else ()
+
+    def get_question(self, qid: int) -> Optional[Question]:
+        q = self._fresh_state().questions.get(qid)
+        if q is None:
+            # вопрос неактивного опроса — редкий случай, идём в БД
+            q = Question.objects.select_related("survey").filter(id=qid).first()
+        return q
+
+    def get_marks(self, qid: int) -> List[Mark]:
+        state = self._fresh_state()
+        if qid in state.questions:
+            return list(state.marks.get(qid, ()))
+        return list(Mark.objects.filter(que_id=qid).order_by("id"))
+
+    def get_gift(self, survey_id: int) -> Optional[SurveyGift]:
+        snap = self.snapshot(survey_id)
+        if snap is None:
+            return SurveyGift.objects.filter(survey_id=survey_id).first()
+        return snap.gift
+
+
+survey_cache = SurveyCache()
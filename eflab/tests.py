@@ -1,3 +1,618 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipUnless
 
-# Create your tests here.
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from tgbot import codec
+from tgbot.middlewares import PerUserMailbox
+from tgbot.sender import SendScheduler, SendSchedulerMiddleware
+
+from . import aggregates, broadcasts, exports, partitions, search
+from .answer_outbox import AnswerOutbox
+from .models import (
+    Answer, AnswerExport, AnswerMark, Broadcast, Client, Mark, Question, QuestionAnswerStat, SelectionState, Survey,
+    SurveySession,
+)
+from .selection_store import DbSelectionStore, MemorySelectionStore, SelectionStore
+
+
+@skipUnless(connection.vendor == "postgresql", "планы запросов проверяем на Postgres")
+class QueryPlanTests(TestCase):
+    """
+    Горячие ORM-функции bot.py ходят по индексам из миграции 0009 и
+    session_open_idx. В тестовой БД строк мало, и планировщик честно
+    выбрал бы последовательный скан — поэтому EXPLAIN с enable_seqscan = off,
+    а опросов, как и в жизни, в основном архивные (active = false) и по
+    таблицам собрана статистика.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.environ.setdefault("BOT_TOKEN", "123456:test")  # bot.py без токена не импортируется
+        cls.bot = importlib.import_module("bot")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey = Survey.objects.create(name="Опрос", slug="plan", description="-", active=True)
+        cls.inactive = Survey.objects.create(name="Архив", slug="plan-old", description="-", active=False)
+        cls.questions = [
+            Question.objects.create(survey=cls.survey, numb=n, que_text=f"Вопрос {n}", type_q="text")
+            for n in (1, 2, 3)
+        ]
+        Question.objects.create(survey=cls.inactive, numb=1, que_text="Старый вопрос", type_q="text")
+        Survey.objects.bulk_create(
+            Survey(name=f"Архив {n}", slug=f"plan-old-{n}", description="-", active=False) for n in range(200)
+        )
+        cls.customer = Client.objects.create(name="Клиент", tg_id=101, email="c@example.com", phone="+7900")
+        Answer.objects.create(client_id=cls.customer, que=cls.questions[0], ans="да", client_tg_acc="client")
+        SurveySession.objects.create(
+            client=cls.customer, survey=cls.survey, current_question=cls.questions[1], answered_count=1,
+        )
+        with connection.cursor() as cursor:
+            for model in (Survey, Question, Answer, SurveySession):
+                cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+
+    def setUp(self):
+        self.bot.survey_cache.invalidate()
+
+    def plans(self, func, *args) -> str:
+        """EXPLAIN всех SELECT, которые выполнила func."""
+        with CaptureQueriesContext(connection) as ctx:
+            func(*args)
+        plans = []
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            for query in ctx.captured_queries:
+                sql = query["sql"]
+                if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                    continue
+                cursor.execute(f"EXPLAIN {sql}")
+                plans.append("\n".join(row[0] for row in cursor.fetchall()))
+        return "\n".join(plans)
+
+    def assertUsesIndex(self, index: str, func, *args):
+        plan = self.plans(func, *args)
+        self.assertIn(index, plan, f"{func.__name__}: индекс {index} не используется\n{plan}")
+
+    def test_list_active_surveys(self):
+        self.assertUsesIndex("survey_active_idx", self.bot._list_active_surveys_sync)
+
+    def test_get_survey(self):
+        self.assertUsesIndex("survey_active_idx", self.bot._get_survey_by_slug_or_first_active_sync, "plan")
+
+    def test_survey_questions(self):
+        # активный опрос собирает кэш структуры, неактивный — читается из БД
+        self.assertUsesIndex("question_survey_numb_idx", self.bot._survey_questions_sync, self.survey)
+        self.assertUsesIndex("question_survey_numb_idx", self.bot._survey_questions_sync, self.inactive)
+
+    def test_resolve_pending(self):
+        self.assertUsesIndex("session_open_idx", self.bot._resolve_pending_sync, self.customer)
+
+    def test_answers_by_client(self):
+        # таблица ответов секционирована (миграция 0021): в плане — индексы секций,
+        # созданные из answer_client_que_idx родителя
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'answer_client_que_idx'::regclass
+                """
+            )
+            indexes = [row[0] for row in cursor.fetchall()]
+        checks = [
+            (self.bot._answered_qids_sync, self.customer, self.survey, 1),
+            (self.bot._last_attempt_sync, self.customer, self.survey),
+            (self.bot._save_answer_sync, self.customer, self.questions[1], "нет"),
+        ]
+        for func, *args in checks:
+            plan = self.plans(func, *args)
+            self.assertTrue(
+                any(index in plan for index in indexes),
+                f"{func.__name__}: индексы {indexes} не используются\n{plan}",
+            )
+
+
+@skipUnless(connection.vendor == "postgresql", "секционирование — только Postgres")
+class PartitionTests(TestCase):
+    def test_legacy_indexes_reused_by_attach(self):
+        # миграция 0021: индексы шага 1 стали индексами PK и UNIQUE секции,
+        # ATTACH не строил вторые на тех же колонках
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT substring(pg_get_indexdef(x.indexrelid) FROM ' USING .*'), array_agg(c.relname ORDER BY c.relname)
+                FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+                WHERE x.indrelid = %s::regclass
+                GROUP BY 1, x.indisunique HAVING count(*) > 1
+                """,
+                [partitions.LEGACY],
+            )
+            self.assertEqual(cursor.fetchall(), [])
+            cursor.execute(
+                """
+                SELECT c.relname FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+                WHERE x.indrelid = %s::regclass AND x.indisunique
+                  AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = x.indexrelid)
+                  AND EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = x.indexrelid AND k.contype = 'p')
+                """,
+                [partitions.LEGACY],
+            )
+            self.assertEqual(cursor.fetchall(), [], "PK секции не подключён к PK родителя")
+
+    def test_bot_recreates_missing_partitions(self):
+        # cron пропустили: последней секции нет — бот досоздаёт её сам
+        with connection.cursor() as cursor:
+            last = max(partitions.list_partitions(cursor), key=lambda p: p.upper).name
+            cursor.execute(f'ALTER TABLE "{partitions.TABLE}" DETACH PARTITION "{last}"')
+            cursor.execute(f'DROP TABLE "{last}"')
+        self.assertEqual(partitions.ensure_ahead(3), [last])
+        self.assertEqual(partitions.ensure_ahead(3), [])
+
+
+@skipUnless(connection.vendor == "postgresql", "запись ответа одним запросом — только Postgres")
+class ConcurrentAnswerTests(TransactionTestCase):
+    """
+    Два одновременных ответа на один вопрос (двойной клик, два процесса бота).
+    Ответ за месяц с готовой секцией: уникального индекса (клиент, вопрос,
+    попытка) у месячных секций нет, поэтому на время теста его снимаем и
+    с legacy-секции — защищать должна только блокировка курсора.
+    """
+
+    def setUp(self):
+        os.environ.setdefault("BOT_TOKEN", "123456:test")
+        self.bot = importlib.import_module("bot")
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{partitions.LEGACY}" DROP CONSTRAINT uniq_answer_client_que_attempt')
+        self.addCleanup(self.restore_unique)
+        survey = Survey.objects.create(name="Опрос", slug="race", description="-", active=True)
+        self.questions = [
+            Question.objects.create(survey=survey, numb=n, que_text=f"Вопрос {n}", type_q="text") for n in (1, 2)
+        ]
+        self.customer = Client.objects.create(name="Клиент", tg_id=4001, email="r@example.com", phone="+74")
+        SurveySession.objects.create(client=self.customer, survey=survey, current_question=self.questions[0])
+        self.bot.survey_cache.invalidate()
+
+    def restore_unique(self):
+        Answer.objects.all().delete()  # дубли, если тест упал, не дадут вернуть ограничение
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'ALTER TABLE "{partitions.LEGACY}" ADD CONSTRAINT uniq_answer_client_que_attempt '
+                f'UNIQUE (client_id_id, que_id, attempt)'
+            )
+
+    def test_double_answer_is_written_once(self):
+        saved, second = threading.Event(), []
+
+        def first():
+            try:
+                with transaction.atomic():
+                    self.assertIsNotNone(self.bot._save_answer_sync(self.customer, self.questions[0], "да"))
+                    saved.set()
+                    time.sleep(0.5)  # второй запрос успевает упереться в блокировку
+            finally:
+                connection.close()
+
+        def other():
+            try:
+                saved.wait(5)
+                second.append(self.bot._save_answer_sync(self.customer, self.questions[0], "да"))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=other)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+
+        self.assertEqual(second, [None])
+        self.assertEqual(Answer.objects.filter(client_id=self.customer).count(), 1)
+        self.assertEqual(SurveySession.objects.get(client=self.customer).answered_count, 1)
+
+
+class SaveAnswerTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        os.environ.setdefault("BOT_TOKEN", "123456:test")
+        cls.bot = importlib.import_module("bot")
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey = Survey.objects.create(name="Опрос", slug="save", description="-", active=True)
+        cls.questions = [
+            Question.objects.create(survey=cls.survey, numb=n, que_text=f"Вопрос {n}", type_q="text") for n in (1, 2)
+        ]
+        cls.customer = Client.objects.create(name="Клиент", tg_id=5001, email="s@example.com", phone="+75")
+
+    def setUp(self):
+        self.bot.survey_cache.invalidate()
+
+    def test_answer_without_session_creates_cursor(self):
+        # клавиатура пришла до появления SurveySession — ответ не теряется
+        self.assertIsNotNone(self.bot._save_answer_sync(self.customer, self.questions[0], "да"))
+        session = SurveySession.objects.get(client=self.customer, survey=self.survey)
+        self.assertEqual((session.current_question, session.answered_count), (self.questions[1], 1))
+
+    def test_stale_question_is_not_written(self):
+        SurveySession.objects.create(client=self.customer, survey=self.survey, current_question=self.questions[1])
+        self.assertIsNone(self.bot._save_answer_sync(self.customer, self.questions[0], "да"))
+        self.assertFalse(Answer.objects.exists())
+
+
+@skipUnless(connection.vendor == "postgresql", "полнотекстовый поиск — только Postgres")
+class SearchAnswersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        survey = Survey.objects.create(name="Опрос", slug="find", description="-", active=True)
+        cls.question = Question.objects.create(survey=survey, numb=1, que_text="Любимый цвет?", type_q="text")
+
+    def test_all_matching_clients_are_searched(self):
+        # частое слово: клиентов с ним больше тысячи — ответ последнего тоже находится
+        clients = Client.objects.bulk_create(
+            Client(name=f"Иванов {n}", tg_id=6000 + n, email=f"i{n}@example.com", phone=f"+76{n}")
+            for n in range(1100)
+        )
+        answer = Answer.objects.create(client_id=clients[-1], que=self.question, ans="синий", client_tg_acc="x")
+        self.assertEqual(list(search.search_answers(Answer.objects.all(), "Иванов")), [answer])
+
+    def test_tg_account_at_answer_time(self):
+        client = Client.objects.create(name="Пётр", tg_id=7001, email="p@example.com", phone="+77")
+        answer = Answer.objects.create(client_id=client, que=self.question, ans="зелёный", client_tg_acc="old_nick")
+        self.assertEqual(list(search.search_answers(Answer.objects.all(), "old_nick")), [answer])
+
+
+class ChangelistQueryCountTests(TestCase):
+    """
+    Страница списка в админке делает одно и то же число запросов при одной
+    строке и при полной странице: аннотации, list_select_related и
+    EstimatedCountPaginator вместо запроса на строку.
+    """
+    ROWS = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def make_survey(self, n: int) -> Survey:
+        survey = Survey.objects.create(name=f"Опрос {n}", slug=f"s{n}", description="-", active=True)
+        for numb in (1, 2):
+            Question.objects.create(survey=survey, numb=numb, que_text=f"Вопрос {numb}", type_q="text")
+        return survey
+
+    def make_client(self, n: int) -> Client:
+        return Client.objects.create(name=f"Клиент {n}", tg_id=1000 + n, email=f"c{n}@example.com", phone=f"+7{n}")
+
+    def make_answer(self, n: int) -> Answer:
+        question = self.make_survey(n).question_set.first()
+        client = self.make_client(n)
+        return Answer.objects.create(client_id=client, que=question, ans=f"ответ {n}", client_tg_acc=f"c{n}")
+
+    def assertConstantQueries(self, model, make_row):
+        url = reverse(f"admin:eflab_{model._meta.model_name}_changelist")
+        make_row(0)
+        self.client.get(url)  # прогрев: кэши ContentType, сессии и т.п.
+        with CaptureQueriesContext(connection) as one_row:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for n in range(1, self.ROWS):
+            make_row(n)
+        with self.assertNumQueries(len(one_row.captured_queries)):
+            response = self.client.get(url)
+        self.assertEqual(response.context["cl"].result_count, model.objects.count())
+
+    def test_survey_changelist(self):
+        self.assertConstantQueries(Survey, self.make_survey)
+
+    def test_question_changelist(self):
+        self.assertConstantQueries(Question, self.make_survey)
+
+    def test_client_changelist(self):
+        self.assertConstantQueries(Client, self.make_client)
+
+    def test_answer_changelist(self):
+        self.assertConstantQueries(Answer, self.make_answer)
+
+
+class BroadcastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey = Survey.objects.create(name="Опрос", slug="bc", description="-", active=True)
+        cls.clients = [
+            Client.objects.create(name=f"Клиент {n}", tg_id=2000 + n, email=f"b{n}@example.com", phone=f"+8{n}")
+            for n in range(3)
+        ]
+
+    def test_replayed_page_is_counted_once(self):
+        # после падения последняя пачка уходит повторно — счётчики не должны расти
+        b = Broadcast.objects.create(survey=self.survey, text="Приглашение", status="running", total=3)
+        page = [(self.clients[0].pk, "sent", ""), (self.clients[1].pk, "blocked", "forbidden")]
+        broadcasts.save_page(b.pk, page, self.clients[1].pk)
+        broadcasts.save_page(b.pk, page + [(self.clients[2].pk, "sent", "")], self.clients[2].pk)
+        b.refresh_from_db()
+        self.assertEqual((b.sent_count, b.blocked_count, b.failed_count), (2, 1, 0))
+        self.assertEqual(b.progress, 100)
+
+    def test_heartbeat_keeps_long_page_claimed(self):
+        # пачка идёт дольше STALE_AFTER: пока бот отмечается, второй процесс её не берёт
+        stale = timezone.now() - broadcasts.STALE_AFTER - timedelta(seconds=1)
+        b = Broadcast.objects.create(survey=self.survey, text="Приглашение", status="running", heartbeat_at=stale)
+        broadcasts.heartbeat(b.pk)
+        self.assertIsNone(broadcasts.claim_next())
+        Broadcast.objects.filter(pk=b.pk).update(heartbeat_at=stale)
+        self.assertEqual(broadcasts.claim_next().pk, b.pk)
+
+    def test_kind_file_follows_replaced_file(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            b = Broadcast.objects.create(
+                survey=self.survey, text="Приглашение", file=SimpleUploadedFile("promo.jpg", b"jpg")
+            )
+            self.assertEqual(b.kind_file, "photo")
+            b.file = SimpleUploadedFile("rules.pdf", b"pdf")
+            b.save()
+            self.assertEqual(Broadcast.objects.get(pk=b.pk).kind_file, "document")
+
+
+class AnswerExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = get_user_model().objects.create_superuser("admin", "admin@example.com", "admin")
+
+    def test_run_export_marks_heartbeat(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(MEDIA_ROOT=media):
+            job = AnswerExport.objects.create(gzip=False)
+            exports.run_export(job.pk)
+            job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertIsNotNone(job.heartbeat_at)
+
+    def test_abandoned_export_fails_in_admin_list(self):
+        # поток выгрузки умер вместе с процессом — задача не должна висеть «выполняется» вечно
+        stale = timezone.now() - exports.STALE_AFTER - timedelta(seconds=1)
+        dead = AnswerExport.objects.create(status="running", heartbeat_at=stale)
+        alive = AnswerExport.objects.create(status="running", heartbeat_at=timezone.now())
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse("admin:eflab_answerexport_changelist")).status_code, 200)
+        dead.refresh_from_db()
+        alive.refresh_from_db()
+        self.assertEqual((dead.status, alive.status), ("failed", "running"))
+        self.assertIsNotNone(dead.finished_at)
+
+    def test_process_exports_fails_abandoned(self):
+        stale = timezone.now() - exports.STALE_AFTER - timedelta(seconds=1)
+        dead = AnswerExport.objects.create(status="running", heartbeat_at=stale)
+        call_command("process_exports", stdout=StringIO())
+        dead.refresh_from_db()
+        self.assertEqual(dead.status, "failed")
+
+
+class PurgeOldAttemptsTests(TestCase):
+    def test_purge_keeps_totals(self):
+        survey = Survey.objects.create(name="Опрос", slug="purge", description="-", active=True)
+        question = Question.objects.create(survey=survey, numb=1, que_text="Что выбрали?", type_q="one_of_some")
+        mark = Mark.objects.create(que=question, mark_text="Чай")
+        clients = [
+            Client.objects.create(name=f"Клиент {n}", tg_id=3000 + n, email=f"p{n}@example.com", phone=f"+9{n}")
+            for n in range(3)
+        ]
+        for client in clients:
+            SurveySession.objects.create(client=client, survey=survey, attempt=2, completed_at=None)
+            for attempt in (1, 2):
+                answer = Answer.objects.create(client_id=client, que=question, ans="Чай", attempt=attempt)
+                AnswerMark.objects.create(answer=answer, mark=mark)
+        aggregates.consume_all(lag=0)
+        totals = dict(QuestionAnswerStat.objects.values_list("option", "count"))
+
+        call_command("purge_old_attempts", "--batch-size", "2", stdout=StringIO())
+
+        self.assertEqual(set(Answer.objects.values_list("attempt", flat=True)), {2})
+        self.assertEqual(AnswerMark.objects.count(), 3)
+        self.assertEqual(dict(QuestionAnswerStat.objects.values_list("option", "count")), totals)
+        self.assertEqual(totals, {aggregates.TOTAL: 6, "Чай": 6})
+
+
+class SelectionStoreTests(TestCase):
+    async def test_memory_toggle_and_clear(self):
+        store = MemorySelectionStore(ttl=60, max_entries=10)
+        self.assertEqual(await store.toggle(1, 10, "Чай"), {"Чай"})
+        self.assertEqual(await store.toggle(1, 10, "Кофе"), {"Чай", "Кофе"})
+        self.assertEqual(await store.toggle(1, 10, "Чай"), {"Кофе"})
+        self.assertEqual(await store.get(2, 10), set())  # другой пользователь
+        await store.clear(1, 10)
+        self.assertEqual(await store.get(1, 10), set())
+
+    async def test_memory_expiry_and_limit(self):
+        store = MemorySelectionStore(ttl=0.05, max_entries=2)
+        await store.toggle(1, 10, "Чай")
+        time.sleep(0.1)
+        self.assertEqual(await store.get(1, 10), set())
+        for qid in (1, 2, 3):
+            await store.toggle(1, qid, "Чай")
+        self.assertEqual(len(store), 2)
+        self.assertEqual(await store.get(1, 1), set())  # самая старая вытеснена
+
+    def test_db_toggle_and_expiry(self):
+        store = DbSelectionStore(ttl=60)
+        self.assertEqual(store._toggle_sync(1, 10, "Чай"), {"Чай"})
+        self.assertEqual(store._toggle_sync(1, 10, "Кофе"), {"Чай", "Кофе"})
+        self.assertEqual(store._toggle_sync(1, 10, "Кофе"), {"Чай"})
+        self.assertEqual(store._get_sync(1, 10), {"Чай"})
+        SelectionState.objects.update(updated_at=timezone.now() - timedelta(seconds=61))
+        self.assertEqual(store._get_sync(1, 10), set())
+        self.assertEqual(store._toggle_sync(1, 10, "Кофе"), {"Кофе"})  # просроченный выбор не воскресает
+        store._clear_sync(1, 10)
+        self.assertFalse(SelectionState.objects.exists())
+
+    def test_interface_is_enforced(self):
+        class Partial(SelectionStore):
+            async def get(self, tg_id, question_id):
+                return set()
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+
+class AnswerOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey = Survey.objects.create(name="Опрос", slug="outbox", description="-", active=True)
+        cls.questions = [
+            Question.objects.create(survey=cls.survey, numb=n, que_text=f"Вопрос {n}", type_q="text") for n in (1, 2)
+        ]
+        cls.customer = Client.objects.create(name="Клиент", tg_id=8001, email="o@example.com", phone="+78")
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "outbox.sqlite3")
+        self.session = SurveySession.objects.create(
+            client=self.customer, survey=self.survey, current_question=self.questions[0],
+        )
+        if connection.vendor == "postgresql":
+            # как в месячных секциях: у legacy-секции остались старые уникальные ключи,
+            # которые прячут повтор; в остальных outbox_id уникален только вместе с date
+            with connection.cursor() as cursor:
+                for name in (f"{partitions.TABLE}_outbox_id_key", "uniq_answer_client_que_attempt"):
+                    cursor.execute(f'ALTER TABLE "{partitions.LEGACY}" DROP CONSTRAINT IF EXISTS "{name}"')
+
+    def accept(self, outbox: AnswerOutbox) -> None:
+        """Как бот в режиме outbox: ответ и сдвинутый курсор — в журнал."""
+        answer = Answer(client_tg_acc="c", que=self.questions[0], ans="да", client_id=self.customer)
+        self.session.current_question = self.questions[1]
+        self.session.answered_count = 1
+        outbox.append(answer, self.survey.pk, self.session)
+
+    def test_crash_before_flush_is_replayed(self):
+        outbox = AnswerOutbox(self.path)
+        self.accept(outbox)
+        fresh = SurveySession.objects.get(pk=self.session.pk)
+        self.assertEqual(outbox.apply_pending(fresh).current_question, self.questions[1])
+        outbox._conn.close()  # «падение»: в БД ещё ничего нет
+
+        restarted = AnswerOutbox(self.path)
+        self.assertEqual(restarted.pending_count(), 1)
+        self.assertEqual(restarted.flush_all(), 1)
+        self.assertEqual(Answer.objects.filter(client_id=self.customer).count(), 1)
+        session = SurveySession.objects.get(pk=self.session.pk)
+        self.assertEqual((session.current_question, session.answered_count), (self.questions[1], 1))
+
+    def test_crash_after_flush_does_not_duplicate(self):
+        outbox = AnswerOutbox(self.path)
+        self.accept(outbox)
+        payloads = [row[0] for row in outbox._conn.execute("SELECT payload FROM outbox")]
+        outbox.flush()
+        # «падение» между коммитом в БД и чисткой журнала: записи остались в журнале
+        outbox._conn.executemany("INSERT INTO outbox (payload) VALUES (?)", [(p,) for p in payloads])
+        outbox._conn.close()
+
+        restarted = AnswerOutbox(self.path)
+        self.assertEqual(restarted.flush_all(), 1)
+        self.assertEqual(restarted.pending_count(), 0)
+        self.assertEqual(Answer.objects.filter(client_id=self.customer).count(), 1)
+
+
+class SendSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.scheduler = SendScheduler(global_rate=1000, per_chat_rate=1000, per_chat_burst=10, max_retries=2)
+        self.middleware = SendSchedulerMiddleware(self.scheduler)
+        self.calls = []
+
+    def flaky(self, failures: int, retry_after: int = 1):
+        """make_request, который первые failures раз отвечает 429."""
+        async def make_request(bot, method):
+            self.calls.append(time.monotonic())
+            if len(self.calls) <= failures:
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=retry_after)
+            return "ok"
+        return make_request
+
+    async def test_retry_after_pauses_chat_and_retries(self):
+        response = await self.middleware(self.flaky(1), None, SendMessage(chat_id=1, text="x"))
+        self.assertEqual(response, "ok")
+        self.assertEqual(len(self.calls), 2)
+        self.assertGreaterEqual(self.calls[1] - self.calls[0], 0.9)  # ждали retry_after
+        self.assertEqual((self.scheduler.retries, self.scheduler.sent), (1, 1))
+
+    async def test_gives_up_after_max_retries(self):
+        with self.assertRaises(TelegramRetryAfter):
+            await self.middleware(self.flaky(10, retry_after=0), None, SendMessage(chat_id=1, text="x"))
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual((self.scheduler.retries, self.scheduler.sent), (2, 0))
+
+
+class CodecTests(SimpleTestCase):
+    options = ["Чай", "Кофе", "Какао"]
+
+    def test_round_trip(self):
+        tag = codec.options_tag(self.options)
+        mask = codec.mask_of(self.options, ["Чай", "Какао"])
+        for payload in (
+            codec.MultiPayload(question_id=123456, tag=tag, mask=mask, action=codec.TOGGLE, index=1),
+            codec.MultiPayload(question_id=7, tag=tag, mask=mask, action=codec.DONE),
+            codec.MultiPayload(question_id=7, tag=tag, mask=0, action=codec.SKIP),
+        ):
+            self.assertEqual(codec.decode(payload.encode()), payload)
+        toggled = codec.MultiPayload(question_id=7, tag=tag, mask=mask, action=codec.TOGGLE, index=1).toggled()
+        self.assertEqual(codec.MultiPayload(7, tag, toggled, codec.DONE).chosen(self.options), self.options)
+
+    def test_encode_rejects_long_data(self):
+        payload = codec.MultiPayload(question_id=1, tag="x" * 60, mask=0, action=codec.DONE)
+        with self.assertRaises(ValueError):
+            payload.encode()
+
+    def test_decode_rejects_bad_payloads(self):
+        for data in (None, "", "ans:1:2", "m2:1:ab:0:d", "m1:1:ab:0", "m1:1:ab:0:d:x",
+                     "m1:1:ab:0:x", "m1:1:ab:0:t", "m1:1:ab:-:d", "m1:!:ab:0:d"):
+            with self.subTest(data=data):
+                self.assertIsNone(codec.decode(data))
+
+
+class PerUserMailboxTests(SimpleTestCase):
+    def setUp(self):
+        self.log = []
+
+    async def handler(self, event, data):
+        user = data["event_from_user"].id
+        self.log.append(("start", user, event.update_id))
+        await asyncio.sleep(0.01)
+        self.log.append(("end", user, event.update_id))
+
+    def deliver(self, mailbox: PerUserMailbox, user_id: int, update_id: int):
+        return mailbox(self.handler, SimpleNamespace(update_id=update_id), {"event_from_user": SimpleNamespace(id=user_id)})
+
+    async def test_user_order_kept_users_in_parallel(self):
+        mailbox = PerUserMailbox()
+        await asyncio.gather(*(self.deliver(mailbox, user, n) for n in (1, 2, 3) for user in (1, 2)))
+        for user in (1, 2):
+            own = [(kind, n) for kind, u, n in self.log if u == user]
+            self.assertEqual(own, [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)])
+        # пока первый апдейт пользователя 1 в работе, второй пользователь уже начал
+        self.assertLess(self.log.index(("start", 2, 1)), self.log.index(("end", 1, 1)))
+        self.assertEqual(mailbox.stats()["active_users"], 0)
+
+    async def test_overflow_is_shed(self):
+        mailbox = PerUserMailbox(max_depth=2)
+        await asyncio.gather(*(self.deliver(mailbox, 1, n) for n in range(5)))
+        self.assertEqual([n for kind, _, n in self.log if kind == "start"], [0, 1])
+        self.assertEqual((mailbox.processed, mailbox.shed), (2, 3))
@@ -0,0 +1,97 @@
+# tgbot/codec.py
+"""
+Компактный callback_data для мультивыбора (one_of_some).
+
+Формат v1:  m1:<qid>:<tag>:<mask>:<action><index>
+  qid    — id вопроса (base36)
+  tag    — отпечаток списка вариантов (crc32, base36): если варианты
+           поменяли в админке, старые кнопки распознаются как устаревшие
+  mask   — битовая маска выбранных вариантов (base36), бит i = вариант i
+  action — t (переключить вариант index), d (готово), s (пропустить)
+
+Текущий выбор едет в самой кнопке, поэтому нажатие обрабатывается по
+payload и закэшированному списку вариантов — без обращения к БД, а длина
+не зависит от текста вариантов (лимит Telegram — 64 байта).
+"""
+import zlib
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence, TypeVar
+
+PREFIX = "m1"
+MAX_CALLBACK_BYTES = 64
+
+TOGGLE = "t"
+DONE = "d"
+SKIP = "s"
+ACTIONS = (TOGGLE, DONE, SKIP)
+
+T = TypeVar("T")
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to36(n: int) -> str:
+    if n < 0:
+        raise ValueError("отрицательное число")
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = _DIGITS[r] + out
+        if not n:
+            return out
+
+
+def from36(s: str) -> int:
+    return int(s, 36)
+
+
+def options_tag(options: Sequence[str]) -> str:
+    return to36(zlib.crc32("\x1f".join(options).encode("utf-8")) % 36 ** 4)
+
+
+@dataclass(frozen=True)
+class MultiPayload:
+    question_id: int
+    tag: str
+    mask: int
+    action: str
+    index: int = 0
+
+    def encode(self) -> str:
+        tail = f"{self.action}{to36(self.index)}" if self.action == TOGGLE else self.action
+        data = f"{PREFIX}:{to36(self.question_id)}:{self.tag}:{to36(self.mask)}:{tail}"
+        if len(data.encode("ascii")) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+        return data
+
+    def chosen(self, options: Sequence[T]) -> List[T]:
+        return [opt for i, opt in enumerate(options) if self.mask >> i & 1]
+
+    def toggled(self) -> int:
+        return self.mask ^ (1 << self.index)
+
+
+def decode(data: str) -> Optional[MultiPayload]:
+    """None — не наш формат или битые данные."""
+    parts = (data or "").split(":")
+    if len(parts) != 5 or parts[0] != PREFIX:
+        return None
+    _, qid, tag, mask, tail = parts
+    action, index = tail[:1], tail[1:]
+    if action not in ACTIONS:
+        return None
+    try:
+        return MultiPayload(
+            question_id=from36(qid),
+            tag=tag,
+            mask=from36(mask),
+            action=action,
+            index=from36(index) if action == TOGGLE else 0,
+        )
+    except ValueError:
+        return None
+
+
+def mask_of(options: Sequence[str], chosen: Iterable[str]) -> int:
+    chosen = set(chosen)
+    return sum(1 << i for i, opt in enumerate(options) if opt in chosen)
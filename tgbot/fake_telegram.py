@@ -0,0 +1,147 @@
+# tgbot/fake_telegram.py
+"""
+Фейковый Telegram для локальной проверки вебхук-режима.
+
+Поднимает Bot API-заглушку (на неё указывает TELEGRAM_API_URL воркеров)
+и шлёт в вебхук апдейты от N пользователей так, как это делает Telegram:
+POST с секретом, по одному апдейту на запрос, с повтором на не-200.
+
+    # терминал 1
+    TELEGRAM_API_URL=http://127.0.0.1:8081 WEBHOOK_SECRET=s BOT_WORKERS=4 python -m tgbot.webhook
+    # терминал 2
+    python -m tgbot.fake_telegram --webhook http://127.0.0.1:8080/tg/webhook --secret s --users 50 --updates 20
+
+В конце печатает, сколько апдейтов доставлено и какие методы Bot API
+вызывал бот. Порядок: апдейты одного пользователя шлются последовательно
+(как у Telegram), разные пользователи — параллельно.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, web
+
+from tgbot.webhook import SECRET_HEADER
+
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+
+
+def _fake_message(params: dict) -> dict:
+    chat_id = params.get("chat_id")
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        chat_id = 0
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": params.get("text") or params.get("caption") or "",
+    }
+
+
+class FakeBotApi:
+    """Отвечает ok на любой метод; send*/edit*/copy* возвращают Message."""
+
+    def __init__(self):
+        self.calls: Counter = Counter()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type.startswith("multipart/"):
+            params = {k: v for k, v in (await request.post()).items() if isinstance(v, str)}
+        else:
+            params = dict(await request.post())
+        lowered = method.lower()
+        if lowered.startswith(("send", "copy", "forward")) or (
+            lowered.startswith("edit") and "inline_message_id" not in params
+        ):
+            result = _fake_message(params)
+        elif lowered == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+def _text_update(user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def _post(session: ClientSession, url: str, secret: str, update: dict, stats: Counter) -> None:
+    headers = {SECRET_HEADER: secret} if secret else {}
+    for delay in (0, 0.5, 1, 2, 4):  # Telegram повторяет неуспешную доставку
+        await asyncio.sleep(delay)
+        try:
+            async with session.post(url, data=json.dumps(update), headers=headers) as resp:
+                if resp.status == 200:
+                    stats["delivered"] += 1
+                    return
+                stats[f"http_{resp.status}"] += 1
+        except OSError:
+            stats["conn_error"] += 1
+    stats["lost"] += 1
+
+
+async def _user_flow(session, url, secret, user_id, updates, stats) -> None:
+    texts = ["/start", "/surveys"] + [f"ответ {i}" for i in range(max(0, updates - 2))]
+    for text in texts[:updates]:
+        await _post(session, url, secret, _text_update(user_id, text), stats)
+
+
+async def run(args) -> None:
+    api = FakeBotApi()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.api_host, args.api_port).start()
+    stats: Counter = Counter()
+    started = time.monotonic()
+    try:
+        async with ClientSession() as session:
+            await asyncio.gather(*[
+                _user_flow(session, args.webhook, args.secret, 100_000 + u, args.updates, stats)
+                for u in range(args.users)
+            ])
+        took = time.monotonic() - started
+        # даём воркерам доотвечать
+        await asyncio.sleep(args.settle)
+    finally:
+        await runner.cleanup()
+    print(f"апдейтов: {dict(stats)} за {took:.2f} с ({stats['delivered'] / took:.0f}/с)")
+    print(f"вызовы Bot API: {dict(api.calls)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/tg/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=10, help="апдейтов на пользователя")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--settle", type=float, default=3.0, help="сколько ждать ответов бота в конце, с")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# tgbot/middlewares.py
+"""Outer-middleware диспетчера (dp.update.outer_middleware)."""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+class DropDuplicateUpdates(BaseMiddleware):
+    """
+    Отбрасывает повторно доставленные апдейты (тот же update_id) до хендлеров,
+    то есть до любого обращения к БД. Telegram повторяет апдейт, если не
+    дождался ответа вебхука; при поллинге — после рестарта до подтверждения offset.
+    """
+
+    def __init__(self, maxlen: int = 10_000):
+        self.maxlen = maxlen
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self.dropped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if update_id in self._seen:
+            self.dropped += 1
+            logger.info("повтор апдейта %s пропущен", update_id)
+            return None
+        self._seen[update_id] = None
+        if len(self._seen) > self.maxlen:
+            self._seen.popitem(last=False)
+        return await handler(event, data)
+
+
+class _Mailbox:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0  # обрабатывается + ждут очереди
+
+
+class PerUserMailbox(BaseMiddleware):
+    """
+    Апдейты одного пользователя обрабатываются строго по очереди, разных
+    пользователей — параллельно. Так быстрый клик по варианту и «Готово»
+    не гоняются друг с другом и с записью ответа.
+
+    max_depth — сколько апдейтов пользователя может стоять в очереди;
+    всё сверх этого отбрасывается (защита от спама кнопками).
+    """
+
+    def __init__(self, max_depth: int = 10):
+        self.max_depth = max_depth
+        self._boxes: Dict[int, _Mailbox] = {}
+        self.processed = 0
+        self.shed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        box = self._boxes.get(user.id)
+        if box is None:
+            box = self._boxes[user.id] = _Mailbox()
+        if box.depth >= self.max_depth:
+            self.shed += 1
+            logger.warning("очередь пользователя %s переполнена, апдейт %s отброшен", user.id, event.update_id)
+            return None
+
+        box.depth += 1
+        queued_at = time.monotonic()
+        try:
+            async with box.lock:
+                wait = time.monotonic() - queued_at
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+                self.processed += 1
+                return await handler(event, data)
+        finally:
+            box.depth -= 1
+            if box.depth == 0:
+                self._boxes.pop(user.id, None)
+
+    def stats(self) -> dict:
+        depths = [b.depth for b in self._boxes.values()]
+        processed = self.processed
+        return {
+            "active_users": len(depths),
+            "max_depth": max(depths, default=0),
+            "queued": sum(d - 1 for d in depths),
+            "processed": processed,
+            "shed": self.shed,
+            "wait_avg_ms": round(self.wait_total / processed * 1000, 2) if processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+    def reset_max(self) -> None:
+        self.wait_max = 0.0
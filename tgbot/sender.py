@@ -0,0 +1,214 @@
+# tgbot/sender.py
+"""
+Планировщик исходящих запросов к Telegram.
+
+Все вызовы бота идут через сессию aiogram, поэтому планировщик подключён
+как request-middleware (bot.session.middleware): любой msg.answer /
+answer_photo / edit_* сначала получает токен, потом уходит в API.
+
+  * глобальное ведро — SEND_GLOBAL_RATE сообщений/с на весь бот;
+  * ведро на чат — SEND_PER_CHAT_RATE сообщений/с (с запасом SEND_PER_CHAT_BURST);
+  * очередь с приоритетами: интерактивные ответы идут раньше массовых
+    рассылок (with bulk_priority(): ...);
+  * 429 (TelegramRetryAfter) — чат ставится на паузу на retry_after,
+    запрос повторяется до SEND_MAX_RETRIES раз;
+  * stats(): глубина очереди, задержка в очереди и время отправки.
+"""
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 10
+
+send_priority: contextvars.ContextVar[int] = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+# методы, на которые действуют лимиты Telegram на отправку сообщений
+LIMITED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+
+
+@contextlib.contextmanager
+def bulk_priority():
+    """Все отправки внутри блока — с низким приоритетом (рассылки, напоминания)."""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """Ведро с виртуальным временем: reserve() возвращает, сколько ждать до своего токена."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до свободного токена (без резервирования)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        if self._tokens < 1:
+            wait = max(wait, (1 - self._tokens) / self.rate)
+        return wait
+
+    def reserve(self) -> float:
+        """Занять токен (можно уйти в минус) и вернуть задержку до него."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        self._tokens -= 1
+        if self._tokens < 0:
+            wait = max(wait, -self._tokens / self.rate)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle_since(self) -> float:
+        return self._updated
+
+
+class SendScheduler:
+    def __init__(self, global_rate: float = 30, per_chat_rate: float = 1, per_chat_burst: float = 3,
+                 max_retries: int = 3):
+        # доля воркера может быть меньше 1/с, а ведро меньше токена не выдаст ни одного
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.max_retries = max_retries
+        self._chats: Dict[int, TokenBucket] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        # метрики
+        self.sent = 0
+        self.retries = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                self._drop_idle_chats()
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    def _drop_idle_chats(self) -> None:
+        border = time.monotonic() - 60
+        for chat_id in [c for c, b in self._chats.items() if b.idle_since < border]:
+            del self._chats[chat_id]
+
+    def _ensure_pump(self) -> None:
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self) -> None:
+        """Раздаёт глобальные токены ожидающим — по приоритету, затем по порядку."""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.global_bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._heap)
+            if fut.done():  # отправитель отменён
+                continue
+            self.global_bucket.reserve()
+            fut.set_result(None)
+
+    async def acquire(self, chat_id: Optional[int], priority: int) -> None:
+        if chat_id is not None:
+            wait = self._chat_bucket(chat_id).reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        self._ensure_pump()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        self._wakeup.set()
+        await fut
+
+    def pause_chat(self, chat_id: Optional[int], seconds: float) -> None:
+        if chat_id is None:
+            self.global_bucket.pause(seconds)
+        else:
+            self._chat_bucket(chat_id).pause(seconds)
+
+    def record(self, queue_wait: float, latency: float) -> None:
+        self.sent += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def stats(self) -> dict:
+        sent = self.sent
+        return {
+            "queue_depth": len(self._heap),
+            "chats": len(self._chats),
+            "sent": sent,
+            "retries": self.retries,
+            "queue_wait_avg_ms": round(self.queue_wait_total / sent * 1000, 2) if sent else 0.0,
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 2),
+            "send_latency_avg_ms": round(self.latency_total / sent * 1000, 2) if sent else 0.0,
+            "send_latency_max_ms": round(self.latency_max * 1000, 2),
+        }
+
+    def reset_max(self) -> None:
+        self.queue_wait_max = 0.0
+        self.latency_max = 0.0
+
+
+class SendSchedulerMiddleware(BaseRequestMiddleware):
+    def __init__(self, scheduler: SendScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(self, make_request, bot, method):
+        if not type(method).__name__.startswith(LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        chat_key = chat_id if isinstance(chat_id, int) else None
+        priority = send_priority.get()
+        for attempt in range(self.scheduler.max_retries + 1):
+            queued_at = time.monotonic()
+            await self.scheduler.acquire(chat_key, priority)
+            started = time.monotonic()
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.scheduler.max_retries:
+                    raise
+                self.scheduler.retries += 1
+                logger.warning("429 для чата %s, пауза %s с", chat_id, e.retry_after)
+                self.scheduler.pause_chat(chat_key, e.retry_after)
+                continue
+            self.scheduler.record(started - queued_at, time.monotonic() - started)
+            return response
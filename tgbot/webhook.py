@@ -0,0 +1,223 @@
+# tgbot/webhook.py
+"""
+Вебхук-режим: приём апдейтов (aiohttp) + N процессов-воркеров бота.
+
+    python -m tgbot.webhook
+
+Ингресс не трогает Django и БД: принимает POST от Telegram, проверяет
+секрет, достаёт id пользователя и кладёт сырой апдейт в очередь воркера
+jump_hash(user_id, N). Пользователь всегда попадает в один и тот же воркер,
+а внутри воркера порядок держит PerUserMailbox — порядок апдейтов одного
+пользователя сохраняется, разные пользователи обрабатываются на N ядрах.
+
+Остановка (SIGTERM/SIGINT): сервер перестаёт принимать запросы, воркерам
+уходит «стоп», каждый дорабатывает принятые апдейты, досылает outbox и
+кэши в БД и выходит (WEBHOOK_DRAIN_TIMEOUT). Вебхук при этом не снимается:
+пока идёт деплой, Telegram копит апдейты у себя и дошлёт их новому инстансу.
+
+Настройки (env):
+  WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH — где слушать;
+  WEBHOOK_URL     — публичный адрес; если задан, вызываем setWebhook;
+  WEBHOOK_SECRET  — X-Telegram-Bot-Api-Secret-Token;
+  BOT_WORKERS     — число воркеров (по умолчанию — число ядер); общие на
+                    бота лимиты SEND_GLOBAL_RATE и BROADCAST_RATE делятся
+                    между воркерами поровну;
+  WEBHOOK_QUEUE_SIZE — очередь на воркер; переполнена — отвечаем 503,
+                       и Telegram повторит апдейт позже.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+from typing import AsyncIterator, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+STOP = None  # сигнал воркеру: апдейтов больше не будет
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Jump consistent hash (Lamping, Veach): при смене N переезжает ~1/N пользователей."""
+    key &= 0xFFFFFFFFFFFFFFFF
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def update_user_id(update: dict) -> int:
+    """Ключ шардирования: отправитель, иначе чат, иначе сам update_id."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+# ---------------- воркер ----------------
+async def _read_queue(q: "mp.Queue") -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    parent = mp.parent_process()
+    while True:
+        try:
+            raw = await loop.run_in_executor(None, q.get, True, 1.0)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning("ингресс завершился, воркер останавливается")
+                return
+            continue
+        if raw is STOP:
+            return
+        yield raw
+
+
+def _worker_main(index: int, workers: int, q: "mp.Queue") -> None:
+    # Ctrl+C получает вся группа процессов — останавливает воркер только ингресс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ["BOT_WORKER_INDEX"] = str(index)
+    os.environ["BOT_WORKERS"] = str(workers)  # бот делит на воркеров общие лимиты отправки
+    import bot  # Django и aiogram поднимаются уже в процессе воркера
+
+    asyncio.run(bot.run_worker(_read_queue(q)))
+
+
+# ---------------- ингресс ----------------
+class Ingress:
+    def __init__(self, workers: int, queue_size: int = 10_000, secret: Optional[str] = None):
+        self.ctx = mp.get_context("spawn")
+        self.secret = secret
+        self.queues: List["mp.Queue"] = [self.ctx.Queue(queue_size) for _ in range(workers)]
+        self.procs: List[Optional[mp.Process]] = [None] * workers
+        self.draining = False
+        self.accepted = 0
+        self.rejected = 0
+        self._watch_task: Optional[asyncio.Task] = None
+
+    def _spawn(self, index: int) -> None:
+        proc = self.ctx.Process(target=_worker_main, args=(index, len(self.queues), self.queues[index]), name=f"bot-worker-{index}")
+        proc.start()
+        self.procs[index] = proc
+        logger.info("воркер %s запущен (pid %s)", index, proc.pid)
+
+    async def _watch(self) -> None:
+        """Упавший воркер перезапускается с той же очередью — его пользователи не теряются."""
+        while not self.draining:
+            await asyncio.sleep(1)
+            for i, proc in enumerate(self.procs):
+                if not self.draining and proc is not None and not proc.is_alive():
+                    logger.error("воркер %s упал (код %s), перезапуск", i, proc.exitcode)
+                    self._spawn(i)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        raw = await request.read()
+        if self.draining:  # проверка после await: «стоп» воркеру уже мог уйти
+            return web.Response(status=503)
+        try:
+            user_id = update_user_id(json.loads(raw))
+        except (ValueError, AttributeError):
+            return web.Response(status=400)
+        try:
+            self.queues[jump_hash(user_id, len(self.queues))].put_nowait(raw)
+        except queue.Full:
+            self.rejected += 1
+            return web.Response(status=503)
+        self.accepted += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        alive = [p is not None and p.is_alive() for p in self.procs]
+        body = {
+            "draining": self.draining,
+            "workers_alive": sum(alive),
+            "workers": len(alive),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "queues": [q.qsize() for q in self.queues],
+        }
+        ok = all(alive) and not self.draining
+        return web.json_response(body, status=200 if ok else 503)
+
+    async def on_startup(self, app: web.Application) -> None:
+        for i in range(len(self.queues)):
+            self._spawn(i)
+        self._watch_task = asyncio.create_task(self._watch())
+        url = os.getenv("WEBHOOK_URL")
+        if url:
+            await _set_webhook(url, self.secret)
+
+    async def on_shutdown(self, app: web.Application) -> None:
+        """Дренаж: новых апдейтов не берём, воркеры дорабатывают очередь и выходят."""
+        self.draining = True
+        if self._watch_task:
+            self._watch_task.cancel()
+        for q in self.queues:
+            q.put(STOP)
+        timeout = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for i, proc in enumerate(self.procs):
+            if proc is None:
+                continue
+            await loop.run_in_executor(None, proc.join, max(0.0, deadline - loop.time()))
+            if proc.is_alive():
+                logger.error("воркер %s не успел доработать за %s с, завершаем", i, timeout)
+                proc.terminate()
+                await loop.run_in_executor(None, proc.join, 5)
+        logger.info("ингресс остановлен: принято %s, отклонено %s", self.accepted, self.rejected)
+
+
+async def _set_webhook(url: str, secret: Optional[str]) -> None:
+    from aiogram import Bot
+
+    bot = Bot(os.environ["BOT_TOKEN"])
+    try:
+        await bot.set_webhook(url, secret_token=secret or None, allowed_updates=["message", "callback_query"])
+        logger.info("вебхук установлен: %s", url)
+    finally:
+        await bot.session.close()
+
+
+def build_app(ingress: Ingress, path: str) -> web.Application:
+    app = web.Application()
+    app.router.add_post(path, ingress.handle_update)
+    app.router.add_get("/healthz", ingress.handle_health)
+    app.on_startup.append(ingress.on_startup)
+    app.on_shutdown.append(ingress.on_shutdown)
+    return app
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    if not os.getenv("BOT_TOKEN"):
+        raise RuntimeError("Set BOT_TOKEN in environment (BOT_TOKEN=...)")
+    ingress = Ingress(
+        workers=int(os.getenv("BOT_WORKERS", str(os.cpu_count() or 1))),
+        queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+        secret=os.getenv("WEBHOOK_SECRET"),
+    )
+    app = build_app(ingress, os.getenv("WEBHOOK_PATH", "/tg/webhook"))
+    web.run_app(
+        app,
+        host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        shutdown_timeout=5,
+    )
+
+
+if __name__ == "__main__":
+    main()